@@ -1,79 +1,161 @@
-# add_to_database.py
+# add_to_database.py (Ingesta masiva en paralelo)
+import argparse
+import glob
 import os
 import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
-import chromadb
-from chromadb.config import \
-    Settings  # <-- IMPORTANTE: Asegúrate de que esta línea exista
-from chromadb.utils import embedding_functions
+from backend_controller import RAGSystem, is_streamable_pdf, prepare_document
+from config import (BULK_IO_THREADS, BULK_PROCESS_WORKERS, SUPPORTED_EXTENSIONS,
+                    URL_FETCH_WORKERS)
+import telemetry
+from web_fetcher import get_web_fetcher
 
-from chunker import chunk_text
-from extractor import extract_text_from_document
-from gemini_provider import setup_gemini
-from text_scraper import extract_text_from_url
 
-COLLECTION_NAME = "personal_rag_collection"
+def is_url(source: str) -> bool:
+    return source.startswith('http://') or source.startswith('https://')
+
+
+def expand_sources(inputs: list[str], url_list: str | None = None, sitemaps: list[str] = ()) -> list[str]:
+    """
+    Convierte los argumentos de la línea de comandos en una lista de fuentes:
+    directorios (recorridos recursivamente), patrones glob, archivos y URLs, más las
+    páginas que enumeran los sitemaps (o listas de enlaces en texto plano) indicados.
+    """
+    sources = []
+    for item in inputs:
+        if is_url(item):
+            sources.append(item)
+        elif os.path.isdir(item):
+            for root, _, files in os.walk(item):
+                sources.extend(os.path.join(root, f) for f in sorted(files) if f.lower().endswith(SUPPORTED_EXTENSIONS))
+        elif os.path.isfile(item):
+            sources.append(item)
+        else:
+            matches = [m for m in sorted(glob.glob(item, recursive=True)) if os.path.isfile(m)]
+            if not matches: print(f"⚠️ La fuente '{item}' no es una URL, un archivo ni un patrón con coincidencias.")
+            sources.extend(matches)
+    if url_list:
+        with open(url_list, 'r', encoding='utf-8') as f:
+            sources.extend(line.strip() for line in f if line.strip() and not line.startswith('#'))
+    for sitemap in sitemaps:
+        pages = get_web_fetcher().expand_url_list(sitemap)
+        if not pages: print(f"⚠️ El sitemap '{sitemap}' no enumera ninguna página.")
+        sources.extend(pages)
+    # Eliminamos duplicados conservando el orden.
+    return list(dict.fromkeys(sources))
+
+
+def ingest_sources(rag_system: RAGSystem, sources: list[str], process_workers: int = BULK_PROCESS_WORKERS,
+                   io_threads: int = BULK_IO_THREADS, force: bool = False) -> dict[str, dict]:
+    """
+    Ingesta un lote de fuentes reutilizando las etapas del pipeline de RAGSystem:
+    la descarga de las URLs en un pool de hilos (sesión HTTP compartida y caché condicional),
+    la extracción y limpieza (CPU) en un pool de procesos y el Índice Maestro y el
+    embedding (llamadas remotas) en un pool de hilos acotado. Cada fuente guarda su punto de
+    control en la cola de trabajos: si la ejecución se corta, la siguiente no repite los lotes ya embebidos.
+    """
+    results = {}
+    # Limitamos los documentos preparados en memoria que esperan a un hilo de E/S.
+    in_flight = threading.BoundedSemaphore(io_threads * 2)
+
+    io_futures = []
+    # El pool de hilos envuelve al de procesos: al cerrarse este último ya se han encolado
+    # todas las tareas de E/S, y el pool de hilos espera a que terminen.
+    with ThreadPoolExecutor(max_workers=io_threads) as io_pool, ProcessPoolExecutor(max_workers=process_workers, initializer=telemetry.mark_worker_process) as cpu_pool:
+
+        def on_prepared(source, fingerprint, cpu_future):
+            try:
+                prepared = cpu_future.result()
+            except Exception as e:
+                prepared = {"success": False, "message": f"❌ Error al extraer: {e}"}
+            io_futures.append((source, io_pool.submit(store, source, prepared, fingerprint)))
+
+        def store(source, prepared, fingerprint):
+            # Si la extracción falló no hay nada que reanudar: no se abre trabajo.
+            try:
+                if prepared is not None and not prepared["success"]: return prepared
+                return rag_system.store_bulk_source(source, fingerprint, prepared, force)
+            finally:
+                in_flight.release()
+
+        def submit_prepare(source, fingerprint, html=None):
+            cpu_future = cpu_pool.submit(prepare_document, source, html)
+            cpu_future.add_done_callback(lambda f, s=source, fp=fingerprint: on_prepared(s, fp, f))
+
+        def fetch_url(source):
+            # Descarga condicional en un hilo (las URLs no esperan unas a otras); sus validadores son la huella.
+            try:
+                page = get_web_fetcher().fetch(source)
+                unchanged_result, fingerprint = rag_system.check_source_unchanged(source, force, page.validators)
+                if unchanged_result is None:
+                    submit_prepare(source, fingerprint, page.text)
+                    return
+                results[source] = unchanged_result
+            except Exception as e:
+                results[source] = {"success": False, "message": f"❌ Error al descargar: {e}"}
+            in_flight.release()
+
+        # El pool de descargas se cierra antes que el de procesos: todas las extracciones ya están encoladas.
+        with ThreadPoolExecutor(max_workers=URL_FETCH_WORKERS, thread_name_prefix="descarga") as fetch_pool:
+            for source in sources:
+                if is_url(source):
+                    in_flight.acquire()
+                    fetch_pool.submit(fetch_url, source)
+                    continue
+                try:
+                    unchanged_result, fingerprint = rag_system.check_source_unchanged(source, force)
+                except Exception as e:
+                    results[source] = {"success": False, "message": f"❌ Error al leer la fuente: {e}"}
+                    continue
+                if unchanged_result:
+                    results[source] = unchanged_result
+                    continue
+                in_flight.acquire()
+                if is_streamable_pdf(source):
+                    # Los PDFs se procesan en streaming: su extracción ya usa el pool de procesos de páginas.
+                    io_futures.append((source, io_pool.submit(store, source, None, fingerprint)))
+                    continue
+                submit_prepare(source, fingerprint)
+
+    for source, future in io_futures:
+        try:
+            results[source] = future.result()
+        except Exception as e:
+            results[source] = {"success": False, "message": f"❌ Error inesperado: {e}"}
+    return results
+
 
 def main():
-    if len(sys.argv) < 2:
-        print("Error: Debes proporcionar una fuente de datos.")
-        print("Uso: python add_to_database.py <URL_o_ruta_a_archivo>")
-        sys.exit(1)
-    
-    source = sys.argv[1]
-
-    try:
-        setup_gemini()
-        gemini_api_key = os.getenv("GEMINI_API_KEY")
-        google_ef = embedding_functions.GoogleGenerativeAiEmbeddingFunction(api_key=gemini_api_key)
-    except ValueError as e:
-        print(f"Error de configuración: {e}")
-        exit()
-
-    # <-- IMPORTANTE: Esta línea deshabilita la telemetría que causa el error
-    client = chromadb.PersistentClient(path="bd_vectorial")
-    
-    collection = client.get_or_create_collection(
-        name=COLLECTION_NAME,
-        embedding_function=google_ef
-    )
-    print(f"✅ Conectado a la colección '{COLLECTION_NAME}'.")
-
-    print(f"Procesando fuente: {source}...")
-    extracted_text = ""
-    if source.startswith('http://') or source.startswith('https://'):
-        extracted_text = extract_text_from_url(source)
-    elif os.path.isfile(source):
-        extracted_text = extract_text_from_document(source)
-    else:
-        print(f"❌ Error: La fuente '{source}' no es una URL válida ni un archivo existente.")
-        sys.exit(1)
+    parser = argparse.ArgumentParser(description="Ingesta masiva de documentos en la biblioteca RAG.")
+    parser.add_argument("sources", nargs="*", help="Directorios, archivos, patrones glob o URLs.")
+    parser.add_argument("--urls", help="Archivo de texto con una URL por línea.")
+    parser.add_argument("--sitemap", action="append", default=[], help="URL de un sitemap (o de una lista de enlaces) cuyas páginas se ingieren. Se puede repetir.")
+    parser.add_argument("--procesos", type=int, default=BULK_PROCESS_WORKERS, help="Procesos para extracción y limpieza.")
+    parser.add_argument("--hilos", type=int, default=BULK_IO_THREADS, help="Hilos para Índice Maestro y embedding.")
+    parser.add_argument("--forzar", action="store_true", help="Reprocesar aunque la fuente no haya cambiado.")
+    args = parser.parse_args()
 
-    if not extracted_text:
-        print(f"❌ No se pudo extraer texto de la fuente '{source}'.")
+    sources = expand_sources(args.sources, args.urls, args.sitemap)
+    if not sources:
+        parser.print_usage()
+        print("Error: Debes proporcionar al menos una fuente de datos.")
         sys.exit(1)
 
-    print("Dividiendo el texto en fragmentos (chunks)...")
-    chunks = chunk_text(extracted_text)
+    rag_system = RAGSystem()
+    print(f"Procesando {len(sources)} fuentes con {args.procesos} procesos y {args.hilos} hilos...")
+    start = time.perf_counter()
+    results = ingest_sources(rag_system, sources, args.procesos, args.hilos, args.forzar)
+    elapsed = time.perf_counter() - start
+
+    failed = {s: r for s, r in results.items() if not r["success"]}
+    unchanged = sum(1 for r in results.values() if r.get("unchanged"))
+    for source, result in failed.items(): print(f"❌ {source}: {result['message']}")
+    print(f"✅ {len(results) - len(failed)} fuentes correctas ({unchanged} sin cambios), {len(failed)} con errores, en {elapsed:.1f} s.")
+    sys.exit(1 if failed else 0)
 
-    if not chunks:
-        print("❌ El texto extraído estaba vacío o no se pudo dividir.")
-        sys.exit(1)
-        
-    base_id = os.path.basename(source)
-    ids = [f"{base_id}_{i}" for i in range(len(chunks))]
-    metadatas = [{'source': source} for _ in range(len(chunks))]
-
-    print(f"Añadiendo {len(chunks)} fragmentos a la base de datos vectorial...")
-    try:
-        collection.add(
-            documents=chunks,
-            metadatas=metadatas,
-            ids=ids
-        )
-        print(f"✅ Documento '{source}' procesado y añadido exitosamente a la base de datos.")
-    except Exception as e:
-        print(f"❌ Ocurrió un error al añadir los documentos a ChromaDB: {e}")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -1,27 +1,271 @@
 # analyzer.py (Versión Final - Índice Maestro Holístico)
+import hashlib
 import json
+import os
 import re
+import sqlite3
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 
-from gemini_provider import setup_gemini
+from config import (MASTER_INDEX_CONCURRENCY, MASTER_INDEX_HIERARCHICAL,
+                    MASTER_INDEX_SECTION_CHARS, SECTION_SUMMARY_CACHE_PATH)
+from providers import get_generation_model
+import telemetry
+
+# Límite seguro para no exceder la cuota de tokens por minuto en una sola llamada.
+# 200,000 caracteres son ~50,000 tokens, muy por debajo del límite de GENERATION_TPM_LIMIT (250,000 TPM).
+# Esto es suficiente para la mayoría de documentos o las partes más importantes.
+MAX_CHARS_FOR_ANALYSIS = 200000
+
+# Versión de los prompts de sección: al cambiarlos, los resúmenes cacheados dejan de valer.
+SECTION_PROMPT_VERSION = 1
+
+_section_pool = None
+_section_pool_lock = threading.Lock()
+_summary_cache = None
+
+
+def _generate_json(prompt: str, what: str) -> dict | None:
+    """Llama a la IA y extrae el bloque JSON de la respuesta. Devuelve None si falla."""
+    try:
+        response = get_generation_model().generate_content(prompt)
+        json_match = re.search(r'```json\s*([\s\S]*?)\s*```', response.text)
+        if not json_match:
+            print(f"  -> ⚠️ Analyzer: No se encontró un bloque JSON en la respuesta de la IA ({what}).")
+            return None
+        result = json.loads(json_match.group(1))
+        return result if isinstance(result, dict) else None
+    except Exception as e:
+        print(f"  -> ❌ Analyzer: Error inesperado durante la generación de {what}: {e}")
+        return None
+
+
+class SectionSummaryCache:
+    """Resúmenes de sección en SQLite, por hash del texto de la sección, modelo y versión del prompt."""
+
+    def __init__(self, path: str):
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS section_summaries (
+                key TEXT PRIMARY KEY,
+                summary TEXT NOT NULL,
+                created_at REAL NOT NULL
+            )""")
+        self._conn.commit()
+
+    @staticmethod
+    def key_for(text: str) -> str:
+        payload = f"{get_generation_model().model_name}\n{SECTION_PROMPT_VERSION}\n{text}"
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, text: str) -> dict | None:
+        with self._lock:
+            row = self._conn.execute("SELECT summary FROM section_summaries WHERE key = ?", (self.key_for(text),)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put(self, text: str, summary: dict):
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO section_summaries VALUES (?, ?, ?)",
+                               (self.key_for(text), json.dumps(summary, ensure_ascii=False), time.time()))
+            self._conn.commit()
+
+
+def _get_section_pool() -> ThreadPoolExecutor:
+    # Pool compartido por todos los documentos: la concurrencia hacia la IA es global al proceso.
+    global _section_pool, _summary_cache
+    with _section_pool_lock:
+        if _section_pool is None:
+            _section_pool = ThreadPoolExecutor(max_workers=MASTER_INDEX_CONCURRENCY)
+            _summary_cache = SectionSummaryCache(SECTION_SUMMARY_CACHE_PATH)
+        return _section_pool
+
+
+def split_into_sections(full_text: str, section_chars: int = MASTER_INDEX_SECTION_CHARS) -> list[str]:
+    """Divide el texto en secciones de ~section_chars caracteres, cortando en límites de párrafo."""
+    sections, current, current_chars = [], [], 0
+    for paragraph in full_text.split("\n\n"):
+        if current and current_chars + len(paragraph) > section_chars:
+            sections.append("\n\n".join(current)); current, current_chars = [], 0
+        current.append(paragraph); current_chars += len(paragraph) + 2
+    if current: sections.append("\n\n".join(current))
+    return sections
+
+
+def summarize_section(section_text: str, position: int, filename: str) -> dict | None:
+    """Fase de mapa: resume una sección. Reutiliza el resumen cacheado si la sección no ha cambiado."""
+    cached = _summary_cache.get(section_text)
+    telemetry.increment("cache_requests", cache="resumenes_seccion", result="hit" if cached else "miss")
+    if cached:
+        return cached
+    prompt = f"""
+    Eres un Agente de Catalogación de IA. Vas a leer la sección {position + 1} de un documento largo.
+    Devuelve un JSON con:
+    - "titulo_seccion": el nombre del capítulo o sección principal que aparece en el texto (o un nombre descriptivo breve).
+    - "resumen": un resumen de 2-3 frases del contenido de la sección.
+    - "subsecciones": un mapa con los capítulos o apartados que empiezan en esta sección y un resumen de una frase de cada uno.
+    - "temas": de 3 a 5 conceptos clave.
+    - "titulo", "autor", "fecha_publicacion": los datos bibliográficos del documento si aparecen en esta sección.
+    Si un campo no se puede determinar, usa el valor "No disponible". NO inventes información.
+
+    ---
+    Nombre de Archivo (para contexto): "{filename}"
+    ---
+    Texto de la Sección:
+    "{section_text}"
+    ---
+
+    RESPUESTA JSON:
+    ```json
+    {{
+      "titulo_seccion": "...",
+      "resumen": "...",
+      "subsecciones": {{"Capítulo 1: Nombre": "Resumen de una frase."}},
+      "temas": ["tema1", "tema2"],
+      "titulo": "...",
+      "autor": "...",
+      "fecha_publicacion": "..."
+    }}
+    ```
+    """
+    summary = _generate_json(prompt, f"la sección {position + 1}")
+    if summary: _summary_cache.put(section_text, summary)
+    return summary
+
+
+def reduce_section_summaries(summaries: list[dict], filename: str) -> dict | None:
+    """Fase de reducción: fusiona los resúmenes de sección en un Índice Maestro con el esquema habitual."""
+    sections_json = json.dumps(summaries, ensure_ascii=False, indent=1)
+    prompt = f"""
+    Eres un Editor Senior y un Agente de Catalogación de IA. A partir de los resúmenes ordenados de todas
+    las secciones de un documento, crea su "Índice Maestro" en formato JSON.
+
+    PROCESO A SEGUIR:
+    1.  **Datos Bibliográficos:** Toma el título, autor(es) y fecha de publicación de los resúmenes (normalmente de los primeros).
+    2.  **Resumen Global:** Escribe un resumen de 3-5 frases que capture la tesis y el contenido principal del documento completo.
+    3.  **Índice Estructurado:** Une los capítulos/secciones de todos los resúmenes, en orden, en un mapa donde cada clave sea el nombre del capítulo/sección y el valor un resumen de una sola frase. Fusiona los capítulos repartidos entre varias secciones.
+    4.  **Temas Fundamentales:** Extrae de 5 a 7 'tags' que representen los conceptos clave del documento.
+
+    REGLAS IMPORTANTES:
+    - Si un campo no se puede determinar, usa el valor "No disponible". NO inventes información.
+    - El formato de salida DEBE ser un único bloque de código JSON válido.
+
+    ---
+    Nombre de Archivo (para contexto): "{filename}"
+    ---
+    Resúmenes de las Secciones ({len(summaries)}):
+    {sections_json}
+    ---
+
+    RESPUESTA JSON (Índice Maestro):
+    ```json
+    {{
+      "titulo": "...",
+      "autor": "...",
+      "fecha_publicacion": "...",
+      "resumen_global": "...",
+      "indice_estructurado": {{
+        "Capítulo 1: Nombre del Capítulo": "Resumen de una frase de este capítulo."
+      }},
+      "tags": ["tag1", "tag2", "tag3"]
+    }}
+    ```
+    """
+    telemetry.annotate(secciones_resumidas=len(summaries))
+    master_index = _generate_json(prompt, "la reducción del Índice Maestro")
+    return master_index or _merge_summaries_locally(summaries)
+
+
+def _merge_summaries_locally(summaries: list[dict]) -> dict:
+    """Índice Maestro de respaldo construido sin IA, si la llamada de reducción falla."""
+    print("  -> ⚠️ Analyzer: La reducción falló. Construyendo el Índice Maestro directamente de las secciones.")
+
+    def first_known(field):
+        return next((s[field] for s in summaries if s.get(field) and s[field] != "No disponible"), "No disponible")
+
+    structure = {}
+    for summary in summaries:
+        # La IA no siempre devuelve "subsecciones" como un mapa: si no lo es, la sección entra con su resumen.
+        subsections = summary.get("subsecciones")
+        if isinstance(subsections, dict) and subsections: structure.update(subsections)
+        else: structure[summary.get("titulo_seccion") or f"Sección {len(structure) + 1}"] = summary.get("resumen", "")
+    tags = Counter(str(tema) for s in summaries if isinstance(s.get("temas"), list) for tema in s["temas"])
+    return {"titulo": first_known("titulo"), "autor": first_known("autor"), "fecha_publicacion": first_known("fecha_publicacion"),
+            "resumen_global": " ".join(str(s.get("resumen") or "") for s in summaries[:3]).strip() or "No disponible",
+            "indice_estructurado": structure, "tags": [tag for tag, _ in tags.most_common(7)]}
+
+
+class MasterIndexBuilder:
+    """
+    Construye el Índice Maestro de un documento largo por mapa-reducción. El texto se le
+    entrega por partes (feed); cada vez que se completa una sección se resume en el pool
+    compartido mientras llegan las siguientes. finish() espera los resúmenes y los fusiona.
+    """
+
+    def __init__(self, filename: str, section_chars: int = MASTER_INDEX_SECTION_CHARS):
+        self.filename = filename
+        self.section_chars = section_chars
+        self._buffer, self._buffer_chars = [], 0
+        self._futures = []
+        # Secciones pendientes en memoria: si la IA va más lenta que la lectura, feed() espera.
+        self._pending = threading.BoundedSemaphore(MASTER_INDEX_CONCURRENCY * 2)
+
+    def feed(self, text: str):
+        self._buffer.append(text); self._buffer_chars += len(text)
+        if self._buffer_chars >= self.section_chars: self._submit_section()
+
+    def add_section(self, section_text: str):
+        """Encola una sección ya delimitada (p. ej. por split_into_sections)."""
+        self._submit_section()
+        self._buffer = [section_text]
+        self._submit_section()
+
+    def _submit_section(self):
+        if not self._buffer: return
+        section_text = "\n\n".join(self._buffer)
+        self._buffer, self._buffer_chars = [], 0
+        self._pending.acquire()
+        future = _get_section_pool().submit(summarize_section, section_text, len(self._futures), self.filename)
+        future.add_done_callback(lambda _: self._pending.release())
+        self._futures.append(future)
+
+    def bibliographic_data(self) -> dict:
+        """Resumen de la primera sección (con título, autor y fecha), sin esperar al resto."""
+        if not self._futures: self._submit_section()
+        return (self._futures[0].result() if self._futures else None) or {}
+
+    def finish(self) -> dict | None:
+        self._submit_section()
+        telemetry.annotate(secciones=len(self._futures))
+        summaries = [s for s in (f.result() for f in self._futures) if s]
+        if len(summaries) < len(self._futures):
+            print(f"  -> ⚠️ Analyzer: {len(self._futures) - len(summaries)} secciones no se pudieron resumir.")
+        if not summaries: return None
+        return reduce_section_summaries(summaries, self.filename)
 
-try:
-    models = setup_gemini()
-    generation_model = models["generation_model"]
-except Exception as e:
-    print(f"❌ ANALYZER: Error fatal al inicializar Gemini: {e}")
-    generation_model = None
 
 def create_master_index(full_text: str, filename: str) -> dict | None:
     """
     Analiza un documento de forma holística para crear un "Índice Maestro" detallado,
-    aprovechando una gran ventana de contexto.
+    aprovechando una gran ventana de contexto. Si el texto supera MAX_CHARS_FOR_ANALYSIS,
+    se construye de forma jerárquica (mapa de secciones + reducción).
     """
-    if not generation_model: return None
+    # El modelo se crea al primer uso (no al importar): así importar el módulo no requiere red.
+    try:
+        get_generation_model()
+    except Exception as e:
+        print(f"❌ ANALYZER: Error fatal al inicializar el modelo de generación: {e}")
+        return None
+    if MASTER_INDEX_HIERARCHICAL and len(full_text) > MAX_CHARS_FOR_ANALYSIS:
+        # Documento largo: resumimos todas sus secciones en paralelo en lugar de truncarlo.
+        builder = MasterIndexBuilder(filename)
+        for section in split_into_sections(full_text): builder.add_section(section)
+        return builder.finish()
 
-    # Límite seguro para no exceder la cuota de tokens por minuto en una sola llamada.
-    # 200,000 caracteres son ~50,000 tokens, muy por debajo del límite de 250,000 TPM.
-    # Esto es suficiente para la mayoría de documentos o las partes más importantes.
-    MAX_CHARS_FOR_ANALYSIS = 200000
     text_sample = full_text[:MAX_CHARS_FOR_ANALYSIS]
 
     prompt = f"""
@@ -60,21 +304,6 @@ def create_master_index(full_text: str, filename: str) -> dict | None:
     }}
     ```
     """
-    try:
-        print(f"  -> Analyzer: Enviando {len(text_sample)} caracteres a Gemini para generar el Índice Maestro...")
-        response = generation_model.generate_content(prompt)
-        
-        json_match = re.search(r'```json\s*([\s\S]*?)\s*```', response.text)
-        if not json_match:
-            print("  -> ⚠️ Analyzer: No se encontró un bloque JSON en la respuesta de la IA.")
-            return None
-
-        json_str = json_match.group(1)
-        analysis_result = json.loads(json_str)
-        
-        print("  -> ✅ Analyzer: Índice Maestro generado exitosamente.")
-        return analysis_result
-
-    except Exception as e:
-        print(f"  -> ❌ Analyzer: Error inesperado durante la generación del Índice Maestro: {e}")
-        return None
\ No newline at end of file
+    telemetry.annotate(caracteres_analizados=len(text_sample))
+    analysis_result = _generate_json(prompt, "el Índice Maestro")
+    return analysis_result
\ No newline at end of file
@@ -1,105 +1,680 @@
 # backend_controller.py (Arquitectura Rolls-Royce - Búsqueda y Lectura Corregidas)
+import asyncio
+import contextvars
+import functools
+import hashlib
+import itertools
 import json
 import os
+import queue
 import re
-
-import chromadb
-from chromadb.utils import embedding_functions
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 import analyzer
 # Importaciones de nuestros módulos
-from config import COLLECTION_NAME, DB_PATH, EMBEDDING_MODEL_NAME, PROMPTS_PATH
-from extractor import extract_text_from_document
-from gemini_provider import setup_gemini
-from text_cleaner import clean_and_normalize_text
-from text_scraper import extract_text_from_url
+from config import (ANSWER_CACHE_MAX_ENTRIES, ASYNC_EXECUTOR_WORKERS,
+                    COLLECTION_NAME, CONTEXT_TOKEN_BUDGET, DB_PATH,
+                    DOCUMENT_COLLECTION_NAME, EMBEDDING_CACHE_MAX_ENTRIES,
+                    EMBEDDING_CACHE_MAX_MB, EMBEDDING_CACHE_PATH,
+                    HISTORY_RECENT_MESSAGES,
+                    HISTORY_TOKEN_BUDGET, IN_MEMORY_VECTOR_SEARCH,
+                    INGEST_JOB_MAX_ATTEMPTS, INGEST_JOB_RETRY_SECONDS,
+                    INGEST_JOBS_DB_PATH, INGEST_WORKERS,
+                    LEXICAL_INDEX_PATH,
+                    LEXICAL_N_RESULTS, LIBRARY_ROUTING_TOP_N,
+                    MASTER_INDEX_HIERARCHICAL,
+                    METADATA_DB_PATH, MMR_CANDIDATES, MMR_LAMBDA,
+                    PDF_STREAMING,
+                    PIPELINE_QUEUE_SIZE, PLAN_CACHE_MAX_ENTRIES,
+                    PLAN_INDEX_TOKEN_BUDGET,
+                    PLANNER_DEADLINE_SECONDS, PROMPTS_PATH,
+                    QUANTIZED_DTYPE, QUANTIZED_RESCORE_FACTOR,
+                    QUANTIZED_STORE_PATH, QUERY_CACHE_TTL_SECONDS,
+                    RETRIEVAL_TOP_K, RRF_K, SPECULATIVE_RETRIEVAL,
+                    VECTOR_CACHE_MAX_DOCUMENTS, VECTOR_CACHE_MAX_MB,
+                    VECTOR_N_RESULTS, VECTOR_STORE)
+from chunker import chunk_pages
+from document_router import DocumentRouter
+from embedding_cache import CachedEmbeddingFunction, EmbeddingCache
+from extractor import extract_text_from_document, iter_pdf_pages
+from ingest_jobs import DONE, FAILED, IngestCheckpoint, IngestJobStore, IngestQueue
+from lexical_index import (BM25Index, LexicalIndexStore,
+                           reciprocal_rank_fusion)
+from metadata_store import MetadataStore
+from prompt_builder import PromptBuilder
+from providers import get_embedding_function, get_generation_model
+from quantized_store import QuantizedCollection
+from query_cache import TTLCache, normalize_question, stable_hash
+from result_fusion import maximal_marginal_relevance, merge_query_results
+import telemetry
+from text_cleaner import clean_and_normalize_text, hash_pages, normalize_pages
+from text_scraper import extract_text_from_html, extract_text_from_url
+from vector_cache import DocumentVectorCache
+from web_fetcher import get_web_fetcher
+
+# Catálogo antiguo en JSON; se migra automáticamente a SQLite la primera vez.
+LEGACY_METADATA_STORE_PATH = os.path.join(DB_PATH, "metadata_store.json")
+
+# document_id especial para consultar toda la biblioteca en lugar de un solo documento.
+LIBRARY_SCOPE = "__biblioteca__"
+
+def _hash_file(path: str) -> str:
+    """Calcula el SHA-256 de un archivo leyéndolo por bloques."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""): digest.update(block)
+    return digest.hexdigest()
+
+def prepare_document(source: str, html: str | None = None) -> dict:
+    """
+    Etapas de CPU de la ingesta: extracción, limpieza y troceado.
+    Es una función de módulo (sin estado) para poder ejecutarla en un pool de procesos.
+    Para una URL ya descargada, html es la página (así solo se ejecuta aquí la extracción).
+    """
+    filename = os.path.basename(source)
+    with telemetry.span("ingesta.extraccion", f"Ingesta [1/4]: Extrayendo y limpiando texto de '{filename}'", documento=filename) as stage:
+        if os.path.isfile(source): extracted_content = extract_text_from_document(source)
+        elif html is not None: extracted_content = extract_text_from_html(html)
+        else: extracted_content = extract_text_from_url(source)
+        if not extracted_content: return {"success": False, "message": "No se pudo extraer texto."}
+
+        if isinstance(extracted_content, list):
+            # Una sola pasada de limpieza da las páginas (sin cabeceras ni pies repetidos) y el documento.
+            text_hash = hash_pages(extracted_content)
+            pages = list(normalize_pages(enumerate(extracted_content, 1)))
+            cleaned_text = "\n\n".join(page for _, page in pages)
+        else:
+            text_hash = hashlib.sha256(extracted_content.encode("utf-8")).hexdigest()
+            cleaned_text = clean_and_normalize_text(extracted_content)
+            pages = [(None, cleaned_text)]
+        chunks = list(chunk_pages(pages))
+        stage.set(caracteres=len(cleaned_text), fragmentos=len(chunks))
+        if len(cleaned_text) < 500: return {"success": False, "message": "El documento tiene muy poco contenido útil."}
+        if not chunks: return {"success": False, "message": "No se pudieron generar fragmentos para embedding."}
+
+    return {"success": True, "cleaned_text": cleaned_text, "chunks": chunks, "text_hash": text_hash}
+
+def is_streamable_pdf(source: str) -> bool:
+    """Los PDFs locales se ingieren en streaming si PDF_STREAMING está activo."""
+    return PDF_STREAMING and os.path.isfile(source) and source.lower().endswith('.pdf')
+
+# Marca de fin de flujo en la cola de páginas.
+_END_OF_STREAM = object()
+
+def _produce_clean_pages(source: str, out: queue.Queue, stop: threading.Event):
+    """Productor del pipeline en streaming: extrae y limpia páginas y deja (número, texto) en la cola acotada."""
+    def put(item):
+        # Si el consumidor abandona (error o IA fallida), dejamos de esperar hueco en la cola.
+        while not stop.is_set():
+            try: out.put(item, timeout=0.5); return
+            except queue.Full: continue
+    try:
+        for page in normalize_pages(iter_pdf_pages(source)):
+            if stop.is_set(): return
+            put(page)
+        put(_END_OF_STREAM)
+    except Exception as e:
+        put(e)
+
+def _iter_queue(pages: queue.Queue):
+    while True:
+        item = pages.get()
+        if item is _END_OF_STREAM: return
+        if isinstance(item, Exception): raise item
+        yield item
+
+def _tee(items, callback):
+    """Deja pasar los elementos de un iterador entregándoselos también a callback."""
+    for item in items:
+        callback(item)
+        yield item
 
-METADATA_STORE_PATH = os.path.join(DB_PATH, "metadata_store.json")
+
+def _merge_retrievals(*retrievals: list[dict]) -> list[dict]:
+    """Fusiona con RRF varias listas de fragmentos recuperados para la misma pregunta (cada uno, con su mejor puntuación)."""
+    chunks = {}
+    for retrieved in retrievals:
+        for chunk in retrieved:
+            if chunk['id'] not in chunks or chunk['score'] > chunks[chunk['id']]['score']: chunks[chunk['id']] = chunk
+    fused = reciprocal_rank_fusion([[chunk['id'] for chunk in retrieved] for retrieved in retrievals], k=RRF_K)
+    return [chunks[chunk_id] for chunk_id, _ in fused[:RETRIEVAL_TOP_K]]
+
+
+def _chunk_source(chunk: dict) -> dict:
+    """Lo que la interfaz muestra de un fragmento usado como contexto: de dónde sale y cuánto puntuó."""
+    metadata = chunk['metadata']
+    return {"id": chunk['id'], "source": metadata.get('source') or chunk['id'].rsplit("_", 1)[0],
+            "score": chunk['score'], "distance": chunk['distance'], "page_start": metadata.get('page_start'),
+            "page_end": metadata.get('page_end'), "heading": metadata.get('heading')}
 
 class RAGSystem:
     def __init__(self):
+        """
+        Arranque ligero: solo el catálogo (SQLite), los pools y las cachés en memoria. Los modelos
+        de IA, la caché de embeddings y las colecciones de vectores se crean al primer uso
+        (o antes, con warm_up en segundo plano), así la interfaz puede mostrarse enseguida.
+        """
         print("Iniciando el Sistema RAG 'Rolls-Royce'...")
+        start = time.perf_counter()
         try:
-            models = setup_gemini(); self.generation_model = models["generation_model"]
-            gemini_api_key = os.getenv("GEMINI_API_KEY")
-            self.embedding_function = embedding_functions.GoogleGenerativeAiEmbeddingFunction(api_key=gemini_api_key, model_name=EMBEDDING_MODEL_NAME)
             os.makedirs(DB_PATH, exist_ok=True)
-            self.client = chromadb.PersistentClient(path=DB_PATH)
-            self.collection = self.client.get_or_create_collection(name=COLLECTION_NAME, embedding_function=self.embedding_function)
-            print(f"✅ Conectado a la colección '{COLLECTION_NAME}'.")
-            self.metadata_store = self._load_metadata_store()
+            self._backends = {}
+            self._backends_lock = threading.RLock()
+            self.startup_timings: dict[str, float] = {}
+            self.lexical_store = LexicalIndexStore(LEXICAL_INDEX_PATH)
+            self._executor = ThreadPoolExecutor(max_workers=4)
+            # Pool acotado para el trabajo bloqueante de la API asíncrona. Es distinto de _executor
+            # porque sus tareas (p. ej. _hybrid_retrieve) esperan a su vez a tareas de _executor.
+            self._blocking_executor = ThreadPoolExecutor(max_workers=ASYNC_EXECUTOR_WORKERS)
+            self._event_loop = None
+            self._event_loop_lock = threading.Lock()
+            self._source_locks: dict[str, threading.Lock] = {}
+            self._source_locks_guard = threading.Lock()
+            self.plan_cache = TTLCache(PLAN_CACHE_MAX_ENTRIES, QUERY_CACHE_TTL_SECONDS, name="planes")
+            self.answer_cache = TTLCache(ANSWER_CACHE_MAX_ENTRIES, QUERY_CACHE_TTL_SECONDS, name="respuestas")
+            self.prompt_builder = PromptBuilder(lambda: self.generation_model, PLAN_INDEX_TOKEN_BUDGET, HISTORY_TOKEN_BUDGET,
+                                                HISTORY_RECENT_MESSAGES, CONTEXT_TOKEN_BUDGET, ttl_seconds=QUERY_CACHE_TTL_SECONDS)
+            self.metadata_store = MetadataStore(METADATA_DB_PATH, legacy_json_path=LEGACY_METADATA_STORE_PATH)
             print(f"✅ Almacén de metadatos cargado. {len(self.metadata_store)} documentos catalogados.")
             self.prompts_path = PROMPTS_PATH; os.makedirs(self.prompts_path, exist_ok=True)
             print(f"✅ Directorio de prompts listo.")
         except Exception as e:
             print(f"❌ Error fatal durante la inicialización: {e}"); raise
+        self.startup_timings["sistema"] = time.perf_counter() - start
 
-    def _load_metadata_store(self):
-        if os.path.exists(METADATA_STORE_PATH):
-            with open(METADATA_STORE_PATH, 'r', encoding='utf-8') as f: return json.load(f)
-        return {}
+    # --- Servicios pesados, creados al primer uso ---
 
-    def _save_metadata_store(self):
-        with open(METADATA_STORE_PATH, 'w', encoding='utf-8') as f: json.dump(self.metadata_store, f, indent=4, ensure_ascii=False)
+    def _backend(self, name: str, factory):
+        """Crea una sola vez (aunque lo pidan varios hilos a la vez) el servicio `name` y lo cronometra."""
+        backend = self._backends.get(name)
+        if backend is not None: return backend
+        with self._backends_lock:
+            if name not in self._backends:
+                start = time.perf_counter()
+                self._backends[name] = factory()
+                self.startup_timings[name] = time.perf_counter() - start
+            return self._backends[name]
 
-    def _get_master_index(self, source: str):
-        return self.metadata_store.get(source)
+    @property
+    def generation_model(self):
+        return self._backend("generacion", get_generation_model)
 
-    def add_document_pipeline(self, source: str) -> dict:
-        filename = os.path.basename(source)
-        print(f"--- Ingesta [1/4]: Extrayendo texto de '{filename}' ---")
-        extracted_content = extract_text_from_document(source) if os.path.isfile(source) else extract_text_from_url(source)
-        if not extracted_content: return {"success": False, "message": "No se pudo extraer texto."}
+    @property
+    def embedding_cache(self) -> EmbeddingCache:
+        return self._backend("cache_embeddings", lambda: EmbeddingCache(
+            EMBEDDING_CACHE_PATH, get_embedding_function().model_name,
+            max_entries=EMBEDDING_CACHE_MAX_ENTRIES, max_bytes=EMBEDDING_CACHE_MAX_MB * 1024 * 1024))
 
-        full_text = "\n\n".join(extracted_content) if isinstance(extracted_content, list) else extracted_content
-        
-        print(f"--- Ingesta [2/4]: Limpiando y generando Índice Maestro ---")
-        cleaned_text = clean_and_normalize_text(full_text)
-        if len(cleaned_text) < 500: return {"success": False, "message": "El documento tiene muy poco contenido útil."}
+    @property
+    def embedding_function(self) -> CachedEmbeddingFunction:
+        return self._backend("embeddings", lambda: CachedEmbeddingFunction(get_embedding_function(), self.embedding_cache))
 
-        master_index = analyzer.create_master_index(cleaned_text, filename)
-        if not master_index: return {"success": False, "message": "La IA no pudo generar un Índice Maestro."}
-        
-        print(f"--- Ingesta [3/4]: Guardando Índice Maestro ---")
-        self.metadata_store[source] = master_index
-        self._save_metadata_store()
+    @property
+    def client(self):
+        def connect():
+            import chromadb  # Importar Chroma ya cuesta: solo se hace si se usa.
+            return chromadb.PersistentClient(path=DB_PATH)
+        return self._backend("chroma", connect)
 
-        print(f"--- Ingesta [4/4]: Embedding por Páginas/Fragmentos ---")
-        if isinstance(extracted_content, list):
-            chunks = [clean_and_normalize_text(page) for page in extracted_content if page.strip()]
+    @property
+    def collection(self):
+        def open_fragments():
+            collection = self._open_collection(COLLECTION_NAME)
+            print(f"✅ Conectado a la colección '{COLLECTION_NAME}' ({VECTOR_STORE}).")
+            return collection
+        return self._backend("coleccion", open_fragments)
+
+    @property
+    def router(self) -> DocumentRouter:
+        return self._backend("enrutador", lambda: DocumentRouter(self._open_collection(DOCUMENT_COLLECTION_NAME)))
+
+    @property
+    def vector_cache(self) -> DocumentVectorCache:
+        return self._backend("cache_vectores", lambda: DocumentVectorCache(
+            self.collection, VECTOR_CACHE_MAX_DOCUMENTS, VECTOR_CACHE_MAX_MB * 1024 * 1024))
+
+    @property
+    def ingest_queue(self) -> IngestQueue:
+        """
+        Cola persistente de ingestas. Crearla solo abre su SQLite: los hilos arrancan (y reanudan
+        los trabajos interrumpidos) con ingest_queue.start() o al encolar el primer trabajo.
+        """
+        return self._backend("cola_ingesta", lambda: IngestQueue(self, IngestJobStore(INGEST_JOBS_DB_PATH), INGEST_WORKERS,
+                                                                 INGEST_JOB_MAX_ATTEMPTS, INGEST_JOB_RETRY_SECONDS))
+
+    def warm_up(self) -> dict:
+        """
+        Crea ya todos los servicios pesados, en el orden en que los necesita una consulta, e informa
+        de lo que ha tardado cada uno. Devuelve {"success", "message", "timings"}.
+        """
+        start = time.perf_counter()
+        with telemetry.span("arranque", "Arranque: preparando modelos y base de datos vectorial") as trace:
+            try:
+                for name in ("generation_model", "embedding_function", "collection", "router", "vector_cache"):
+                    getattr(self, name)
+            except Exception as e:
+                trace.set(error=repr(e))
+                print(f"❌ Error al preparar el backend: {e}")
+                return {"success": False, "message": f"❌ Error al iniciar el backend: {e}", "timings": dict(self.startup_timings)}
+            self.startup_timings["arranque_total"] = time.perf_counter() - start
+            trace.set(**{name: round(seconds, 3) for name, seconds in self.startup_timings.items()})
+        print("⏱️ Arranque: " + ", ".join(f"{name} {seconds:.2f} s" for name, seconds in self.startup_timings.items()))
+        return {"success": True, "message": "✅ Sistema listo.", "timings": dict(self.startup_timings)}
+
+    def start_warm_up(self, on_done=None) -> threading.Thread:
+        """warm_up en un hilo aparte; on_done(resultado) se llama al terminar."""
+        def run():
+            result = self.warm_up()
+            if on_done: on_done(result)
+        thread = threading.Thread(target=run, name="rag-arranque", daemon=True)
+        thread.start()
+        return thread
+
+    def _open_collection(self, name: str):
+        """Colección de Chroma o, con VECTOR_STORE="cuantizado", su equivalente en ficheros mapeados."""
+        if VECTOR_STORE == "chroma":
+            return self.client.get_or_create_collection(name=name, embedding_function=self.embedding_function)
+        if VECTOR_STORE == "cuantizado":
+            return QuantizedCollection(os.path.join(QUANTIZED_STORE_PATH, name), self.embedding_function,
+                                       dtype=QUANTIZED_DTYPE, rescore_factor=QUANTIZED_RESCORE_FACTOR)
+        raise ValueError(f"Almacén de vectores desconocido: {VECTOR_STORE}")
+
+    def _get_master_index(self, source: str):
+        return self.metadata_store.get_master_index(source)
+
+    def _get_ingest_state(self, source: str) -> dict:
+        return self.metadata_store.get_ingest_state(source)
+
+    def _mark_unchanged(self, source: str, fingerprint: dict) -> dict:
+        # Refrescamos los datos baratos de la huella (mtime, ETag) para no volver a hashear la próxima vez.
+        self.metadata_store.update_ingest_state(source, {**self._get_ingest_state(source), **fingerprint})
+        message = f"ℹ️ '{os.path.basename(source)}' no ha cambiado desde la última ingesta. No hay nada que actualizar."
+        return {"success": True, "message": message, "unchanged": True}
+
+    def check_source_unchanged(self, source: str, force: bool = False, validators: dict | None = None) -> tuple[dict | None, dict]:
+        """
+        Compara la huella actual de la fuente con la guardada. Devuelve el resultado final si
+        no hay nada que hacer (o None si hay que ingerirla) y la huella calculada. La huella de
+        una URL son los validadores (ETag, Last-Modified) de su descarga condicional.
+        """
+        previous_state = {} if force else self._get_ingest_state(source)
+        if os.path.isfile(source):
+            stat = os.stat(source)
+            fingerprint = {"size": stat.st_size, "mtime": stat.st_mtime}
+            if previous_state and all(previous_state.get(k) == v for k, v in fingerprint.items()):
+                return self._mark_unchanged(source, {}), fingerprint
+            fingerprint["content_hash"] = _hash_file(source)
+            if previous_state.get("content_hash") == fingerprint["content_hash"]:
+                return self._mark_unchanged(source, fingerprint), fingerprint
         else:
-            chunk_size = 3000; chunk_overlap = 300
-            chunks = [cleaned_text[i:i + chunk_size] for i in range(0, len(cleaned_text), chunk_size - chunk_overlap)]
+            fingerprint = dict(validators or {})
+            if previous_state and fingerprint and all(previous_state.get(k) == v for k, v in fingerprint.items()):
+                return self._mark_unchanged(source, {}), fingerprint
+        return None, fingerprint
 
-        if not chunks: return {"success": False, "message": "No se pudieron generar fragmentos para embedding."}
+    def add_document_pipeline(self, source: str, force: bool = False, profile: bool = False) -> dict:
+        """Ingesta una fuente. Con profile=True se guarda un perfil cProfile de toda la ingesta."""
+        return self._add_document(source, force, profile=profile)
 
-        doc_title = master_index.get('titulo', filename)
-        metadatas = [{'source': source, 'doc_title': doc_title, 'fragment_num': i+1} for i, _ in enumerate(chunks)]
-        ids = [f"{source}_{i}" for i in range(len(chunks))]
+    async def aadd_document(self, source: str, force: bool = False, profile: bool = False) -> dict:
+        """
+        Versión asíncrona de add_document_pipeline. La ingesta corre en el pool acotado;
+        si se cancela la tarea, se detiene al terminar la etapa en curso.
+        """
+        cancel_event = threading.Event()
+        try:
+            return await self._run_blocking(self._add_document, source, force, cancel_event, profile)
+        except asyncio.CancelledError:
+            cancel_event.set(); raise
+
+    def enqueue_document(self, source: str, force: bool = False) -> int:
+        """Encola la ingesta de una fuente en la cola persistente y devuelve el id del trabajo."""
+        self.ingest_queue.start()
+        return self.ingest_queue.submit(source, force)
 
-        batch_size = 32
-        total_chunks = len(chunks)
+    def run_ingest_job(self, source: str, force: bool, cancel_event: threading.Event, checkpoint: IngestCheckpoint) -> dict:
+        """Un intento de un trabajo de la cola: la ingesta normal, saltándose lo que ya guardó el punto de control."""
+        return self._add_document(source, force, cancel_event, checkpoint=checkpoint)
+
+    def _add_document(self, source: str, force: bool = False, cancel_event: threading.Event | None = None, profile: bool = False,
+                      checkpoint: IngestCheckpoint | None = None) -> dict:
+        with telemetry.span("ingesta", profile=profile, documento=os.path.basename(source), reanudada=bool(checkpoint and checkpoint.data)) as trace:
+            result = self._add_document_stages(source, force, cancel_event, checkpoint)
+            trace.set(resultado="sin_cambios" if result.get("unchanged") else "ok" if result["success"] else "fallo")
+            return result
+
+    def _add_document_stages(self, source: str, force: bool, cancel_event: threading.Event | None,
+                             checkpoint: IngestCheckpoint | None = None) -> dict:
+        cancelled = {"success": False, "message": f"Ingesta de '{os.path.basename(source)}' cancelada."}
+        # Dos ingestas (o una ingesta y un borrado) de la misma fuente nunca se solapan.
+        with self._source_lock(source):
+            page = None
+            if not os.path.isfile(source):
+                # Una sola petición por URL: la descarga condicional da la página y su huella.
+                try:
+                    page = get_web_fetcher().fetch(source)
+                except Exception as e:
+                    return {"success": False, "message": f"❌ Error al descargar: {e}"}
+            unchanged_result, fingerprint = self.check_source_unchanged(source, force, page.validators if page else None)
+            if unchanged_result: return unchanged_result
+            self._start_checkpoint(checkpoint, fingerprint)
+            if cancel_event and cancel_event.is_set(): return cancelled
+            if is_streamable_pdf(source):
+                return self.store_streamed_pdf(source, fingerprint, force, checkpoint, cancel_event)
+            prepared = prepare_document(source, page.text if page else None)
+            if cancel_event and cancel_event.is_set(): return cancelled
+            return self.store_prepared_document(source, prepared, fingerprint, force, checkpoint, cancel_event)
+
+    @staticmethod
+    def _start_checkpoint(checkpoint: IngestCheckpoint | None, fingerprint: dict):
+        if checkpoint is not None and checkpoint.get("fingerprint") != fingerprint:
+            # Primer intento, o la fuente cambió desde el anterior: se empieza de cero.
+            checkpoint.reset()
+            checkpoint.save("iniciado", fingerprint=fingerprint)
+
+    def store_bulk_source(self, source: str, fingerprint: dict, prepared: dict | None = None, force: bool = False) -> dict:
+        """
+        Etapas de E/S de la ingesta masiva para una fuente ya comprobada y extraída (sin prepared, un
+        PDF en streaming). Como la ingesta normal, con el cerrojo de la fuente y un trabajo en la cola
+        persistente: si la ejecución se corta o falla, la siguiente reanuda desde su punto de control.
+        """
+        jobs = self.ingest_queue.store
+        job = jobs.claim_source(source, force)
+        checkpoint = IngestCheckpoint(jobs, job["id"], job["checkpoint"])
+        with telemetry.span("ingesta", documento=os.path.basename(source), reanudada=bool(checkpoint.data), masiva=True) as trace:
+            try:
+                with self._source_lock(source):
+                    self._start_checkpoint(checkpoint, fingerprint)
+                    if prepared is None: result = self.store_streamed_pdf(source, fingerprint, force, checkpoint)
+                    else: result = self.store_prepared_document(source, prepared, fingerprint, force, checkpoint)
+            except Exception as e:
+                result = {"success": False, "message": f"❌ Error inesperado: {e}"}
+            trace.set(resultado="sin_cambios" if result.get("unchanged") else "ok" if result["success"] else "fallo")
+        jobs.finish(job["id"], DONE if result["success"] else FAILED, result["message"])
+        return result
+
+    def _source_lock(self, source: str) -> threading.Lock:
+        with self._source_locks_guard:
+            return self._source_locks.setdefault(source, threading.Lock())
+
+    def _get_event_loop(self) -> asyncio.AbstractEventLoop:
+        """Bucle de eventos en segundo plano sobre el que corren los envoltorios síncronos."""
+        with self._event_loop_lock:
+            if self._event_loop is None:
+                self._event_loop = asyncio.new_event_loop()
+                threading.Thread(target=self._event_loop.run_forever, name="rag-asyncio", daemon=True).start()
+            return self._event_loop
+
+    def _loop_for_sync_call(self) -> asyncio.AbstractEventLoop:
+        """El bucle de fondo, para un envoltorio síncrono. Desde el propio bucle, esperarlo lo bloquearía para siempre."""
+        loop = self._get_event_loop()
         try:
-            print(f"  -> Añadiendo {total_chunks} fragmentos a la base de datos...")
-            for i in range(0, total_chunks, batch_size):
-                batch_end = min(i + batch_size, total_chunks)
-                self.collection.add(documents=chunks[i:batch_end], metadatas=metadatas[i:batch_end], ids=ids[i:batch_end])
-            message = f"✅ Documento '{doc_title}' procesado con {total_chunks} fragmentos."
-            return {"success": True, "message": message}
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is loop:
+            raise RuntimeError("Los envoltorios síncronos no se pueden llamar desde el bucle 'rag-asyncio': usa las versiones asíncronas (aquery, aquery_stream).")
+        return loop
+
+    def _run_sync(self, coroutine):
+        try:
+            loop = self._loop_for_sync_call()
+        except RuntimeError:
+            coroutine.close(); raise
+        return asyncio.run_coroutine_threadsafe(coroutine, loop).result()
+
+    async def _run_blocking(self, func, *args):
+        """Ejecuta trabajo bloqueante (Chroma, extracción, SQLite) en el pool acotado."""
+        # Copiamos el contexto para que los tramos de telemetría del hilo cuelguen del tramo en curso.
+        context = contextvars.copy_context()
+        return await asyncio.get_running_loop().run_in_executor(self._blocking_executor, functools.partial(context.run, func, *args))
+
+    def store_prepared_document(self, source: str, prepared: dict, fingerprint: dict, force: bool = False,
+                                checkpoint: IngestCheckpoint | None = None, cancel_event: threading.Event | None = None) -> dict:
+        """
+        Etapas de E/S de la ingesta: Índice Maestro (LLM), embedding y guardado de metadatos.
+        Con un punto de control, reutiliza el Índice Maestro y los lotes ya guardados de un intento anterior.
+        """
+        if not prepared["success"]: return prepared
+        filename = os.path.basename(source)
+        previous_state = {} if force else self._get_ingest_state(source)
+        chunks = prepared["chunks"]
+        if not os.path.isfile(source):
+            # Para URLs sin validadores HTTP la huella es el propio texto extraído.
+            fingerprint = {**fingerprint, "content_hash": prepared["text_hash"]}
+            if previous_state.get("content_hash") == fingerprint["content_hash"]:
+                return self._mark_unchanged(source, fingerprint)
+        if checkpoint is not None:
+            # La extracción no se guarda (es determinista y no cuesta llamadas): se comprueba que da el mismo texto.
+            if checkpoint.get("text_hash") not in (None, prepared["text_hash"]): checkpoint.reset()
+            checkpoint.save("extraido", fingerprint=checkpoint.get("fingerprint"), text_hash=prepared["text_hash"], fragmentos_total=len(chunks))
+
+        master_index = checkpoint.get("master_index") if checkpoint else None
+        if not master_index:
+            with telemetry.span("ingesta.indice_maestro", f"Ingesta [2/4]: Generando Índice Maestro de '{filename}'", documento=filename):
+                master_index = analyzer.create_master_index(prepared["cleaned_text"], filename)
+            if not master_index: return {"success": False, "message": "La IA no pudo generar un Índice Maestro."}
+            if checkpoint is not None: checkpoint.save("indexado", master_index=master_index)
+        if cancel_event and cancel_event.is_set(): return {"success": False, "message": f"Ingesta de '{filename}' cancelada."}
+
+        doc_title = master_index.get('titulo', filename)
+        try:
+            with telemetry.span("ingesta.embedding", "Ingesta [3/4]: Embedding por Páginas/Fragmentos", documento=filename):
+                chunk_hashes, changed = self._upsert_chunks(source, chunks, doc_title, previous_state, checkpoint, cancel_event)
+        except InterruptedError as e:
+            return {"success": False, "message": str(e)}
         except Exception as e:
             return {"success": False, "message": f"❌ Error al guardar en DB: {e}"}
+        return self._finish_ingest(source, master_index, fingerprint, doc_title, chunk_hashes, changed)
 
-    def query_document_pipeline(self, question: str, document_id: str, prompt_name: str, conversation_history: list = []) -> tuple[str, str, list]:
-        print(f"--- Consulta [1/3]: Transformando pregunta con el Índice Maestro y el Historial ---")
-        master_index = self._get_master_index(document_id)
-        if not master_index: return "Error: No se encontró el Índice Maestro.", "", []
+    def store_streamed_pdf(self, source: str, fingerprint: dict, force: bool = False,
+                           checkpoint: IngestCheckpoint | None = None, cancel_event: threading.Event | None = None) -> dict:
+        """
+        Ingesta en streaming de un PDF: extracción (en paralelo), limpieza, troceado y embedding
+        por lotes, con una cola acotada entre etapas. La memoria no depende del número de páginas.
+        Con un punto de control, reutiliza el título (y el Índice Maestro, si llegó a terminarse)
+        y los lotes ya guardados de un intento anterior.
+        """
+        filename = os.path.basename(source)
+        previous_state = {} if force else self._get_ingest_state(source)
+        pages = queue.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+        stop = threading.Event()
+        threading.Thread(target=_produce_clean_pages, args=(source, pages, stop), daemon=True).start()
+        stream = _iter_queue(pages)
+        try:
+            # Leemos hasta MAX_CHARS_FOR_ANALYSIS: si el PDF cabe, el Índice Maestro sale de una sola llamada.
+            # Solo esa muestra queda en memoria mientras se espera a la IA. En streaming, el resto de la
+            # extracción se solapa con el embedding y cuenta dentro de su tramo.
+            with telemetry.span("ingesta.extraccion", f"Ingesta [1/4]: Extrayendo y limpiando '{filename}' página a página", documento=filename) as stage:
+                sample_pages, sample_chars, exhausted = [], 0, True
+                for page in stream:
+                    sample_pages.append(page); sample_chars += len(page[1])
+                    if sample_chars >= analyzer.MAX_CHARS_FOR_ANALYSIS:
+                        exhausted = False
+                        break
+                stage.set(caracteres=sample_chars, paginas=len(sample_pages), muestra=not exhausted)
+            if sample_chars < 500: return {"success": False, "message": "El documento tiene muy poco contenido útil."}
 
-        formatted_history = "\n".join([f"{msg['role']}: {msg['content']}" for msg in conversation_history])
-        translation_prompt = f"""
+            builder = None
+            master_index = checkpoint.get("master_index") if checkpoint else None
+            with telemetry.span("ingesta.indice_maestro", f"Ingesta [2/4]: Generando Índice Maestro de '{filename}'", documento=filename):
+                if master_index:
+                    doc_title = master_index.get('titulo', filename)
+                elif exhausted or not MASTER_INDEX_HIERARCHICAL:
+                    master_index = analyzer.create_master_index("\n\n".join(text for _, text in sample_pages), filename)
+                    if not master_index: return {"success": False, "message": "La IA no pudo generar un Índice Maestro."}
+                    doc_title = master_index.get('titulo', filename)
+                else:
+                    # PDF largo: las secciones se resumen en paralelo mientras el resto del flujo se embebe.
+                    # El título de los fragmentos sale de la primera sección, sin esperar al resto.
+                    builder = analyzer.MasterIndexBuilder(filename)
+                    for _, text in sample_pages: builder.feed(text)
+                    # Al reanudar, el título es el del intento anterior: es el que llevan los fragmentos ya guardados.
+                    doc_title = (checkpoint.get("doc_title") if checkpoint else None) or builder.bibliographic_data().get('titulo') or filename
+                    stream = _tee(stream, lambda page: builder.feed(page[1]))
+            if checkpoint is not None: checkpoint.save("indexado", doc_title=doc_title, master_index=master_index)
+
+            with telemetry.span("ingesta.embedding", "Ingesta [3/4]: Embedding por Páginas/Fragmentos", documento=filename):
+                chunks = chunk_pages(itertools.chain(sample_pages, stream))
+                chunk_hashes, changed = self._upsert_chunks(source, chunks, doc_title, previous_state, checkpoint, cancel_event)
+            if builder:
+                with telemetry.span("ingesta.indice_maestro", documento=filename, fase="reduccion"):
+                    master_index = builder.finish()
+                if not master_index: return {"success": False, "message": "La IA no pudo generar un Índice Maestro."}
+                if checkpoint is not None: checkpoint.save("indexado", master_index=master_index)
+        except InterruptedError as e:
+            return {"success": False, "message": str(e)}
+        except Exception as e:
+            return {"success": False, "message": f"❌ Error al procesar el PDF en streaming: {e}"}
+        finally:
+            stop.set()
+        return self._finish_ingest(source, master_index, fingerprint, doc_title, chunk_hashes, changed)
+
+    def _upsert_chunks(self, source: str, chunks, doc_title: str, previous_state: dict,
+                       checkpoint: IngestCheckpoint | None = None, cancel_event: threading.Event | None = None) -> tuple[list[str], int]:
+        """
+        Consume los fragmentos (texto, metadatos) de una lista o un generador y hace upsert por lotes
+        solo de los que han cambiado respecto a la ingesta anterior. Devuelve los hashes de todos y
+        cuántos cambiaron. Tras cada lote se anota en el punto de control hasta qué fragmento está
+        guardado; al reanudar, los anteriores no se vuelven a embeber. La cancelación se atiende entre lotes.
+        """
+        # Solo se reescriben los fragmentos cuya posición ha cambiado de contenido. Si cambia el
+        # título, cambian los metadatos de todos (la caché de embeddings evita recalcularlos).
+        old_hashes = previous_state.get("chunk_hashes", []) if previous_state.get("doc_title") == doc_title else []
+        resume_from = checkpoint.get("embebidos", 0) if checkpoint else 0
+        chunk_hashes, batch, changed = [], [], checkpoint.get("actualizados", 0) if checkpoint else 0
+        # El índice léxico se reconstruye entero (también con los fragmentos sin cambios).
+        lexical_index = BM25Index()
+        modified = False
+
+        def flush():
+            nonlocal modified
+            if cancel_event and cancel_event.is_set(): raise InterruptedError(f"Ingesta de '{os.path.basename(source)}' cancelada.")
+            modified = True
+            start = time.perf_counter()
+            self.collection.upsert(documents=[chunk for _, chunk, _ in batch],
+                                   metadatas=[{'source': source, 'doc_title': doc_title, 'fragment_num': i+1, **metadata} for i, _, metadata in batch],
+                                   ids=[f"{source}_{i}" for i, _, _ in batch])
+            telemetry.observe("chroma_upsert_seconds", time.perf_counter() - start)
+            if checkpoint is not None: checkpoint.save("embebiendo", embebidos=batch[-1][0] + 1, actualizados=changed)
+
+        try:
+            for i, (chunk, metadata) in enumerate(chunks):
+                # Las páginas y el encabezado forman parte de la huella: si cambian, se reescriben los metadatos.
+                chunk_hash = hashlib.sha256((chunk + json.dumps(metadata, sort_keys=True)).encode("utf-8")).hexdigest()
+                chunk_hashes.append(chunk_hash)
+                lexical_index.add(f"{source}_{i}", chunk)
+                if i < resume_from or (i < len(old_hashes) and old_hashes[i] == chunk_hash): continue
+                batch.append((i, chunk, metadata)); changed += 1
+                # Un lote de upsert es una petición de embedding: su tamaño sigue al que permite la cuota ahora mismo.
+                if len(batch) >= self.embedding_function.current_batch_size(): flush(); batch = []
+            if batch: flush()
+            if not chunk_hashes: raise ValueError("No se pudieron generar fragmentos para embedding.")
+            if checkpoint is not None: checkpoint.save("embebido", embebidos=len(chunk_hashes), actualizados=changed)
+
+            # Borramos los fragmentos sobrantes de una versión anterior más larga.
+            ids = {f"{source}_{i}" for i in range(len(chunk_hashes))}
+            stale_ids = sorted(set(self.collection.get(where={"source": source}, include=[])['ids']) - ids)
+            if stale_ids:
+                modified = True
+                self.collection.delete(ids=stale_ids)
+            self.lexical_store.save(source, lexical_index)
+            telemetry.annotate(fragmentos=len(chunk_hashes), actualizados=changed, obsoletos=len(stale_ids))
+            return chunk_hashes, changed
+        finally:
+            # En cuanto cambia la colección, las respuestas cacheadas (y los vectores en memoria) dejan
+            # de valer, aunque la ingesta falle después: no esperamos a _finish_ingest.
+            if modified: self._invalidate_query_caches(source)
+
+    def _finish_ingest(self, source: str, master_index: dict, fingerprint: dict, doc_title: str, chunk_hashes: list[str], changed: int) -> dict:
+        # La huella se guarda al final: si el embedding falla, la próxima ingesta lo reintentará.
+        with telemetry.span("ingesta.guardado", "Ingesta [4/4]: Guardando Índice Maestro", documento=os.path.basename(source)):
+            ingest_state = {**fingerprint, "doc_title": doc_title, "chunk_hashes": chunk_hashes}
+            self.metadata_store.save_document(source, master_index, ingest_state)
+            try:
+                self.router.upsert(source, master_index)
+            except Exception as e:
+                # El documento ya está catalogado y troceado: solo queda fuera del enrutado de la biblioteca hasta reingerirlo.
+                print(f"  -> ⚠️ No se pudo añadir '{os.path.basename(source)}' al enrutado de la biblioteca: {e}")
+            self.prompt_builder.precompute_index(source, self.metadata_store.get_version(source), master_index)
+            self._invalidate_query_caches(source)
+        message = f"✅ Documento '{doc_title}' procesado con {len(chunk_hashes)} fragmentos ({changed} actualizados)."
+        return {"success": True, "message": message}
+
+    def _get_lexical_index(self, source: str) -> BM25Index | None:
+        lexical_index = self.lexical_store.load(source)
+        if lexical_index is None:
+            # Documentos ingeridos antes de existir el índice léxico: lo construimos desde Chroma una vez.
+            stored = self.collection.get(where={"source": source}, include=["documents"])
+            if not stored['ids']: return None
+            lexical_index = BM25Index()
+            for chunk_id, text in sorted(zip(stored['ids'], stored['documents']), key=lambda item: int(item[0].rsplit("_", 1)[1])):
+                lexical_index.add(chunk_id, text)
+            self.lexical_store.save(source, lexical_index)
+        return lexical_index
+
+    def _hybrid_retrieve(self, sources: str | list[str], question: str, optimized_queries: list[str], keywords: list[str]) -> list[dict]:
+        """
+        Búsqueda vectorial (Chroma, con todas las consultas optimizadas) y léxica (BM25 local) en
+        paralelo sobre uno o varios documentos, fusionadas con Reciprocal Rank Fusion y diversificadas
+        con MMR. Devuelve los mejores fragmentos como {id, text, score, distance, metadata}.
+        """
+        sources = [sources] if isinstance(sources, str) else sources
+        with telemetry.span("consulta.busqueda_hibrida", consultas=optimized_queries, palabras_clave=keywords, documentos=len(sources)) as stage:
+            vector_future = self._executor.submit(self._query_vectors, sources, optimized_queries)
+            start = time.perf_counter()
+            lexical_query = " ".join([question, *keywords])
+            lexical_hits = []
+            for source in sources:
+                lexical_index = self._get_lexical_index(source)
+                if lexical_index: lexical_hits.extend(lexical_index.search(lexical_query, LEXICAL_N_RESULTS))
+            # Con varios documentos, nos quedamos con las mejores puntuaciones BM25 de todos ellos.
+            if len(sources) > 1: lexical_hits = sorted(lexical_hits, key=lambda hit: hit[1], reverse=True)[:LEXICAL_N_RESULTS]
+            telemetry.observe("bm25_seconds", time.perf_counter() - start)
+            results = vector_future.result()
+            # Cada fragmento, una sola vez y con su mejor distancia en cualquiera de las consultas.
+            vector_hits = merge_query_results(results)
+            stage.set(lexicos=len(lexical_hits), vectoriales=len(vector_hits))
+
+            candidates = {hit['id']: hit for hit in vector_hits}
+            fused = reciprocal_rank_fusion([list(candidates), [chunk_id for chunk_id, _ in lexical_hits]], k=RRF_K)[:MMR_CANDIDATES]
+            missing = [chunk_id for chunk_id, _ in fused if chunk_id not in candidates]
+            if missing:
+                fetched = self.collection.get(ids=missing, include=["documents", "metadatas", "embeddings"])
+                embeddings = fetched.get('embeddings')
+                for position, chunk_id in enumerate(fetched['ids']):
+                    candidates[chunk_id] = {"id": chunk_id, "text": fetched['documents'][position],
+                                            "metadata": fetched['metadatas'][position] or {}, "distance": None,
+                                            "embedding": embeddings[position] if embeddings is not None else None}
+            fused = [(chunk_id, score) for chunk_id, score in fused if chunk_id in candidates]
+            start = time.perf_counter()
+            selected = maximal_marginal_relevance([candidates[chunk_id]['embedding'] for chunk_id, _ in fused],
+                                                  [score for _, score in fused], RETRIEVAL_TOP_K, MMR_LAMBDA)
+            telemetry.observe("mmr_seconds", time.perf_counter() - start)
+            stage.set(candidatos=len(fused), seleccionados=len(selected))
+        return [{"id": fused[i][0], "score": fused[i][1], "text": candidates[fused[i][0]]['text'],
+                 "distance": candidates[fused[i][0]]['distance'], "metadata": candidates[fused[i][0]]['metadata']}
+                for i in selected]
+
+    def _query_vectors(self, sources: list[str], queries: list[str]) -> dict:
+        if IN_MEMORY_VECTOR_SEARCH:
+            return self.vector_cache.query(sources, self.embedding_function(queries), VECTOR_N_RESULTS)
+        # La latencia incluye el embedding de las consultas (normalmente un acierto de la caché).
+        start = time.perf_counter()
+        where = {"source": sources[0]} if len(sources) == 1 else {"source": {"$in": sources}}
+        results = self.collection.query(query_texts=queries, n_results=VECTOR_N_RESULTS, where=where,
+                                        include=["documents", "metadatas", "distances", "embeddings"])
+        telemetry.observe("chroma_query_seconds", time.perf_counter() - start)
+        return results
+
+    def _build_plan_prompt(self, question: str, index_text: str, formatted_history: str) -> str:
+        return f"""
         Eres un Investigador de IA. Tu misión es analizar la pregunta de un usuario y, utilizando el mapa de un libro (Índice Maestro) y el historial de la conversación, generar un plan de búsqueda HÍBRIDO.
         **ÍNDICE MAESTRO DEL DOCUMENTO:**
         ---
-        {json.dumps(master_index, indent=2, ensure_ascii=False)}
+        {index_text}
         ---
         **HISTORIAL DE LA CONVERSACIÓN:**
         ---
@@ -120,46 +695,70 @@ class RAGSystem:
         }}
         ```
         """
-        
-        print("  -> Pidiendo a la IA que genere un plan de búsqueda híbrido...")
-        response_text = self.generation_model.generate_content(translation_prompt).text
-        
+
+    async def _agenerate_search_plan(self, question: str, index_text: str, formatted_history: str) -> dict | None:
+        """Pide a la IA el plan de búsqueda híbrido. Devuelve None si la respuesta no es un JSON válido."""
+        response = await self.generation_model.generate_content_async(self._build_plan_prompt(question, index_text, formatted_history))
         try:
-            search_plan_json = json.loads(re.search(r'```json\s*([\s\S]*?)\s*```', response_text).group(1))
-            optimized_queries = search_plan_json.get("optimized_queries", [question])
-            keywords = search_plan_json.get("keywords", [])
+            search_plan = json.loads(re.search(r'```json\s*([\s\S]*?)\s*```', response.text).group(1))
+            return search_plan if isinstance(search_plan, dict) else None
         except Exception:
-            print("  -> ⚠️ Advertencia: La IA no devolvió un plan de búsqueda válido. Usando búsqueda simple.")
-            optimized_queries = [question]
-            keywords = []
-
-        print(f"--- Consulta [2/3]: Realizando búsqueda híbrida ---")
-        hybrid_queries = []
-        for query in optimized_queries:
-            if keywords:
-                keyword_string = ", ".join(keywords)
-                hybrid_query = f"{query}. Conceptos y entidades clave: {keyword_string}"
-                hybrid_queries.append(hybrid_query)
-            else:
-                hybrid_queries.append(query)
-        
-        print(f"  -> Consultas para embedding: {hybrid_queries}")
+            return None
+
+    async def _aplan_with_speculation(self, question: str, sources: list[str], index_text: str, formatted_history: str, plan_key: tuple) -> tuple[dict | None, list | None]:
+        """
+        Lanza el planificador y, mientras tanto, recupera contexto con la pregunta literal.
+        Si el plan no llega antes de PLANNER_DEADLINE_SECONDS (o no es válido) la consulta
+        sigue con el contexto especulativo.
+        """
+        start = time.monotonic()
+        plan_task = asyncio.ensure_future(self._agenerate_search_plan(question, index_text, formatted_history))
+
+        def cache_plan(task):
+            # Aunque llegue tarde, un plan válido queda guardado para la próxima vez.
+            if not task.cancelled() and task.exception() is None and task.result(): self.plan_cache.put(plan_key, task.result())
+        plan_task.add_done_callback(cache_plan)
 
         try:
-            results = self.collection.query(query_texts=hybrid_queries, n_results=5, where={"source": document_id})
-        except Exception as e: return f"Error al consultar DB: {e}", "", []
-        
-        if not results['documents'] or not results['documents'][0]: return "No se encontró contexto relevante con la búsqueda optimizada.", "", []
-        
-        # --- LÍNEA CORREGIDA ---
-        # Ya no buscamos 'parent_text'. El contexto son los documentos recuperados directamente.
-        context = "\n---\n".join(results['documents'][0])
-        
-        print("--- Consulta [3/3]: Sintetizando la respuesta final ---")
-        prompt_template = self.get_prompt_content(prompt_name)
-        if not prompt_template: return "Error: No se pudo cargar la personalidad.", "", []
-
-        final_prompt = f"""
+            speculative = await self._run_blocking(self._hybrid_retrieve, sources, question, [question], [])
+        except Exception as e:
+            print(f"  -> ⚠️ Falló la recuperación especulativa: {e}")
+            speculative = None
+
+        try:
+            # shield: si vence el plazo, el plan sigue en marcha para poder cachearlo.
+            search_plan = await asyncio.wait_for(asyncio.shield(plan_task), timeout=max(PLANNER_DEADLINE_SECONDS - (time.monotonic() - start), 0))
+        except asyncio.TimeoutError:
+            print(f"  -> ⚠️ El planificador no respondió en {PLANNER_DEADLINE_SECONDS} s.")
+            telemetry.increment("planner_deadline_missed")
+            search_plan = None
+        except asyncio.CancelledError:
+            plan_task.cancel(); raise
+        except Exception as e:
+            print(f"  -> ⚠️ Error del planificador: {e}")
+            search_plan = None
+        return search_plan, speculative
+
+    def _retrieve_for_plan(self, sources: list[str], question: str, search_plan: dict | None, speculative: list | None) -> tuple[dict, list]:
+        """Búsqueda híbrida según el plan (o la pregunta literal), reutilizando la especulativa si la hay."""
+        if not search_plan:
+            search_plan = {"optimized_queries": [question], "keywords": []}
+            if speculative is not None:
+                telemetry.increment("speculative_retrieval", result="usada")
+                return search_plan, speculative
+            print("  -> ⚠️ Advertencia: La IA no devolvió un plan de búsqueda válido. Usando búsqueda simple.")
+            return search_plan, self._hybrid_retrieve(sources, question, [question], [])
+        optimized_queries = search_plan.get("optimized_queries") or [question]
+        keywords = search_plan.get("keywords", [])
+        if speculative is not None and optimized_queries == [question] and not keywords:
+            # El plan no aporta nada sobre la pregunta literal: reutilizamos la búsqueda especulativa.
+            telemetry.increment("speculative_retrieval", result="usada")
+            return search_plan, speculative
+        retrieved = self._hybrid_retrieve(sources, question, optimized_queries, keywords)
+        return search_plan, (_merge_retrievals(retrieved, speculative) if speculative else retrieved)
+
+    def _build_final_prompt(self, prompt_template: str, formatted_history: str, context: str, question: str) -> str:
+        return f"""
         {prompt_template}
         **Historial de la Conversación:**
         {formatted_history}
@@ -169,27 +768,206 @@ class RAGSystem:
         {question}
         **Respuesta:**
         """
-        response = self.generation_model.generate_content(final_prompt)
-        clean_text = re.sub(r'\[Pg \d+\]|\[\d+\]', '', response.text).strip()
-        
-        return clean_text, context, [document_id]
+
+    def _finish_answer(self, answer_key: tuple, response_text: str, context: str, sources: list, chunks: list) -> tuple[str, str, list, list]:
+        clean_text = re.sub(r'\[Pg \d+\]|\[\d+\]', '', response_text).strip()
+        result = (clean_text, context, sources, chunks)
+        self.answer_cache.put(answer_key, result)
+        return result
+
+    async def aquery_stream(self, question: str, document_id: str, prompt_name: str, conversation_history: list | None = None,
+                            cancel_event: threading.Event | None = None, stream: bool = True, profile: bool = False):
+        """
+        Núcleo asíncrono de la consulta. Genera eventos (diccionarios): {"type": "stage"} al empezar
+        cada etapa, {"type": "token"} con cada trozo de la respuesta, y al final uno de
+        {"type": "done"} (respuesta limpia, contexto, fuentes y "chunks": los fragmentos usados, con
+        id, documento, puntuación, distancia y páginas), {"type": "error"} o {"type": "cancelled"}.
+        Se puede cancelar cancelando la tarea o activando cancel_event (se comprueba entre trozos).
+        Con document_id=LIBRARY_SCOPE la pregunta se dirige a los documentos más relevantes de la biblioteca.
+        Con profile=True se guarda un perfil cProfile del hilo del bucle de eventos durante la consulta.
+        """
+        # Tramo raíz manual: el generador puede cerrarse desde fuera (aclose) sin pasar por un with.
+        trace = telemetry.start_span("consulta", profile=profile, documento=os.path.basename(document_id), prompt=prompt_name)
+        stages = self._aquery_stages(question, document_id, prompt_name, conversation_history or [], cancel_event, stream)
+        error = None
+        try:
+            async for event in stages:
+                if event["type"] in ("done", "error", "cancelled"): trace.set(resultado=event["type"])
+                yield event
+        except BaseException as e:
+            # Dejar de iterar tras el evento final (como hace aquery) no es una cancelación.
+            if "resultado" not in trace.attributes: error = e
+            raise
+        finally:
+            # Cerramos las etapas aquí para que sus tramos terminen antes que el raíz.
+            await stages.aclose()
+            trace.end(error)
+
+    async def _aquery_stages(self, question: str, document_id: str, prompt_name: str, conversation_history: list,
+                             cancel_event: threading.Event | None, stream: bool):
+        with telemetry.span("consulta.planificacion", "Consulta [1/3]: Transformando pregunta con el Índice Maestro y el Historial") as stage:
+            yield {"type": "stage", "text": "Analizando la pregunta y planificando la búsqueda..."}
+            if document_id == LIBRARY_SCOPE:
+                sources, doc_version, index_text = await self._run_blocking(self._route_question, question)
+                stage.set(candidatos=[os.path.basename(source) for source in sources])
+            else:
+                sources = [document_id]
+                doc_version = await self._run_blocking(self.metadata_store.get_version, document_id)
+                index_text = await self._run_blocking(self.prompt_builder.compact_index, document_id, doc_version, self._get_master_index)
+            if not index_text:
+                missing = "La biblioteca no tiene documentos." if document_id == LIBRARY_SCOPE else "No se encontró el Índice Maestro."
+                yield {"type": "error", "text": f"Error: {missing}"}
+                return
+
+            formatted_history = await self.prompt_builder.aformat_history(conversation_history)
+            history_hash = stable_hash(conversation_history)
+            plan_key = (document_id, doc_version, normalize_question(question), history_hash)
+            search_plan, speculative = self.plan_cache.get(plan_key), None
+            if search_plan:
+                stage.set(plan="cache")
+            elif SPECULATIVE_RETRIEVAL:
+                search_plan, speculative = await self._aplan_with_speculation(question, sources, index_text, formatted_history, plan_key)
+            else:
+                try:
+                    search_plan = await self._agenerate_search_plan(question, index_text, formatted_history)
+                except Exception as e:
+                    print(f"  -> ⚠️ Error del planificador: {e}")
+                if search_plan: self.plan_cache.put(plan_key, search_plan)
+            stage.set(plan_valido=bool(search_plan), especulativa=speculative is not None)
+        if cancel_event and cancel_event.is_set():
+            yield {"type": "cancelled", "text": ""}
+            return
+
+        with telemetry.span("consulta.recuperacion", "Consulta [2/3]: Realizando búsqueda híbrida") as stage:
+            yield {"type": "stage", "text": "Buscando fragmentos relevantes..."}
+            try:
+                search_plan, retrieved = await self._run_blocking(self._retrieve_for_plan, sources, question, search_plan, speculative)
+            except Exception as e:
+                stage.set(error=repr(e))
+                yield {"type": "error", "text": f"Error al consultar DB: {e}"}
+                return
+            stage.set(fragmentos=len(retrieved))
+        if not retrieved:
+            yield {"type": "error", "text": "No se encontró contexto relevante con la búsqueda optimizada."}
+            return
+
+        # El contexto son los fragmentos recuperados, en el orden de la fusión, hasta agotar el presupuesto.
+        packed = self.prompt_builder.pack_context([(chunk['id'], chunk['text']) for chunk in retrieved])
+        context = "\n---\n".join(text for _, text in packed)
+        # Fragmentos que han entrado en el contexto (con su puntuación y páginas) y sus documentos, por relevancia.
+        packed_ids = {chunk_id for chunk_id, _ in packed}
+        chunks = [_chunk_source(chunk) for chunk in retrieved if chunk['id'] in packed_ids]
+        sources = list(dict.fromkeys(chunk['source'] for chunk in chunks))
+
+        with telemetry.span("consulta.sintesis", "Consulta [3/3]: Sintetizando la respuesta final") as stage:
+            yield {"type": "stage", "text": "Redactando la respuesta..."}
+            prompt_template = await self._run_blocking(self.get_prompt_content, prompt_name)
+            if not prompt_template:
+                yield {"type": "error", "text": "Error: No se pudo cargar la personalidad."}
+                return
+
+            answer_key = (document_id, doc_version, stable_hash(search_plan), tuple(chunk['id'] for chunk in retrieved),
+                          prompt_name, stable_hash(prompt_template), plan_key[2], history_hash)
+            cached_answer = self.answer_cache.get(answer_key)
+            if cached_answer:
+                stage.set(respuesta="cache")
+                yield {"type": "token", "text": cached_answer[0]}
+                yield {"type": "done", "answer": cached_answer[0], "context": cached_answer[1], "sources": cached_answer[2], "chunks": cached_answer[3]}
+                return
+
+            final_prompt = self._build_final_prompt(prompt_template, formatted_history, context, question)
+            parts = []
+            try:
+                if stream:
+                    response = await self.generation_model.generate_content_async(final_prompt, stream=True)
+                    async for chunk in response:
+                        if cancel_event and cancel_event.is_set():
+                            stage.set(cancelada=True)
+                            yield {"type": "cancelled", "text": "".join(parts)}
+                            return
+                        try:
+                            text = chunk.text
+                        except ValueError:
+                            continue  # Trozo sin texto (p. ej. solo metadatos de seguridad).
+                        if not parts: stage.set(primer_token_s=round(time.perf_counter() - stage.started, 3))
+                        parts.append(text)
+                        yield {"type": "token", "text": text}
+                else:
+                    response = await self.generation_model.generate_content_async(final_prompt)
+                    parts.append(response.text)
+            except Exception as e:
+                stage.set(error=repr(e))
+                yield {"type": "error", "text": f"Error al generar la respuesta: {e}"}
+                return
+            answer, context, sources, chunks = self._finish_answer(answer_key, "".join(parts), context, sources, chunks)
+        yield {"type": "done", "answer": answer, "context": context, "sources": sources, "chunks": chunks}
+
+    async def aquery(self, question: str, document_id: str, prompt_name: str, conversation_history: list | None = None,
+                     profile: bool = False) -> tuple[str, str, list]:
+        """Versión asíncrona de query_document_pipeline: devuelve (respuesta, contexto, fuentes)."""
+        async for event in self.aquery_stream(question, document_id, prompt_name, conversation_history, stream=False, profile=profile):
+            if event["type"] == "done": return event["answer"], event["context"], event["sources"]
+            if event["type"] in ("error", "cancelled"): return event["text"], "", []
+        return "", "", []
+
+    def query_document_pipeline(self, question: str, document_id: str, prompt_name: str, conversation_history: list = [],
+                                profile: bool = False) -> tuple[str, str, list]:
+        return self._run_sync(self.aquery(question, document_id, prompt_name, conversation_history, profile))
+
+    def query_document_stream(self, question: str, document_id: str, prompt_name: str, conversation_history: list = [],
+                              cancel_event: threading.Event | None = None, profile: bool = False):
+        """Variante síncrona (generador) de aquery_stream, para consumir desde un hilo cualquiera."""
+        events = queue.Queue()
+
+        async def pump():
+            try:
+                async for event in self.aquery_stream(question, document_id, prompt_name, conversation_history, cancel_event, profile=profile):
+                    events.put(event)
+            except Exception as e:
+                events.put({"type": "error", "text": f"Error inesperado: {e}"})
+            finally:
+                events.put(_END_OF_STREAM)
+
+        asyncio.run_coroutine_threadsafe(pump(), self._loop_for_sync_call())
+        while (event := events.get()) is not _END_OF_STREAM:
+            yield event
+
+    def _route_question(self, question: str) -> tuple[list[str], tuple, str | None]:
+        """
+        Consulta a toda la biblioteca: elige los documentos candidatos por la similitud de la
+        pregunta con el vector de cada Índice Maestro. Devuelve los candidatos, su versión
+        conjunta (para las cachés) y sus Índices Maestros compactos para el planificador.
+        """
+        self.router.sync(self.metadata_store)
+        sources = self.router.route(question, LIBRARY_ROUTING_TOP_N)
+        documents = [(source, self.metadata_store.get_version(source)) for source in sources]
+        documents = [(source, version) for source, version in documents if version is not None]
+        if not documents: return [], (), None
+        return [source for source, _ in documents], tuple(documents), self.prompt_builder.compact_library_index(documents, self._get_master_index)
+
+    def _invalidate_query_caches(self, source: str):
+        # Las claves de ambas cachés empiezan por el id del documento (o LIBRARY_SCOPE).
+        self.plan_cache.invalidate(lambda key: key[0] in (source, LIBRARY_SCOPE))
+        self.answer_cache.invalidate(lambda key: key[0] in (source, LIBRARY_SCOPE))
+        self.vector_cache.invalidate(source)
 
     def get_library_summary(self) -> list[dict]:
-        summaries = []
-        for source, index_data in self.metadata_store.items():
-            summaries.append({
-                'id': source, 'titulo': index_data.get('titulo', os.path.basename(source)),
-                'autor': index_data.get('autor', 'N/A'), 'fecha': index_data.get('fecha_publicacion', 'N/A'),
-                'resumen': index_data.get('resumen_global', 'Sin resumen.'), 'tags': ", ".join(index_data.get('tags', []))
-            })
-        return summaries
+        return self.metadata_store.summaries()
             
     def delete_document(self, document_id: str) -> dict:
+        with self._source_lock(document_id):
+            return self._delete_document(document_id)
+
+    async def adelete(self, document_id: str) -> dict:
+        return await self._run_blocking(self.delete_document, document_id)
+
+    def _delete_document(self, document_id: str) -> dict:
         try:
-            if document_id in self.metadata_store:
-                del self.metadata_store[document_id]
-                self._save_metadata_store()
+            self.metadata_store.delete(document_id)
+            self.router.delete(document_id)
+            self.lexical_store.delete(document_id)
             self.collection.delete(where={"source": document_id})
+            self._invalidate_query_caches(document_id)
             message = f"✅ Documento '{os.path.basename(document_id)}' eliminado completamente."
             return {"success": True, "message": message}
         except Exception as e:
@@ -211,6 +989,7 @@ class RAGSystem:
         if not sanitized_name: return {"success": False, "message": "Nombre inválido."}
         try:
             with open(os.path.join(self.prompts_path, f"{sanitized_name}.txt"), 'w', encoding='utf-8') as f: f.write(content)
+            self.answer_cache.invalidate(lambda key: key[4] == sanitized_name)
             return {"success": True, "message": f"✅ Prompt '{sanitized_name}' guardado."}
         except Exception as e:
             return {"success": False, "message": f"❌ Error al guardar prompt: {e}"}
\ No newline at end of file
@@ -0,0 +1,315 @@
+# benchmark.py (Banco de pruebas sin red)
+import argparse
+import contextlib
+import io
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+try:
+    import resource  # Solo en Unix.
+except ImportError:
+    resource = None
+
+DEFAULT_CORPUS = "documentos_para_rag"
+DEFAULT_QUESTIONS = "benchmark_preguntas.json"
+
+# Métricas que se comparan entre ejecuciones: True si cuanto más alto, mejor.
+COMPARED_METRICS = {
+    ("etapas", "extraccion", "mb_s"): True,
+    ("etapas", "limpieza", "mb_s"): True,
+    ("etapas", "troceado", "fragmentos_s"): True,
+    ("etapas", "ingesta", "fragmentos_s"): True,
+    ("consultas", "latencia_ms", "p50"): False,
+    ("consultas", "latencia_ms", "p90"): False,
+    ("recuperacion", "latencia_ms", "p50"): False,
+    ("recuperacion", "recall_at_k"): True,
+    ("cuantizacion", "int8", "recall_reordenado"): True,
+    ("rss_max_mb",): False,
+}
+
+
+def peak_rss_mb() -> float | None:
+    """
+    Pico de memoria residente del proceso y de sus hijos (pools de procesos), en MB. En Windows,
+    el pico del proceso según psutil (sin los hijos), o None si psutil no está instalado.
+    """
+    if resource is None:
+        try:
+            import psutil
+        except ImportError:
+            return None
+        peak = getattr(psutil.Process().memory_info(), "peak_wset", None)
+        return round(peak / (1024 * 1024), 1) if peak else None
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    # En Linux ru_maxrss está en KB; en macOS, en bytes.
+    divisor = 1024 * 1024 if sys.platform == "darwin" else 1024
+    return round(max(own, children) / divisor, 1)
+
+
+def percentiles(values: list[float]) -> dict:
+    """Percentiles por rango más cercano (en milisegundos)."""
+    if not values: return {}
+    ordered = sorted(values)
+
+    def rank(p):
+        return ordered[min(len(ordered) - 1, max(0, round(p / 100 * len(ordered)) - 1))]
+    return {"p50": round(rank(50) * 1000, 2), "p90": round(rank(90) * 1000, 2), "p99": round(rank(99) * 1000, 2),
+            "media": round(sum(ordered) / len(ordered) * 1000, 2), "n": len(ordered)}
+
+
+def _normalize(text: str) -> str:
+    return " ".join(text.split()).lower()
+
+
+@contextlib.contextmanager
+def _quiet(enabled: bool = True):
+    """Silencia los mensajes de progreso del pipeline mientras se mide."""
+    if not enabled:
+        yield
+        return
+    with contextlib.redirect_stdout(io.StringIO()):
+        yield
+
+
+def build_corpus(corpus_dir: str, scale: int, target_dir: str) -> list[str]:
+    """
+    Corpus de la escala pedida: los documentos originales (escala 1) o `scale` copias de cada
+    uno. Las copias de texto llevan una cabecera distinta para que su contenido no coincida.
+    La copia 0 conserva el nombre original, que es el que citan las preguntas etiquetadas.
+    """
+    from config import SUPPORTED_EXTENSIONS
+    originals = sorted(os.path.join(corpus_dir, f) for f in os.listdir(corpus_dir) if f.lower().endswith(SUPPORTED_EXTENSIONS))
+    if scale == 1: return [os.path.abspath(p) for p in originals]
+    paths = []
+    for original in originals:
+        name, extension = os.path.splitext(os.path.basename(original))
+        for copy in range(scale):
+            target = os.path.join(target_dir, f"{name}{extension}" if copy == 0 else f"{name}_copia{copy}{extension}")
+            if extension.lower() == ".txt" and copy > 0:
+                with open(original, 'r', encoding='utf-8') as src, open(target, 'w', encoding='utf-8') as dst:
+                    dst.write(f"Copia sintética {copy} de {name}\n\n")
+                    shutil.copyfileobj(src, dst)
+            else:
+                shutil.copy(original, target)
+            paths.append(os.path.abspath(target))
+    return paths
+
+
+def bench_cpu_stages(paths: list[str], verbose: bool) -> dict:
+    """Extracción, limpieza y troceado de cada documento, medidos por separado."""
+    from chunker import chunk_pages
+    from extractor import extract_text_from_document
+    from text_cleaner import clean_and_normalize_text, normalize_pages
+
+    times = {"extraccion": 0.0, "limpieza": 0.0, "troceado": 0.0}
+    source_bytes, text_bytes, chunk_count = 0, 0, 0
+    with _quiet(not verbose):
+        for path in paths:
+            source_bytes += os.path.getsize(path)
+            start = time.perf_counter()
+            extracted = extract_text_from_document(path)
+            times["extraccion"] += time.perf_counter() - start
+            pages = extracted if isinstance(extracted, list) else [extracted or ""]
+            text_bytes += sum(len(page.encode("utf-8")) for page in pages)
+
+            start = time.perf_counter()
+            if isinstance(extracted, list):
+                cleaned_pages = list(normalize_pages(enumerate(pages, 1)))
+            else:
+                cleaned_pages = [(None, clean_and_normalize_text(pages[0]))]
+            times["limpieza"] += time.perf_counter() - start
+
+            start = time.perf_counter()
+            chunks = list(chunk_pages(cleaned_pages))
+            times["troceado"] += time.perf_counter() - start
+            chunk_count += len(chunks)
+
+    def rate(amount, seconds):
+        return round(amount / seconds, 2) if seconds else None
+    return {
+        "extraccion": {"segundos": round(times["extraccion"], 3), "mb": round(source_bytes / 1e6, 2), "mb_s": rate(source_bytes / 1e6, times["extraccion"])},
+        "limpieza": {"segundos": round(times["limpieza"], 3), "mb": round(text_bytes / 1e6, 2), "mb_s": rate(text_bytes / 1e6, times["limpieza"])},
+        "troceado": {"segundos": round(times["troceado"], 3), "fragmentos": chunk_count, "fragmentos_s": rate(chunk_count, times["troceado"])},
+    }
+
+
+def bench_ingest(rag_system, paths: list[str], verbose: bool) -> dict:
+    """Ingesta completa con el pipeline masivo (extracción, Índice Maestro, embedding y guardado)."""
+    from add_to_database import ingest_sources
+    start = time.perf_counter()
+    with _quiet(not verbose):
+        results = ingest_sources(rag_system, paths, force=True)
+    seconds = time.perf_counter() - start
+    chunks = sum(len(rag_system._get_ingest_state(path).get("chunk_hashes", [])) for path in paths)
+    failed = [path for path, result in results.items() if not result["success"]]
+    return {"segundos": round(seconds, 3), "documentos": len(paths), "fallidos": len(failed), "fragmentos": chunks,
+            "fragmentos_s": round(chunks / seconds, 2) if seconds else None, "cache_embeddings": rag_system.embedding_cache.stats()}
+
+
+def bench_queries(rag_system, questions: list[dict], documents: dict[str, str], repeats: int, verbose: bool) -> tuple[dict, dict]:
+    """
+    Latencia de la recuperación híbrida y de la consulta completa (con las cachés vacías en cada
+    repetición), y recall@1 / recall@k: proporción de preguntas con el pasaje esperado entre
+    los k primeros fragmentos recuperados.
+    """
+    from config import RETRIEVAL_TOP_K
+    retrieval_times, query_times, hits_at_1, hits_at_k, evaluated = [], [], 0, 0, 0
+    with _quiet(not verbose):
+        for item in questions:
+            document_id = documents.get(item["documento"])
+            if not document_id: continue
+            evaluated += 1
+            passage = _normalize(item["pasaje"])
+            for repeat in range(repeats):
+                start = time.perf_counter()
+                retrieved = rag_system._hybrid_retrieve(document_id, item["pregunta"], [item["pregunta"]], [])
+                retrieval_times.append(time.perf_counter() - start)
+                if repeat == 0:
+                    found = [passage in _normalize(chunk["text"]) for chunk in retrieved[:RETRIEVAL_TOP_K]]
+                    hits_at_1 += bool(found[:1] and found[0])
+                    hits_at_k += any(found)
+
+                rag_system.plan_cache.invalidate(); rag_system.answer_cache.invalidate()
+                start = time.perf_counter()
+                rag_system.query_document_pipeline(item["pregunta"], document_id, item.get("personalidad", "redactor"), [])
+                query_times.append(time.perf_counter() - start)
+    retrieval = {"latencia_ms": percentiles(retrieval_times), "preguntas": evaluated, "k": RETRIEVAL_TOP_K,
+                 "recall_at_1": round(hits_at_1 / evaluated, 3) if evaluated else None,
+                 "recall_at_k": round(hits_at_k / evaluated, 3) if evaluated else None}
+    return {"latencia_ms": percentiles(query_times)}, retrieval
+
+
+def bench_quantization(rag_system, questions: list[dict]) -> dict:
+    """
+    Recall frente a memoria del almacén "cuantizado" con los vectores de la colección: proporción
+    de los k vecinos exactos (float32) que encuentra cada tipo de código, sin y con la
+    re-puntuación en float32 de los QUANTIZED_RESCORE_FACTOR * k mejores candidatos.
+    """
+    import numpy as np
+    from config import QUANTIZED_RESCORE_FACTOR, VECTOR_N_RESULTS
+    from quantized_store import (QUANTIZED_DTYPES, approximate_distances,
+                                 exact_distances, quantize)
+    vectors = np.asarray(rag_system.collection.get(include=["embeddings"])['embeddings'], dtype=np.float32)
+    if not len(vectors) or not questions: return {}
+    queries = np.asarray(rag_system.embedding_function([item["pregunta"] for item in questions]), dtype=np.float32)
+    k = min(VECTOR_N_RESULTS, len(vectors))
+    shortlist = min(len(vectors), k * QUANTIZED_RESCORE_FACTOR)
+    exact = exact_distances(vectors, queries)
+    truth = [set(row) for row in np.argsort(exact, axis=1)[:, :k]]
+    result = {"vectores": len(vectors), "dimension": vectors.shape[1], "k": k,
+              "float32": {"bytes_por_vector": vectors.shape[1] * 4}}
+    for dtype in QUANTIZED_DTYPES:
+        codes, scales = quantize(vectors, dtype)
+        approximate = approximate_distances(codes, scales, np.einsum("ij,ij->i", vectors, vectors), queries)
+        candidates = np.argsort(approximate, axis=1)[:, :shortlist]
+        reranked = [row[np.argsort(exact[i, row])[:k]] for i, row in enumerate(candidates)]
+        # Códigos más escala y norma (float32) de cada vector: lo que la búsqueda mantiene en caché.
+        bytes_per_vector = codes.shape[1] * codes.itemsize + 8
+        result[dtype] = {"bytes_por_vector": bytes_per_vector, "memoria_relativa": round(bytes_per_vector / (vectors.shape[1] * 4), 3),
+                         "recall": round(float(np.mean([len(t & set(row[:k])) / k for t, row in zip(truth, candidates)])), 4),
+                         "recall_reordenado": round(float(np.mean([len(t & set(row)) / k for t, row in zip(truth, reranked)])), 4)}
+    return result
+
+
+def run_scale(args) -> dict:
+    """Ejecuta el banco de pruebas de una escala. Corre en su propio proceso (y su propia base de datos)."""
+    from backend_controller import RAGSystem
+    with tempfile.TemporaryDirectory(prefix="rag_corpus_") as corpus_dir:
+        paths = build_corpus(args.corpus, args.escala_unica, corpus_dir)
+        result = {"escala": args.escala_unica, "documentos": len(paths),
+                  "mb": round(sum(os.path.getsize(p) for p in paths) / 1e6, 2)}
+        print(f"[escala {args.escala_unica}×] {len(paths)} documentos, {result['mb']} MB")
+        result["etapas"] = bench_cpu_stages(paths, args.verbose)
+        with _quiet(not args.verbose):
+            rag_system = RAGSystem()
+        result["etapas"]["ingesta"] = bench_ingest(rag_system, paths, args.verbose)
+        with open(args.preguntas, 'r', encoding='utf-8') as f: questions = json.load(f)
+        documents = {os.path.basename(p): p for p in paths}
+        result["consultas"], result["recuperacion"] = bench_queries(rag_system, questions, documents, args.repeticiones, args.verbose)
+        result["cuantizacion"] = bench_quantization(rag_system, questions)
+        result["rss_max_mb"] = peak_rss_mb()
+    return result
+
+
+def _metric(result: dict, path: tuple):
+    for key in path:
+        if not isinstance(result, dict) or key not in result: return None
+        result = result[key]
+    return result
+
+
+def compare(current: dict, baseline: dict, tolerance: float) -> list[str]:
+    """Lista de regresiones (métricas que empeoran más que la tolerancia relativa) entre dos ejecuciones."""
+    regressions = []
+    baseline_by_scale = {r["escala"]: r for r in baseline.get("resultados", [])}
+    for result in current["resultados"]:
+        previous = baseline_by_scale.get(result["escala"])
+        if not previous: continue
+        for path, higher_is_better in COMPARED_METRICS.items():
+            new, old = _metric(result, path), _metric(previous, path)
+            if not isinstance(new, (int, float)) or not isinstance(old, (int, float)) or old == 0: continue
+            change = (new - old) / abs(old)
+            worse = change < -tolerance if higher_is_better else change > tolerance
+            line = f"[escala {result['escala']}×] {'.'.join(path)}: {old} -> {new} ({change:+.1%})"
+            print(("❌ " if worse else "   ") + line)
+            if worse: regressions.append(line)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Banco de pruebas sin red: ingesta, limpieza, troceado y recuperación.")
+    parser.add_argument("--corpus", default=DEFAULT_CORPUS, help="Directorio con los documentos de referencia.")
+    parser.add_argument("--preguntas", default=DEFAULT_QUESTIONS, help="JSON con las preguntas etiquetadas.")
+    parser.add_argument("--escalas", type=int, nargs="+", default=[1, 10], help="Factores de escala del corpus (p. ej. 1 10 100).")
+    parser.add_argument("--repeticiones", type=int, default=3, help="Repeticiones de cada consulta para los percentiles.")
+    parser.add_argument("--salida", default="benchmark_resultados.json", help="Fichero JSON con los resultados.")
+    parser.add_argument("--comparar", help="JSON de una ejecución anterior: falla si alguna métrica empeora.")
+    parser.add_argument("--tolerancia", type=float, default=0.2, help="Empeoramiento relativo admitido al comparar.")
+    parser.add_argument("--verbose", action="store_true", help="Muestra los mensajes del pipeline.")
+    parser.add_argument("--escala-unica", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.escala_unica:
+        # Proceso hijo: ya tiene el entorno sin red y su base de datos temporal.
+        result = run_scale(args)
+        with open(args.salida, 'w', encoding='utf-8') as f: json.dump(result, f, ensure_ascii=False)
+        return
+
+    results = []
+    for scale in args.escalas:
+        with tempfile.TemporaryDirectory(prefix="rag_bench_db_") as db_dir:
+            # Cada escala corre en un proceso nuevo: base de datos vacía y pico de memoria propio.
+            env = {**os.environ, "RAG_DB_PATH": db_dir}
+            env.setdefault("RAG_GENERATION_PROVIDER", "stub")
+            env.setdefault("RAG_EMBEDDING_PROVIDER", "hashing")
+            scale_output = os.path.join(db_dir, "resultado.json")
+            command = [sys.executable, os.path.abspath(__file__), "--escala-unica", str(scale), "--corpus", args.corpus,
+                       "--preguntas", args.preguntas, "--repeticiones", str(args.repeticiones), "--salida", scale_output]
+            if args.verbose: command.append("--verbose")
+            subprocess.run(command, env=env, check=True)
+            with open(scale_output, 'r', encoding='utf-8') as f: results.append(json.load(f))
+        print(json.dumps(results[-1], ensure_ascii=False, indent=2))
+
+    report = {"fecha": time.strftime("%Y-%m-%dT%H:%M:%S"), "python": sys.version.split()[0],
+              "proveedores": {"generacion": os.getenv("RAG_GENERATION_PROVIDER", "stub"), "embeddings": os.getenv("RAG_EMBEDDING_PROVIDER", "hashing")},
+              "resultados": results}
+    with open(args.salida, 'w', encoding='utf-8') as f: json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"✅ Resultados guardados en '{args.salida}'.")
+
+    if args.comparar:
+        with open(args.comparar, 'r', encoding='utf-8') as f: baseline = json.load(f)
+        regressions = compare(report, baseline, args.tolerancia)
+        if regressions:
+            print(f"❌ {len(regressions)} métricas empeoran más de un {args.tolerancia:.0%}.")
+            sys.exit(1)
+        print("✅ Sin regresiones respecto a la ejecución anterior.")
+
+
+if __name__ == "__main__":
+    main()
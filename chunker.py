@@ -0,0 +1,129 @@
+# chunker.py
+import re
+
+from config import CHUNK_MAX_TOKENS, CHUNK_MIN_TOKENS, CHUNK_OVERLAP_TOKENS
+from prompt_builder import estimate_tokens
+
+_PARAGRAPH_BREAK = re.compile(r'\n[ \t]*\n\s*')
+# Fin de frase: . ! ? … (y comillas o paréntesis de cierre) seguido de espacio.
+_SENTENCE_END = re.compile(r'(?<=[.!?…])["\'»”)\]]*\s+')
+# Encabezados típicos: "Capítulo 3", "CHAPTER IV. ...", "Parte II", "2.1 Métodos", "IV. El agua".
+_HEADING = re.compile(r'^(?:(?i:cap[ií]tulo|chapter|parte|part|secci[oó]n|section|libro|book|lecci[oó]n|lesson)\s+(?:\d+|[IVXLCDMivxlcdm]+)\b'
+                      r'|(?:\d{1,2}(?:\.\d{1,2})+\.?|\d{1,2}[.)]|[IVXLCDM]{1,6}[.)])\s+[A-ZÁÉÍÓÚÑ])')
+_MAX_HEADING_CHARS = 100
+
+
+def _is_heading(line: str) -> bool:
+    """Línea corta que abre una sección: un patrón de encabezado o una línea en mayúsculas."""
+    if not line or len(line) > _MAX_HEADING_CHARS or line[-1] in ",;:": return False
+    if _HEADING.match(line): return True
+    letters = sum(c.isalpha() for c in line)
+    return letters >= 3 and line.isupper()
+
+
+def _iter_paragraphs(text: str):
+    """Párrafos (separados por líneas en blanco) sin copiar el texto entero: tiempo lineal."""
+    start = 0
+    for match in _PARAGRAPH_BREAK.finditer(text):
+        if match.start() > start: yield text[start:match.start()].strip()
+        start = match.end()
+    if start < len(text) and (tail := text[start:].strip()): yield tail
+
+
+def _split_headings(paragraph: str):
+    """
+    Separa los encabezados que van dentro de un párrafo (en textos con una línea por párrafo no
+    hay líneas en blanco antes de "CHAPTER I"). Genera (es_encabezado, texto) en orden.
+    """
+    body = []
+    for line in paragraph.split("\n"):
+        if _is_heading(line.strip()):
+            if body: yield False, "\n".join(body).strip()
+            body = []
+            yield True, line.strip()
+        else:
+            body.append(line)
+    if body and (text := "\n".join(body).strip()): yield False, text
+
+
+def _split_long(text: str, max_tokens: int):
+    """Parte un párrafo demasiado grande en frases y, si una frase tampoco cabe, por espacios."""
+    max_chars = max_tokens * 4
+    start = 0
+    boundaries = [m.end() for m in _SENTENCE_END.finditer(text)] + [len(text)]
+    for end in boundaries:
+        sentence = text[start:end].strip()
+        start = end
+        while len(sentence) > max_chars:
+            cut = sentence.rfind(" ", 0, max_chars)
+            if cut <= max_chars // 2: cut = max_chars
+            yield sentence[:cut].strip()
+            sentence = sentence[cut:].strip()
+        if sentence: yield sentence
+
+
+def chunk_pages(pages, max_tokens: int = CHUNK_MAX_TOKENS, min_tokens: int = CHUNK_MIN_TOKENS,
+                overlap_tokens: int = CHUNK_OVERLAP_TOKENS):
+    """
+    Trocea un flujo de (número de página o None, texto) en fragmentos de hasta max_tokens
+    (estimados), cortando por párrafos y, si hace falta, por frases. Las páginas pequeñas se
+    juntan y las grandes se parten. Un encabezado abre fragmento nuevo si el actual ya tiene
+    min_tokens. Genera (texto, metadatos) con page_start/page_end y heading si se conocen.
+    Es un generador: solo retiene el fragmento en curso.
+    """
+    buffer = []  # (separador, texto, tokens, página, es_solapamiento)
+    state = {"tokens": 0, "fresh": 0, "heading": None, "chunk_heading": None}
+
+    def emit(with_overlap: bool):
+        fresh = [piece for piece in buffer if not piece[4]]
+        page_numbers = [piece[3] for piece in buffer if piece[3] is not None]
+        text = buffer[0][1] + "".join(separator + piece_text for separator, piece_text, *_ in buffer[1:])
+        metadata = {}
+        if page_numbers: metadata.update(page_start=page_numbers[0], page_end=page_numbers[-1])
+        if state["chunk_heading"]: metadata["heading"] = state["chunk_heading"]
+        # Solapamiento: las últimas piezas (frases, normalmente) que quepan en overlap_tokens.
+        tail, tail_tokens = [], 0
+        if with_overlap and overlap_tokens > 0:
+            for piece in reversed(fresh):
+                if tail_tokens + piece[2] > overlap_tokens: break
+                tail.insert(0, (piece[0], piece[1], piece[2], piece[3], True)); tail_tokens += piece[2]
+        buffer[:] = tail
+        state.update(tokens=tail_tokens, fresh=0)
+        return text, metadata
+
+    def add(separator: str, piece: str, page):
+        tokens = estimate_tokens(piece)
+        if buffer and state["tokens"] + tokens > max_tokens:
+            if state["fresh"]:
+                yield emit(with_overlap=True)
+            if state["tokens"] + tokens > max_tokens:
+                buffer.clear(); state["tokens"] = 0
+        if not state["fresh"]: state["chunk_heading"] = state["heading"]
+        buffer.append((separator, piece, tokens, page, False))
+        state["tokens"] += tokens; state["fresh"] += 1
+
+    for page, text in pages:
+        if not text: continue
+        for paragraph in _iter_paragraphs(text):
+            for is_heading, block in _split_headings(paragraph):
+                if is_heading:
+                    if state["fresh"] and state["tokens"] >= min_tokens:
+                        yield emit(with_overlap=False)
+                        buffer.clear(); state["tokens"] = 0
+                    state["heading"] = block
+                    # Si el fragmento aún no llega a min_tokens, el encabezado es donde empieza su contenido:
+                    # con varios seguidos ("BOOK I", "CHAPTER I", "FABULOUS SOURCES"), su sección es la del último.
+                    opens_chunk = state["tokens"] < min_tokens
+                    yield from add("\n\n", block, page)
+                    if opens_chunk: state["chunk_heading"] = block
+                elif estimate_tokens(block) <= max_tokens:
+                    yield from add("\n\n", block, page)
+                else:
+                    for position, sentence in enumerate(_split_long(block, max_tokens)):
+                        yield from add(" " if position else "\n\n", sentence, page)
+    if state["fresh"]: yield emit(with_overlap=False)
+
+
+def chunk_text(text: str, max_tokens: int = CHUNK_MAX_TOKENS, overlap_tokens: int = CHUNK_OVERLAP_TOKENS) -> list[str]:
+    """Trocea un texto continuo (sin páginas) por párrafos y frases."""
+    return [chunk for chunk, _ in chunk_pages([(None, text)], max_tokens=max_tokens, overlap_tokens=overlap_tokens)]
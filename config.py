@@ -1,12 +1,23 @@
 # config.py
+import os
 
 # --- Configuración de la Base de Datos Vectorial ---
-# Nombre del directorio donde se guardará la base de datos persistente.
-DB_PATH = "biblioteca_db"
+# Nombre del directorio donde se guardará la base de datos persistente (RAG_DB_PATH lo sustituye).
+DB_PATH = os.getenv("RAG_DB_PATH", "biblioteca_db")
 
 # Nombre de la colección dentro de ChromaDB.
 COLLECTION_NAME = "tratados"
 
+# Almacén de vectores: "chroma" o "cuantizado" (int8/float16 en ficheros mapeados en memoria, para
+# bibliotecas muy grandes). No se migran datos entre ellos: al cambiar, reingiere o usa otro RAG_DB_PATH.
+VECTOR_STORE = os.getenv("RAG_VECTOR_STORE", "chroma")
+
+# Colección con un vector por documento (de su Índice Maestro), para enrutar las consultas a toda la biblioteca.
+DOCUMENT_COLLECTION_NAME = COLLECTION_NAME + "_documentos"
+
+# Catálogo de documentos (Índices Maestros y huellas de ingesta) en SQLite.
+METADATA_DB_PATH = DB_PATH + "/catalogo.sqlite3"
+
 
 # --- Configuración de los Modelos de IA (Gemini) ---
 # Modelo para la generación de respuestas (el chat).
@@ -15,6 +26,205 @@ GENERATION_MODEL_NAME = "models/gemini-2.0-flash-exp"
 # Modelo para crear los embeddings (los vectores numéricos del texto).
 EMBEDDING_MODEL_NAME = "models/embedding-001"
 
+# --- Configuración de los Proveedores de IA ---
+# Generación: "gemini" o "stub" (LLM determinista, sin red). Embeddings: "gemini" o "hashing"
+# (local, en CPU). Las variables de entorno permiten ejecutar todo sin red en CI o en staging.
+# Cada modelo de embedding tiene su dimensión: al cambiarlo, usa otro RAG_DB_PATH.
+GENERATION_PROVIDER = os.getenv("RAG_GENERATION_PROVIDER", "gemini")
+EMBEDDING_PROVIDER = os.getenv("RAG_EMBEDDING_PROVIDER", "gemini")
+
+# Dimensión de los vectores del proveedor "hashing".
+HASHING_EMBEDDING_DIM = 512
+
+# Política común a todos los proveedores: reintentos con espera exponencial, tiempo máximo
+# por llamada (segundos) y textos por petición de embedding.
+PROVIDER_MAX_RETRIES = 3
+PROVIDER_TIMEOUT_SECONDS = 120
+PROVIDER_RETRY_BACKOFF_SECONDS = 2.0
+EMBEDDING_BATCH_SIZE = 100
+
+# Cuota de Gemini por modelo: peticiones y tokens (estimados) por minuto. Un limitador común a todo
+# el proceso reparte la cuota entre hilos y llamadas; cada 429 reduce el ritmo a la mitad (y con él el
+# tamaño de los lotes de embedding) y pausa las llamadas, y las llamadas correctas lo recuperan poco a poco.
+GENERATION_RPM_LIMIT = 1000
+GENERATION_TPM_LIMIT = 250000
+EMBEDDING_RPM_LIMIT = 1500
+EMBEDDING_TPM_LIMIT = 1000000
+
+# Tokens que se reservan para cada respuesta del modelo de generación.
+GENERATION_RESPONSE_TOKENS = 1000
+
+# Los 429 tienen sus propios reintentos, con una espera exponencial mayor (limitada a un máximo).
+PROVIDER_RATE_LIMIT_RETRIES = 8
+PROVIDER_RATE_LIMIT_BACKOFF_SECONDS = 5.0
+PROVIDER_RATE_LIMIT_MAX_BACKOFF_SECONDS = 60
+
+# --- Configuración de la Caché de Embeddings ---
+# Fichero SQLite donde se guardan los embeddings ya calculados (clave: hash del texto + modelo).
+EMBEDDING_CACHE_PATH = DB_PATH + "/embedding_cache.sqlite3"
+
+# Límites de la caché. Al superarlos se expulsan las entradas usadas hace más tiempo (LRU).
+EMBEDDING_CACHE_MAX_ENTRIES = 200000
+EMBEDDING_CACHE_MAX_MB = 512
+
 # --- Configuración de los Prompts ---
 # Directorio donde se guardan las personalidades de la IA.
-PROMPTS_PATH = "system_prompts"
\ No newline at end of file
+PROMPTS_PATH = "system_prompts"
+
+# --- Configuración de la Ingesta Masiva (add_to_database.py) ---
+# Procesos para la extracción y limpieza de texto (trabajo de CPU).
+BULK_PROCESS_WORKERS = 4
+
+# Hilos para el Índice Maestro y el embedding (llamadas remotas, trabajo de E/S).
+BULK_IO_THREADS = 8
+
+# Extensiones de archivo que se recogen al recorrer un directorio.
+SUPPORTED_EXTENSIONS = (".pdf", ".docx", ".txt")
+
+
+# --- Configuración de la Descarga de URLs ---
+# Las páginas se descargan con una sesión HTTP compartida (conexiones reutilizadas), en paralelo
+# pero con como mucho URL_MAX_CONNECTIONS_PER_HOST descargas a la vez por servidor. Las que traen
+# ETag o Last-Modified se guardan en una caché en disco: al reingerirlas, la petición es condicional
+# y, si no han cambiado, el servidor responde 304 sin volver a enviarlas.
+URL_FETCH_WORKERS = 16
+URL_MAX_CONNECTIONS_PER_HOST = 4
+URL_FETCH_TIMEOUT_SECONDS = 60
+HTTP_CACHE_PATH = DB_PATH + "/cache_http.sqlite3"
+HTTP_CACHE_MAX_MB = 256
+
+
+# --- Configuración de la Cola de Ingesta ---
+# Las ingestas de la interfaz son trabajos persistentes (SQLite) que ejecutan hilos en segundo plano.
+# Cada etapa deja un punto de control: tras un fallo o un reinicio, el trabajo se reanuda desde el
+# último lote de fragmentos guardado. Los fallos se reintentan con espera exponencial (segundos).
+INGEST_JOBS_DB_PATH = DB_PATH + "/cola_ingesta.sqlite3"
+INGEST_WORKERS = 2
+INGEST_JOB_MAX_ATTEMPTS = 3
+INGEST_JOB_RETRY_SECONDS = 30
+
+
+# --- Configuración de la Ingesta de PDFs en Streaming ---
+# Los PDFs se procesan página a página (extraer, limpiar, trocear, embeber) sin cargarlos enteros.
+PDF_STREAMING = True
+
+# Procesos que extraen páginas en paralelo y páginas que procesa cada tarea.
+PDF_EXTRACT_WORKERS = 4
+PDF_PAGES_PER_TASK = 16
+
+# Páginas limpias que pueden esperar en la cola entre la extracción y el embedding.
+PIPELINE_QUEUE_SIZE = 64
+
+
+# --- Configuración de la Recuperación Híbrida ---
+# Directorio con los índices léxicos BM25 (uno por documento), junto a los datos de Chroma.
+LEXICAL_INDEX_PATH = DB_PATH + "/lexico"
+
+# Candidatos que aporta cada búsqueda antes de fusionarlas con Reciprocal Rank Fusion.
+VECTOR_N_RESULTS = 5
+LEXICAL_N_RESULTS = 5
+
+# Fragmentos que pasan al contexto final y constante k de la fusión RRF.
+RETRIEVAL_TOP_K = 5
+RRF_K = 60
+
+# Los MMR_CANDIDATES mejores candidatos fusionados se diversifican con Maximal Marginal Relevance:
+# MMR_LAMBDA = 1 ordena solo por relevancia; valores menores penalizan fragmentos parecidos entre sí.
+MMR_CANDIDATES = 20
+MMR_LAMBDA = 0.7
+
+# Búsqueda vectorial en memoria: los embeddings de los últimos documentos consultados se guardan
+# en matrices NumPy y cada turno del chat se resuelve sin pasar por Chroma. Límites de la caché LRU.
+IN_MEMORY_VECTOR_SEARCH = True
+VECTOR_CACHE_MAX_DOCUMENTS = 16
+VECTOR_CACHE_MAX_MB = 512
+
+# Almacén "cuantizado": directorio, tipo de los códigos ("int8" o "float16") y cuántos candidatos
+# por resultado pedido (n_results * QUANTIZED_RESCORE_FACTOR) se vuelven a puntuar en float32.
+QUANTIZED_STORE_PATH = DB_PATH + "/vectores_cuantizados"
+QUANTIZED_DTYPE = os.getenv("RAG_QUANTIZED_DTYPE", "int8")
+QUANTIZED_RESCORE_FACTOR = 4
+
+
+# --- Configuración de las Cachés de Consulta ---
+# Caché del plan de búsqueda (documento, pregunta normalizada, historial) y de la respuesta final
+# (plan, fragmentos recuperados, personalidad). Se invalidan al reingerir el documento.
+QUERY_CACHE_TTL_SECONDS = 3600
+PLAN_CACHE_MAX_ENTRIES = 512
+ANSWER_CACHE_MAX_ENTRIES = 256
+
+
+# --- Configuración de la Recuperación Especulativa ---
+# Mientras la IA genera el plan de búsqueda se recupera contexto con la pregunta literal.
+# Si el plan no llega antes del plazo (segundos), se responde con ese contexto especulativo.
+SPECULATIVE_RETRIEVAL = True
+PLANNER_DEADLINE_SECONDS = 8.0
+
+
+# --- Configuración de la Interfaz ---
+# Intervalo mínimo (segundos) entre refrescos de la página mientras llega una respuesta en streaming.
+STREAM_UI_UPDATE_INTERVAL = 0.1
+
+
+# --- Configuración de la API Asíncrona ---
+# Hilos del pool acotado donde la API asíncrona ejecuta el trabajo bloqueante (Chroma, extracción, SQLite).
+ASYNC_EXECUTOR_WORKERS = 8
+
+
+# --- Configuración del Índice Maestro Jerárquico ---
+# Los documentos que superan MAX_CHARS_FOR_ANALYSIS se dividen en secciones que se resumen en
+# paralelo (mapa) y se fusionan en un único Índice Maestro (reducción), en lugar de truncarse.
+MASTER_INDEX_HIERARCHICAL = True
+
+# Caracteres por sección y llamadas simultáneas a la IA (la cuota la reparte GENERATION_TPM_LIMIT).
+MASTER_INDEX_SECTION_CHARS = 60000
+MASTER_INDEX_CONCURRENCY = 4
+
+# Resúmenes de sección ya calculados (por hash del texto): una reingesta solo resume lo que cambió.
+SECTION_SUMMARY_CACHE_PATH = DB_PATH + "/resumenes_secciones.sqlite3"
+
+
+# --- Configuración del Presupuesto de Tokens de los Prompts ---
+# Tokens (estimados) para el Índice Maestro compacto del planificador, el historial y el contexto recuperado.
+PLAN_INDEX_TOKEN_BUDGET = 1500
+HISTORY_TOKEN_BUDGET = 1000
+CONTEXT_TOKEN_BUDGET = 6000
+
+# Mensajes más recientes del historial que van siempre literales; los anteriores se resumen
+# cuando el historial no cabe en su presupuesto.
+HISTORY_RECENT_MESSAGES = 4
+
+
+# --- Configuración de la Telemetría ---
+# Tramos cronometrados de cada etapa y métricas (llamadas a la IA, lotes de embedding, latencia
+# de Chroma, aciertos de caché). Exportadores: "jsonl" (trazas.jsonl) y "prometheus" (rag.prom).
+TELEMETRY_DIR = DB_PATH + "/telemetria"
+TELEMETRY_EXPORTERS = tuple(e for e in os.getenv("RAG_TELEMETRY_EXPORTERS", "jsonl,prometheus").split(",") if e)
+
+# Mostrar en consola el inicio de cada etapa y cada cuánto (segundos) volcar las métricas.
+TELEMETRY_CONSOLE = True
+TELEMETRY_FLUSH_INTERVAL_SECONDS = 10
+
+
+# --- Configuración de la Limpieza de Texto ---
+# Cabeceras, pies y números de página repetidos se detectan comparando las primeras y últimas
+# RUNNING_LINES_SCAN líneas de cada página con las de las RUNNING_LINES_WINDOW páginas vecinas
+# (antes y después). Una línea se elimina si aparece en al menos RUNNING_LINES_MIN_RATIO de ellas.
+STRIP_RUNNING_LINES = True
+RUNNING_LINES_SCAN = 2
+RUNNING_LINES_WINDOW = 8
+RUNNING_LINES_MIN_RATIO = 0.5
+RUNNING_LINES_MIN_PAGES = 3
+
+
+# --- Configuración del Troceado ---
+# Tamaño máximo de cada fragmento en tokens estimados (~4 caracteres por token), tamaño a partir
+# del cual un encabezado abre fragmento nuevo, y solapamiento entre fragmentos consecutivos.
+CHUNK_MAX_TOKENS = 750
+CHUNK_MIN_TOKENS = 200
+CHUNK_OVERLAP_TOKENS = 75
+
+
+# --- Configuración de las Consultas a Toda la Biblioteca ---
+# Documentos candidatos (los más cercanos a la pregunta) en los que se buscan fragmentos.
+LIBRARY_ROUTING_TOP_N = 5
@@ -0,0 +1,62 @@
+# document_router.py
+import os
+import threading
+import time
+
+from prompt_builder import index_chapters
+import telemetry
+
+
+def routing_text(master_index: dict, source: str) -> str:
+    """Texto que representa a un documento entero: título, resumen, temas y estructura del Índice Maestro."""
+    tags = master_index.get('tags') or []
+    parts = [str(master_index.get('titulo') or os.path.basename(source)),
+             str(master_index.get('resumen_global') or ""),
+             "Temas: " + ", ".join(map(str, tags)) if tags else "",
+             "\n".join(f"{chapter}: {summary}" for chapter, summary in index_chapters(master_index))]
+    return "\n".join(part for part in parts if part)
+
+
+class DocumentRouter:
+    """
+    Vectores a nivel de documento (uno por Índice Maestro) en una colección de Chroma aparte.
+    Para una pregunta sobre toda la biblioteca devuelve los documentos candidatos, de modo que
+    la búsqueda de fragmentos solo recorre esos documentos aunque la biblioteca sea enorme.
+    """
+
+    def __init__(self, collection):
+        self.collection = collection
+        self._synced = False
+        self._lock = threading.Lock()
+
+    def upsert(self, source: str, master_index: dict):
+        self.collection.upsert(ids=[source], documents=[routing_text(master_index, source)],
+                               metadatas=[{'source': source, 'doc_title': str(master_index.get('titulo') or os.path.basename(source))}])
+
+    def delete(self, source: str):
+        self.collection.delete(ids=[source])
+
+    def sync(self, metadata_store):
+        """
+        Calcula una vez los vectores de los documentos ingeridos antes de existir el enrutado
+        y borra los de documentos que ya no están en el catálogo.
+        """
+        with self._lock:
+            if self._synced: return
+            routed = set(self.collection.get(include=[])['ids'])
+            catalog = {summary['id'] for summary in metadata_store.summaries()}
+            for source in sorted(catalog - routed):
+                master_index = metadata_store.get_master_index(source)
+                if master_index: self.upsert(source, master_index)
+            stale = sorted(routed - catalog)
+            if stale: self.collection.delete(ids=stale)
+            self._synced = True
+
+    def route(self, question: str, top_n: int) -> list[str]:
+        """Los top_n documentos más cercanos a la pregunta, del más al menos relevante."""
+        count = self.collection.count()
+        if not count: return []
+        start = time.perf_counter()
+        results = self.collection.query(query_texts=[question], n_results=min(top_n, count), include=["distances"])
+        telemetry.observe("routing_seconds", time.perf_counter() - start)
+        return results['ids'][0] if results['ids'] else []
@@ -0,0 +1,153 @@
+# embedding_cache.py
+import hashlib
+import math
+import os
+import sqlite3
+import threading
+import time
+from array import array
+
+import telemetry
+
+
+class EmbeddingCache:
+    """
+    Caché persistente de embeddings direccionada por contenido.
+    La clave es (hash SHA-256 del fragmento, nombre del modelo de embedding), de modo que
+    el mismo texto nunca se envía dos veces al modelo remoto. Se guarda en SQLite y
+    expulsa las entradas menos usadas recientemente (LRU) al superar los límites.
+    """
+
+    def __init__(self, path: str, model_name: str, max_entries: int = 200000, max_bytes: int = 512 * 1024 * 1024):
+        self.path = path
+        self.model_name = model_name
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS embeddings (
+                text_hash TEXT NOT NULL,
+                model TEXT NOT NULL,
+                vector BLOB NOT NULL,
+                last_used REAL NOT NULL,
+                PRIMARY KEY (text_hash, model)
+            )""")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_embeddings_last_used ON embeddings(last_used)")
+        self._conn.commit()
+        # Entradas y bytes se cuentan en memoria: comprobar los límites no recorre la tabla en cada escritura.
+        self._entries, self._bytes = self._totals()
+
+    def _totals(self) -> tuple[int, int]:
+        return self._conn.execute("SELECT COUNT(*), COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings").fetchone()
+
+    @staticmethod
+    def text_hash(text: str) -> str:
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def get_many(self, texts: list[str]) -> list[list[float] | None]:
+        """Devuelve el embedding cacheado de cada texto, o None si no está en la caché."""
+        hashes = [self.text_hash(t) for t in texts]
+        found = {}
+        with self._lock:
+            # SQLite limita el número de parámetros por consulta, así que consultamos por tramos.
+            for i in range(0, len(hashes), 500):
+                part = hashes[i:i + 500]
+                placeholders = ",".join("?" * len(part))
+                rows = self._conn.execute(
+                    f"SELECT text_hash, vector FROM embeddings WHERE model = ? AND text_hash IN ({placeholders})",
+                    [self.model_name, *part]).fetchall()
+                found.update(rows)
+            if found:
+                now = time.time()
+                self._conn.executemany("UPDATE embeddings SET last_used = ? WHERE text_hash = ? AND model = ?",
+                                       [(now, h, self.model_name) for h in found])
+                self._conn.commit()
+            results = []
+            for h in hashes:
+                if h in found:
+                    self.hits += 1
+                    results.append(array('f', found[h]).tolist())
+                else:
+                    self.misses += 1
+                    results.append(None)
+        telemetry.increment("cache_requests", len(found), cache="embeddings", result="hit")
+        telemetry.increment("cache_requests", len(hashes) - len(found), cache="embeddings", result="miss")
+        return results
+
+    def put_many(self, texts: list[str], vectors: list[list[float]]):
+        """Guarda los embeddings calculados y aplica los límites de tamaño."""
+        now = time.time()
+        rows = {self.text_hash(t): array('f', v).tobytes() for t, v in zip(texts, vectors)}
+        with self._lock:
+            # Las filas que ya existían se sustituyen: sus bytes se descuentan del total.
+            replaced = []
+            hashes = list(rows)
+            for i in range(0, len(hashes), 500):
+                part = hashes[i:i + 500]
+                replaced += self._conn.execute(
+                    f"SELECT LENGTH(vector) FROM embeddings WHERE model = ? AND text_hash IN ({','.join('?' * len(part))})",
+                    [self.model_name, *part]).fetchall()
+            self._conn.executemany("INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?, ?)",
+                                   [(h, self.model_name, vector, now) for h, vector in rows.items()])
+            self._entries += len(rows) - len(replaced)
+            self._bytes += sum(map(len, rows.values())) - sum(size for size, in replaced)
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        if self._entries <= self.max_entries and self._bytes <= self.max_bytes: return
+        # Solo al superar un límite se recorre la tabla: se recuentan los totales (otro proceso puede
+        # haber escrito) y se borran las filas menos usadas, por tandas, hasta volver a caber.
+        self._entries, self._bytes = self._totals()
+        while self._entries > self.max_entries or self._bytes > self.max_bytes:
+            # Estimamos cuántas filas sobran a partir del tamaño medio de un vector.
+            avg_size = self._bytes / self._entries if self._entries else 1
+            excess = max(self._entries - self.max_entries, math.ceil((self._bytes - self.max_bytes) / avg_size), 1)
+            victims = self._conn.execute("SELECT rowid, LENGTH(vector) FROM embeddings ORDER BY last_used ASC LIMIT ?", (excess,)).fetchall()
+            if not victims: break
+            self._conn.executemany("DELETE FROM embeddings WHERE rowid = ?", [(rowid,) for rowid, _ in victims])
+            self._entries -= len(victims)
+            self._bytes -= sum(size for _, size in victims)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "entries": self._entries,
+                "hit_rate": round(self.hits / total, 3) if total else 0.0}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class CachedEmbeddingFunction:
+    """
+    Envoltorio compatible con las funciones de embedding de ChromaDB.
+    Solo los fragmentos que no están en la caché llegan a la función remota.
+    """
+
+    def __init__(self, embedding_function, cache: EmbeddingCache):
+        self._embedding_function = embedding_function
+        self.cache = cache
+
+    def __call__(self, input: list[str]) -> list[list[float]]:
+        texts = list(input)
+        embeddings = self.cache.get_many(texts)
+        missing = [i for i, e in enumerate(embeddings) if e is None]
+        if missing:
+            # Deduplicamos: un mismo texto repetido en el lote solo se calcula una vez.
+            unique_texts = list(dict.fromkeys(texts[i] for i in missing))
+            new_vectors = [list(map(float, v)) for v in self._embedding_function(unique_texts)]
+            self.cache.put_many(unique_texts, new_vectors)
+            by_text = dict(zip(unique_texts, new_vectors))
+            for i in missing: embeddings[i] = by_text[texts[i]]
+        return embeddings
+
+    def __getattr__(self, name):
+        # Delegamos el resto del protocolo (name, get_config, embed_query...) en la función original.
+        if name.startswith("_"): raise AttributeError(name)
+        return getattr(self._embedding_function, name)
@@ -1,26 +1,75 @@
 # extractor.py (Versión Página por Página)
 import os
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 
 import docx
 import pypdf
 
+import telemetry
+from config import PDF_EXTRACT_WORKERS, PDF_PAGES_PER_TASK
+
+# Pool de procesos compartido para la extracción de páginas. Se crea en el primer uso y lo
+# comparten todas las ingestas en curso, así el número de procesos no crece con ellas.
+_page_pool = None
+_page_pool_lock = threading.Lock()
+
 
 def extract_text_from_pdf_paginated(file_path: str) -> list[str]:
-    """Extrae texto de un archivo PDF, devolviendo una lista de strings, una por página."""
+    """
+    Extrae texto de un archivo PDF, devolviendo una lista de strings, una por página.
+    Las páginas sin texto quedan como cadenas vacías para conservar la numeración.
+    """
     pages_text = []
     try:
         with open(file_path, 'rb') as file:
             reader = pypdf.PdfReader(file)
             for page in reader.pages:
-                text = page.extract_text()
-                if text:  # Solo añadir páginas que contienen texto
-                    pages_text.append(text)
-        print(f"  -> PDF procesado. {len(pages_text)} páginas con texto extraído.")
+                pages_text.append(page.extract_text() or "")
+        telemetry.annotate(paginas=len(pages_text), paginas_con_texto=sum(1 for text in pages_text if text))
         return pages_text
     except Exception as e:
         print(f"  -> ⚠️ Error al leer el PDF '{file_path}': {e}")
         return []
 
+def _get_page_pool() -> ProcessPoolExecutor:
+    global _page_pool
+    with _page_pool_lock:
+        if _page_pool is None: _page_pool = ProcessPoolExecutor(max_workers=PDF_EXTRACT_WORKERS, initializer=telemetry.mark_worker_process)
+        return _page_pool
+
+def _extract_page_range(file_path: str, start: int, end: int) -> list[tuple[int, str]]:
+    """Extrae las páginas [start, end) de un PDF. Se ejecuta en un proceso del pool."""
+    with open(file_path, 'rb') as file:
+        reader = pypdf.PdfReader(file)
+        return [(n + 1, text) for n in range(start, end) if (text := reader.pages[n].extract_text())]
+
+def iter_pdf_pages(file_path: str):
+    """
+    Genera (número de página, texto) de un PDF en orden, sin cargar el documento entero.
+    Los tramos de páginas se extraen en paralelo en varios procesos, con un número acotado
+    de tramos en vuelo para que la memoria no dependa del tamaño del PDF.
+    """
+    with open(file_path, 'rb') as file:
+        total_pages = len(pypdf.PdfReader(file).pages)
+    pool = _get_page_pool()
+    ranges = ((start, min(start + PDF_PAGES_PER_TASK, total_pages)) for start in range(0, total_pages, PDF_PAGES_PER_TASK))
+    pending = deque()
+    for start, end in ranges:
+        pending.append(pool.submit(_extract_page_range, file_path, start, end))
+        if len(pending) >= PDF_EXTRACT_WORKERS * 2: break
+    extracted = 0
+    while pending:
+        pages = pending.popleft().result()
+        next_range = next(ranges, None)
+        if next_range: pending.append(pool.submit(_extract_page_range, file_path, *next_range))
+        extracted += len(pages)
+        yield from pages
+    # Se ejecuta en el hilo productor, fuera del tramo de la ingesta: lo contamos como métrica.
+    telemetry.increment("pdf_pages", extracted, result="texto")
+    telemetry.increment("pdf_pages", total_pages - extracted, result="vacia")
+
 def extract_text_from_docx(file_path: str) -> str:
     """Extrae texto de un archivo DOCX como un solo bloque."""
     try:
@@ -1,28 +1,90 @@
 
 # gemini_provider.py
 import os
+import threading
 
 from dotenv import load_dotenv
-from google.generativeai import GenerativeModel, configure
+from google.generativeai import GenerativeModel, configure, embed_content
 
 # Importamos la configuración centralizada
-from config import EMBEDDING_MODEL_NAME, GENERATION_MODEL_NAME
+from config import (EMBEDDING_MODEL_NAME, EMBEDDING_RPM_LIMIT,
+                    EMBEDDING_TPM_LIMIT, GENERATION_MODEL_NAME,
+                    GENERATION_RPM_LIMIT, GENERATION_TPM_LIMIT)
+from providers import CallPolicy, EmbeddingProvider, GenerationProvider
+from rate_limiter import get_rate_limiter
+
+_setup_lock = threading.Lock()
+_configured = False
 
 
 def setup_gemini():
     """
-    Carga la clave API desde el archivo .env e inicializa el SDK de Gemini.
+    Carga la clave API desde el archivo .env e inicializa el SDK de Gemini (una sola vez por
+    proceso, aunque lo pidan el modelo de generación y el de embeddings).
     """
-    load_dotenv()
-    gemini_api_key = os.getenv("GEMINI_API_KEY")
+    global _configured
+    with _setup_lock:
+        if not _configured:
+            load_dotenv()
+            gemini_api_key = os.getenv("GEMINI_API_KEY")
+
+            if not gemini_api_key:
+                raise ValueError("La clave API de Gemini no se encontró. Asegúrate de tener un archivo .env con 'GEMINI_API_KEY'.")
 
-    if not gemini_api_key:
-        raise ValueError("La clave API de Gemini no se encontró. Asegúrate de tener un archivo .env con 'GEMINI_API_KEY'.")
+            configure(api_key=gemini_api_key)
+            _configured = True
+            print(f"✅ Conexión con Gemini establecida.")
 
-    configure(api_key=gemini_api_key)
-    print(f"✅ Conexión con Gemini establecida.")
-    
     return {
         "generation_model": GenerativeModel(GENERATION_MODEL_NAME),
         "embedding_model_name": EMBEDDING_MODEL_NAME  # Devolvemos solo el nombre
-    }
\ No newline at end of file
+    }
+
+
+class GeminiGenerationProvider(GenerationProvider):
+    """
+    Generación con Gemini. Las respuestas son las del SDK (mismo atributo .text y streaming).
+    Todas las llamadas (Índice Maestro, planificador, síntesis) comparten la cuota del modelo.
+    """
+    model_name = GENERATION_MODEL_NAME
+
+    def __init__(self, policy=None):
+        super().__init__(policy or CallPolicy(limiter=get_rate_limiter(GENERATION_MODEL_NAME, GENERATION_RPM_LIMIT, GENERATION_TPM_LIMIT)))
+        self._model = setup_gemini()["generation_model"]
+
+    def _generate(self, prompt: str, timeout: float):
+        return self._model.generate_content(prompt, request_options={"timeout": timeout})
+
+    async def _agenerate(self, prompt: str):
+        return await self._model.generate_content_async(prompt, request_options={"timeout": self.policy.timeout})
+
+    async def _agenerate_stream(self, prompt: str):
+        # Solo se reintenta la apertura del flujo; los trozos ya recibidos no se repiten.
+        return await self._model.generate_content_async(prompt, stream=True, request_options={"timeout": self.policy.timeout})
+
+
+class GeminiEmbeddingProvider(EmbeddingProvider):
+    """
+    Embeddings de Gemini por lotes y con la política de reintentos. El nombre y la configuración
+    son los de la función de Gemini de ChromaDB, con la que se crearon las colecciones.
+    """
+    model_name = EMBEDDING_MODEL_NAME
+
+    def __init__(self, policy=None):
+        from chromadb.utils import embedding_functions
+        super().__init__(policy or CallPolicy(limiter=get_rate_limiter(EMBEDDING_MODEL_NAME, EMBEDDING_RPM_LIMIT, EMBEDDING_TPM_LIMIT)))
+        setup_gemini()
+        self._embedding_function = embedding_functions.GoogleGenerativeAiEmbeddingFunction(
+            api_key=os.getenv("GEMINI_API_KEY"), model_name=EMBEDDING_MODEL_NAME)
+
+    def _embed_batch(self, texts: list[str], timeout: float) -> list[list[float]]:
+        # Misma petición que la función de ChromaDB (que no admite tiempo máximo), pero el lote entero de una vez.
+        response = embed_content(model=EMBEDDING_MODEL_NAME, content=texts, task_type="RETRIEVAL_DOCUMENT",
+                                 request_options={"timeout": timeout})
+        return [list(map(float, v)) for v in response["embedding"]]
+
+    def name(self) -> str:
+        return self._embedding_function.name()
+
+    def get_config(self) -> dict:
+        return self._embedding_function.get_config()
@@ -0,0 +1,262 @@
+# ingest_jobs.py
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import telemetry
+
+# Estados de un trabajo de ingesta.
+PENDING, RUNNING, DONE, FAILED, CANCELLED = "pendiente", "en_curso", "completado", "fallido", "cancelado"
+ACTIVE_STATES = (PENDING, RUNNING)
+
+# Campos del punto de control que se muestran como progreso (el resto, p. ej. el Índice Maestro, solo se usa al reanudar).
+_PROGRESS_FIELDS = ("embebidos", "actualizados", "fragmentos_total")
+
+
+class IngestJobStore:
+    """
+    Trabajos de ingesta en SQLite: fuente, estado, intentos y el punto de control de cada uno
+    (etapas terminadas y lotes de fragmentos ya guardados). Sobrevive a errores y reinicios.
+    """
+
+    def __init__(self, path: str):
+        self._lock = threading.RLock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        with self._conn:
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    source TEXT NOT NULL,
+                    force INTEGER NOT NULL DEFAULT 0,
+                    status TEXT NOT NULL,
+                    stage TEXT,
+                    checkpoint TEXT NOT NULL DEFAULT '{}',
+                    progress TEXT NOT NULL DEFAULT '{}',
+                    message TEXT,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    not_before REAL NOT NULL DEFAULT 0,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                )""")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status, not_before)")
+
+    def add(self, source: str, force: bool = False) -> int:
+        """Encola una fuente. Si ya tiene un trabajo pendiente o en curso, devuelve ese."""
+        with self._lock, self._conn:
+            row = self._conn.execute("SELECT id FROM jobs WHERE source = ? AND status IN (?, ?)", (source, *ACTIVE_STATES)).fetchone()
+            if row: return row[0]
+            now = time.time()
+            return self._conn.execute("INSERT INTO jobs (source, force, status, created_at, updated_at) VALUES (?, ?, ?, ?, ?)",
+                                      (source, int(force), PENDING, now, now)).lastrowid
+
+    def claim_source(self, source: str, force: bool = False) -> dict:
+        """
+        Trabajo de una fuente que se ingiere fuera de la cola (ingesta masiva), marcado en curso: el
+        último que quedó sin completar (cortado o fallido, con su punto de control) o uno nuevo.
+        """
+        with self._lock, self._conn:
+            row = self._conn.execute("SELECT id FROM jobs WHERE source = ? AND status IN (?, ?, ?) ORDER BY id DESC LIMIT 1",
+                                     (source, *ACTIVE_STATES, FAILED)).fetchone()
+            now = time.time()
+            job_id = row[0] if row else self._conn.execute(
+                "INSERT INTO jobs (source, force, status, created_at, updated_at) VALUES (?, ?, ?, ?, ?)",
+                (source, int(force), RUNNING, now, now)).lastrowid
+            self._conn.execute("UPDATE jobs SET status = ?, attempts = attempts + 1, message = NULL, updated_at = ? WHERE id = ?",
+                               (RUNNING, now, job_id))
+        return self.get(job_id, with_checkpoint=True)
+
+    def claim(self) -> dict | None:
+        """Toma el trabajo pendiente más antiguo que ya puede ejecutarse y lo marca en curso."""
+        with self._lock, self._conn:
+            row = self._conn.execute("SELECT id FROM jobs WHERE status = ? AND not_before <= ? ORDER BY id LIMIT 1",
+                                     (PENDING, time.time())).fetchone()
+            if not row: return None
+            self._conn.execute("UPDATE jobs SET status = ?, attempts = attempts + 1, message = NULL, updated_at = ? WHERE id = ?",
+                               (RUNNING, time.time(), row[0]))
+        return self.get(row[0], with_checkpoint=True)
+
+    def save_checkpoint(self, job_id: int, stage: str, checkpoint: dict):
+        progress = {key: checkpoint[key] for key in _PROGRESS_FIELDS if key in checkpoint}
+        with self._lock, self._conn:
+            self._conn.execute("UPDATE jobs SET stage = ?, checkpoint = ?, progress = ?, updated_at = ? WHERE id = ?",
+                               (stage, json.dumps(checkpoint, ensure_ascii=False), json.dumps(progress), time.time(), job_id))
+
+    def finish(self, job_id: int, status: str, message: str, retry_at: float = 0):
+        """Cierra un intento: completado, fallido, cancelado o (con retry_at) pendiente de reintento."""
+        with self._lock, self._conn:
+            self._conn.execute("UPDATE jobs SET status = ?, message = ?, not_before = ?, updated_at = ? WHERE id = ?",
+                               (status, message, retry_at, time.time(), job_id))
+
+    def requeue(self, job_id: int, reset_attempts: bool = False) -> bool:
+        with self._lock, self._conn:
+            attempts = ", attempts = 0" if reset_attempts else ""
+            return self._conn.execute(f"UPDATE jobs SET status = ?, not_before = 0, updated_at = ?{attempts} WHERE id = ? AND status IN (?, ?)",
+                                      (PENDING, time.time(), job_id, FAILED, CANCELLED)).rowcount > 0
+
+    def cancel_pending(self, job_id: int) -> bool:
+        with self._lock, self._conn:
+            return self._conn.execute("UPDATE jobs SET status = ?, message = ?, updated_at = ? WHERE id = ? AND status = ?",
+                                      (CANCELLED, "Cancelado antes de empezar.", time.time(), job_id, PENDING)).rowcount > 0
+
+    def requeue_interrupted(self) -> int:
+        """Los trabajos que estaban en curso cuando se cerró la aplicación vuelven a la cola (se reanudan)."""
+        with self._lock, self._conn:
+            return self._conn.execute("UPDATE jobs SET status = ?, not_before = 0, updated_at = ? WHERE status = ?",
+                                      (PENDING, time.time(), RUNNING)).rowcount
+
+    def _row_to_job(self, row, with_checkpoint: bool) -> dict:
+        job = {"id": row[0], "source": row[1], "force": bool(row[2]), "status": row[3], "stage": row[4],
+               "progress": json.loads(row[6]), "message": row[7], "attempts": row[8], "not_before": row[9], "updated_at": row[11]}
+        if with_checkpoint: job["checkpoint"] = json.loads(row[5])
+        return job
+
+    def get(self, job_id: int, with_checkpoint: bool = False) -> dict | None:
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._row_to_job(row, with_checkpoint) if row else None
+
+    def recent(self, limit: int = 20) -> list[dict]:
+        """Trabajos activos y los últimos terminados, del más reciente al más antiguo."""
+        with self._lock:
+            rows = self._conn.execute("SELECT * FROM jobs WHERE status IN (?, ?) OR id IN (SELECT id FROM jobs ORDER BY id DESC LIMIT ?) "
+                                      "ORDER BY id DESC", (*ACTIVE_STATES, limit)).fetchall()
+        return [self._row_to_job(row, False) for row in rows]
+
+    def has_pending(self) -> bool:
+        with self._lock:
+            return self._conn.execute("SELECT 1 FROM jobs WHERE status = ? LIMIT 1", (PENDING,)).fetchone() is not None
+
+
+class IngestCheckpoint:
+    """
+    Punto de control de un trabajo en curso. Las etapas de la ingesta guardan aquí lo que ya está
+    hecho (huella de la fuente, Índice Maestro, fragmentos embebidos) y lo consultan para saltárselo al reanudar.
+    """
+
+    def __init__(self, store: IngestJobStore, job_id: int, data: dict | None = None, on_save=None):
+        self.store = store
+        self.job_id = job_id
+        self.data = dict(data or {})
+        self._on_save = on_save
+
+    def get(self, key: str, default=None):
+        return self.data.get(key, default)
+
+    def save(self, stage: str, **values):
+        self.data.update(values)
+        self.store.save_checkpoint(self.job_id, stage, self.data)
+        if self._on_save: self._on_save(self.job_id)
+
+    def reset(self):
+        """La fuente ha cambiado desde el intento anterior: no se reutiliza nada."""
+        self.data = {}
+
+
+class IngestQueue:
+    """
+    Cola persistente de ingestas con hilos trabajadores. Cada trabajo ejecuta la ingesta normal de
+    RAGSystem con un punto de control; si falla, se reintenta más tarde (espera exponencial) desde
+    el último lote guardado, y los que quedaron a medias al cerrar la aplicación se reanudan al arrancar.
+    """
+
+    def __init__(self, rag_system, store: IngestJobStore, workers: int, max_attempts: int, retry_seconds: float):
+        self.rag_system = rag_system
+        self.store = store
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.retry_seconds = retry_seconds
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._running: dict[int, threading.Event] = {}
+        self._running_lock = threading.Lock()
+        self._listeners = []
+        self._threads: list[threading.Thread] = []
+        self._start_lock = threading.Lock()
+
+    def start(self):
+        """Arranca los hilos trabajadores (una sola vez) y reanuda los trabajos interrumpidos."""
+        with self._start_lock:
+            if self._threads: return
+            resumed = self.store.requeue_interrupted()
+            if resumed: print(f"  -> Cola de ingesta: se reanudan {resumed} trabajos interrumpidos.")
+            for n in range(self.workers):
+                thread = threading.Thread(target=self._work, name=f"rag-ingesta-{n}", daemon=True)
+                thread.start(); self._threads.append(thread)
+
+    def stop(self):
+        self._stop.set(); self._wakeup.set()
+
+    def subscribe(self, listener):
+        """listener(trabajo) se llama (desde un hilo trabajador) cada vez que cambia un trabajo."""
+        self._listeners.append(listener)
+
+    def _notify(self, job_id: int):
+        if not self._listeners: return
+        job = self.store.get(job_id)
+        for listener in list(self._listeners):
+            try:
+                listener(job)
+            except Exception as e:
+                print(f"  -> ⚠️ Error al notificar el progreso de la ingesta: {e}")
+
+    def submit(self, source: str, force: bool = False) -> int:
+        job_id = self.store.add(source, force)
+        self._notify(job_id); self._wakeup.set()
+        return job_id
+
+    def cancel(self, job_id: int) -> bool:
+        """Cancela un trabajo pendiente, o uno en curso al terminar la etapa en la que está."""
+        if self.store.cancel_pending(job_id):
+            self._notify(job_id)
+            return True
+        with self._running_lock:
+            cancel_event = self._running.get(job_id)
+        if cancel_event: cancel_event.set()
+        return cancel_event is not None
+
+    def retry(self, job_id: int) -> bool:
+        requeued = self.store.requeue(job_id, reset_attempts=True)
+        if requeued:
+            self._notify(job_id); self._wakeup.set()
+        return requeued
+
+    def jobs(self, limit: int = 20) -> list[dict]:
+        return self.store.recent(limit)
+
+    def _work(self):
+        while not self._stop.is_set():
+            job = self.store.claim()
+            if job is None:
+                # Sin trabajo listo: esperamos a uno nuevo o al siguiente reintento programado.
+                self._wakeup.wait(timeout=1.0); self._wakeup.clear()
+                continue
+            self._run(job)
+
+    def _run(self, job: dict):
+        job_id = job["id"]
+        cancel_event = threading.Event()
+        with self._running_lock: self._running[job_id] = cancel_event
+        self._notify(job_id)
+        checkpoint = IngestCheckpoint(self.store, job_id, job["checkpoint"], on_save=self._notify)
+        try:
+            result = self.rag_system.run_ingest_job(job["source"], job["force"], cancel_event, checkpoint)
+        except Exception as e:
+            result = {"success": False, "message": f"❌ Error inesperado: {e}"}
+        finally:
+            with self._running_lock: self._running.pop(job_id, None)
+
+        if result["success"]:
+            self.store.finish(job_id, DONE, result["message"])
+        elif cancel_event.is_set():
+            self.store.finish(job_id, CANCELLED, result["message"])
+        elif job["attempts"] < self.max_attempts:
+            delay = self.retry_seconds * 2 ** (job["attempts"] - 1)
+            self.store.finish(job_id, PENDING, f"{result['message']} (reintento en {delay:.0f} s)", retry_at=time.time() + delay)
+        else:
+            self.store.finish(job_id, FAILED, result["message"])
+        telemetry.increment("ingest_jobs", result=self.store.get(job_id)["status"])
+        self._notify(job_id)
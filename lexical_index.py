@@ -0,0 +1,124 @@
+# lexical_index.py
+import hashlib
+import heapq
+import json
+import math
+import os
+import re
+import threading
+import unicodedata
+from collections import Counter, OrderedDict
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+# Palabras vacías frecuentes en español e inglés: no aportan nada a la búsqueda léxica.
+STOPWORDS = frozenset("""
+a al algo como con de del desde donde el ella ellos en entre era es esa ese eso esta este esto fue ha han
+hay la las le les lo los mas me mi muy no nos o para pero por que quien se ser si sin sobre su sus tambien
+te tiene todo tu un una uno unos y ya
+and are as at be by for from has in is it its of on or that the this to was were which with
+""".split())
+
+
+def tokenize(text: str) -> list[str]:
+    """Minúsculas, sin tildes y sin palabras vacías. 'Alquimia' y 'alquímia' dan el mismo término."""
+    text = unicodedata.normalize("NFKD", text.lower())
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return [t for t in _TOKEN_RE.findall(text) if len(t) > 1 and t not in STOPWORDS]
+
+
+class BM25Index:
+    """Índice invertido BM25 de los fragmentos de un documento."""
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.ids: list[str] = []
+        self.lengths: list[int] = []
+        self.postings: dict[str, list[tuple[int, int]]] = {}
+
+    def add(self, chunk_id: str, text: str):
+        doc_index = len(self.ids)
+        terms = Counter(tokenize(text))
+        self.ids.append(chunk_id)
+        self.lengths.append(sum(terms.values()))
+        for term, tf in terms.items():
+            self.postings.setdefault(term, []).append((doc_index, tf))
+
+    def search(self, query: str, top_k: int = 5) -> list[tuple[str, float]]:
+        if not self.ids: return []
+        total_docs = len(self.ids)
+        avg_length = sum(self.lengths) / total_docs or 1.0
+        scores: dict[int, float] = {}
+        for term in set(tokenize(query)):
+            postings = self.postings.get(term)
+            if not postings: continue
+            idf = math.log(1 + (total_docs - len(postings) + 0.5) / (len(postings) + 0.5))
+            for doc_index, tf in postings:
+                norm = self.k1 * (1 - self.b + self.b * self.lengths[doc_index] / avg_length)
+                scores[doc_index] = scores.get(doc_index, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+        best = heapq.nlargest(top_k, scores.items(), key=lambda item: item[1])
+        return [(self.ids[doc_index], score) for doc_index, score in best]
+
+    def to_dict(self) -> dict:
+        return {"k1": self.k1, "b": self.b, "ids": self.ids, "lengths": self.lengths, "postings": self.postings}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "BM25Index":
+        index = cls(data["k1"], data["b"])
+        index.ids, index.lengths = data["ids"], data["lengths"]
+        index.postings = {term: [tuple(p) for p in postings] for term, postings in data["postings"].items()}
+        return index
+
+
+class LexicalIndexStore:
+    """
+    Guarda un índice BM25 por fuente junto a los datos de Chroma y mantiene
+    en memoria los últimos usados para que las consultas no relean el disco.
+    """
+
+    def __init__(self, directory: str, max_cached: int = 16):
+        self.directory = directory
+        self.max_cached = max_cached
+        self._cache: OrderedDict[str, BM25Index] = OrderedDict()
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _path_for(self, source: str) -> str:
+        return os.path.join(self.directory, hashlib.sha1(source.encode("utf-8")).hexdigest() + ".json")
+
+    def save(self, source: str, index: BM25Index):
+        path = self._path_for(source)
+        with open(path + ".tmp", 'w', encoding='utf-8') as f: json.dump(index.to_dict(), f, ensure_ascii=False)
+        os.replace(path + ".tmp", path)
+        with self._lock:
+            self._cache[source] = index
+            self._cache.move_to_end(source)
+            while len(self._cache) > self.max_cached: self._cache.popitem(last=False)
+
+    def load(self, source: str) -> BM25Index | None:
+        with self._lock:
+            if source in self._cache:
+                self._cache.move_to_end(source)
+                return self._cache[source]
+        path = self._path_for(source)
+        if not os.path.exists(path): return None
+        with open(path, 'r', encoding='utf-8') as f: index = BM25Index.from_dict(json.load(f))
+        with self._lock:
+            self._cache[source] = index
+            while len(self._cache) > self.max_cached: self._cache.popitem(last=False)
+        return index
+
+    def delete(self, source: str):
+        with self._lock: self._cache.pop(source, None)
+        path = self._path_for(source)
+        if os.path.exists(path): os.remove(path)
+
+
+def reciprocal_rank_fusion(rankings: list[list[str]], k: int = 60) -> list[tuple[str, float]]:
+    """Fusiona varias listas ordenadas de ids: cada aparición suma 1 / (k + posición)."""
+    scores: dict[str, float] = {}
+    for ranking in rankings:
+        for position, item_id in enumerate(ranking, start=1):
+            scores[item_id] = scores.get(item_id, 0.0) + 1.0 / (k + position)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
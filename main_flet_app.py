@@ -1,9 +1,24 @@
 # main_flet_app.py
 import os
+import threading
+import time
+
+# Para el informe de arranque: cuánto tarda en verse la ventana desde que se lanza la aplicación.
+_LAUNCHED = time.perf_counter()
 
 import flet as ft
 
-from backend_controller import RAGSystem
+from backend_controller import LIBRARY_SCOPE, RAGSystem
+from config import STREAM_UI_UPDATE_INTERVAL
+
+
+def describe_chunk(chunk: dict) -> str:
+    """Una línea por fragmento usado: documento, páginas, sección y puntuación de la búsqueda."""
+    pages = ""
+    if chunk.get("page_start"):
+        pages = f", pág. {chunk['page_start']}" + (f"-{chunk['page_end']}" if chunk.get("page_end") not in (None, chunk["page_start"]) else "")
+    heading = f" · {chunk['heading']}" if chunk.get("heading") else ""
+    return f"{os.path.basename(chunk['source'])}{pages}{heading} (puntuación {chunk['score']:.4f})"
 
 
 def main(page: ft.Page):
@@ -43,7 +58,7 @@ def main(page: ft.Page):
     progress_ring_chat = ft.ProgressRing(visible=False, width=20, height=20)
     source_input = ft.TextField(label="Pega una URL o selecciona un archivo local", expand=True)
     add_button = ft.ElevatedButton(text="Añadir a la Biblioteca")
-    progress_indicator_library = ft.Row(controls=[ft.ProgressRing(), ft.Text("Procesando...")], visible=False)
+    jobs_list_view = ft.ListView(spacing=5, height=180)
     library_list_view = ft.ListView(expand=True, spacing=5)
     prompt_dropdown_editor = ft.Dropdown(label="Seleccionar Personalidad para Editar")
     prompt_name_input = ft.TextField(label="Nombre de la Personalidad")
@@ -73,7 +88,7 @@ def main(page: ft.Page):
     def update_library_list():
         library_summary = rag_system.get_library_summary()
         library_list_view.controls.clear()
-        doc_options = []
+        doc_options = [ft.dropdown.Option(key=LIBRARY_SCOPE, text="📚 Toda la biblioteca")] if library_summary else []
         for doc_info in library_summary:
             library_list_view.controls.append(
                 ft.Card(
@@ -92,31 +107,51 @@ def main(page: ft.Page):
         doc_dropdown.options = doc_options
         page.update()
 
-    # --- FUNCIÓN CORREGIDA ---
     def handle_add_document(e):
-        """Maneja el evento de añadir un documento con una sola llamada al pipeline."""
+        """Encola la ingesta: la hacen los hilos de la cola y su progreso aparece en la lista de trabajos."""
         source = source_input.value
         if not source:
             show_snackbar("Por favor, introduce una URL o selecciona un archivo.", ft.Colors.AMBER)
             return
+        rag_system.enqueue_document(source)
+        source_input.value = ""
+        show_snackbar(f"'{os.path.basename(source) or source}' añadido a la cola de ingesta.", ft.Colors.BLUE)
 
-        add_button.disabled = True
-        progress_indicator_library.visible = True
-        page.update()
+    job_icons = {"pendiente": ft.Icons.SCHEDULE, "en_curso": ft.Icons.SYNC, "completado": ft.Icons.CHECK_CIRCLE,
+                 "fallido": ft.Icons.ERROR_OUTLINE, "cancelado": ft.Icons.CANCEL}
 
-        # Llamada única al nuevo pipeline de ingesta
-        result = rag_system.add_document_pipeline(source)
-        
-        add_button.disabled = False
-        progress_indicator_library.visible = False
-        source_input.value = ""
-        
-        if result["success"]:
-            show_snackbar(result["message"], ft.Colors.GREEN)
-            update_library_list()
+    def job_tile(job):
+        progress = job["progress"]
+        details = [job["status"].replace("_", " ")]
+        if job["status"] == "en_curso" and job["stage"]: details.append(job["stage"])
+        if "embebidos" in progress:
+            total = progress.get("fragmentos_total")
+            details.append(f"{progress['embebidos']}/{total} fragmentos" if total else f"{progress['embebidos']} fragmentos")
+        if job["message"] and job["status"] != "en_curso": details.append(job["message"])
+        controls = [ft.Text(" · ".join(details), size=12)]
+        if job["status"] == "en_curso":
+            total = progress.get("fragmentos_total")
+            controls.append(ft.ProgressBar(value=progress.get("embebidos", 0) / total if total else None))
+        if job["status"] in ("pendiente", "en_curso"):
+            action = ft.IconButton(icon=ft.Icons.STOP_CIRCLE_OUTLINED, tooltip="Cancelar", data=job["id"],
+                                   on_click=lambda e: rag_system.ingest_queue.cancel(e.control.data))
+        elif job["status"] in ("fallido", "cancelado"):
+            action = ft.IconButton(icon=ft.Icons.REPLAY, tooltip="Reintentar (continúa desde el último lote guardado)", data=job["id"],
+                                   on_click=lambda e: rag_system.ingest_queue.retry(e.control.data))
         else:
-            show_snackbar(result["message"], ft.Colors.RED)
-        page.update()
+            action = None
+        return ft.ListTile(leading=ft.Icon(job_icons.get(job["status"], ft.Icons.HELP_OUTLINE)), dense=True,
+                           title=ft.Text(os.path.basename(job["source"]) or job["source"]),
+                           subtitle=ft.Column(controls, spacing=2, tight=True), trailing=action)
+
+    jobs_lock = threading.Lock()
+
+    def update_jobs_list(job=None):
+        # Lo llaman los hilos de la cola en cada cambio; al terminar un trabajo, se refresca la biblioteca.
+        with jobs_lock:
+            jobs_list_view.controls = [job_tile(j) for j in rag_system.ingest_queue.jobs()]
+            page.update()
+        if job and job["status"] == "completado": update_library_list()
 
     def handle_delete_document(e):
         result = rag_system.delete_document(e.control.data)
@@ -135,54 +170,90 @@ def main(page: ft.Page):
 
         # Añadir pregunta al historial ANTES de la llamada
         state["conversation_history"].append({"role": "user", "content": question})
+        history = state["conversation_history"]
+        document_id, prompt_name = state["selected_document_id"], state["selected_prompt_name"]
 
-        answer, context, _ = rag_system.query_document_pipeline(
-            question=question, 
-            document_id=state["selected_document_id"], 
-            prompt_name=state["selected_prompt_name"],
-            conversation_history=state["conversation_history"] # Pasamos el historial
-        )
-        
-        # Añadir respuesta al historial
-        state["conversation_history"].append({"role": "assistant", "content": answer})
-
-        # Limitar el historial para que no crezca indefinidamente
-        if len(state["conversation_history"]) > 6: # Mantener los últimos 3 intercambios
-            state["conversation_history"] = state["conversation_history"][-6:]
-
-        sources_view = ft.ExpansionTile(
-            title=ft.Text("Fuentes Consultadas"),
-            controls=[
-                ft.Row([
-                    ft.Text(context, selectable=True, font_family="monospace", expand=True),
-                    ft.IconButton(icon=ft.Icons.COPY, tooltip="Copiar Fuentes", on_click=copy_to_clipboard, data=context)
-                ])
-            ]
-        )
-        
+        # La tarjeta de respuesta se crea vacía y se va rellenando a medida que llegan los tokens.
+        cancel_event = threading.Event()
+        status_text = ft.Text("Pensando...", italic=True, size=12, color=ft.Colors.GREY_400)
+        answer_markdown = ft.Markdown("", selectable=True, extension_set=ft.MarkdownExtensionSet.GITHUB_WEB, on_tap_link=lambda e: page.launch_url(e.data))
+        copy_answer_button = ft.IconButton(icon=ft.Icons.COPY, tooltip="Copiar Respuesta", on_click=copy_to_clipboard, data="")
+        cancel_button = ft.IconButton(icon=ft.Icons.STOP_CIRCLE_OUTLINED, tooltip="Cancelar Respuesta", on_click=lambda _: cancel_event.set())
+        sources_container = ft.Container()
         response_card = ft.Card(
             ft.Container(
                 content=ft.Column([
                     ft.Row(
                         [
-                            ft.Text(f"{state['selected_prompt_name']}:", weight=ft.FontWeight.BOLD, expand=True),
-                            ft.IconButton(icon=ft.Icons.COPY, tooltip="Copiar Respuesta", on_click=copy_to_clipboard, data=answer),
+                            ft.Text(f"{prompt_name}:", weight=ft.FontWeight.BOLD, expand=True),
+                            cancel_button,
+                            copy_answer_button,
                         ],
                         alignment=ft.MainAxisAlignment.SPACE_BETWEEN,
                     ),
-                    ft.Markdown(answer, selectable=True, extension_set=ft.MarkdownExtensionSet.GITHUB_WEB, on_tap_link=lambda e: page.launch_url(e.data)),
-                    sources_view if context else ft.Container(),
+                    status_text,
+                    answer_markdown,
+                    sources_container,
                 ]),
                 padding=10,
             ),
             color=ft.Colors.BLUE_GREY_900,
         )
-        
         chat_view.controls.append(response_card)
-
-        send_button.disabled = False; progress_ring_chat.visible = False
         page.update()
 
+        def finish_answer(answer, context, chunks):
+            # Si el usuario cambió de documento mientras tanto, ese historial ya no está activo.
+            if state["conversation_history"] is history:
+                # Añadir respuesta al historial
+                history.append({"role": "assistant", "content": answer})
+                # Limitar el historial para que no crezca indefinidamente
+                if len(history) > 6: # Mantener los últimos 3 intercambios
+                    del history[:-6]
+
+            answer_markdown.value = answer
+            copy_answer_button.data = answer
+            status_text.visible = False; cancel_button.visible = False
+            if context:
+                sources_container.content = ft.ExpansionTile(
+                    title=ft.Text("Fuentes Consultadas"),
+                    controls=[
+                        *[ft.Text(describe_chunk(chunk), size=12, italic=True) for chunk in chunks],
+                        ft.Row([
+                            ft.Text(context, selectable=True, font_family="monospace", expand=True),
+                            ft.IconButton(icon=ft.Icons.COPY, tooltip="Copiar Fuentes", on_click=copy_to_clipboard, data=context)
+                        ])
+                    ]
+                )
+            send_button.disabled = False; progress_ring_chat.visible = False
+            page.update()
+
+        def stream_answer():
+            """Se ejecuta en un hilo aparte para no bloquear la interfaz mientras llega la respuesta."""
+            answer, context, chunks, streamed, last_update = "", "", [], [], 0.0
+            try:
+                for event in rag_system.query_document_stream(question, document_id, prompt_name, list(history), cancel_event):
+                    if event["type"] == "stage":
+                        status_text.value = event["text"]; page.update()
+                    elif event["type"] == "token":
+                        streamed.append(event["text"])
+                        # Limitamos los refrescos de la página: redibujar el Markdown en cada token es caro.
+                        if time.monotonic() - last_update >= STREAM_UI_UPDATE_INTERVAL:
+                            status_text.visible = False
+                            answer_markdown.value = "".join(streamed); page.update()
+                            last_update = time.monotonic()
+                    elif event["type"] == "done":
+                        answer, context, chunks = event["answer"], event["context"], event.get("chunks", [])
+                    elif event["type"] == "cancelled":
+                        answer = (event["text"] + "\n\n" if event["text"] else "") + "*(Respuesta cancelada)*"
+                    elif event["type"] == "error":
+                        answer = event["text"]
+            except Exception as ex:
+                answer = f"Error inesperado: {ex}"
+            finish_answer(answer, context, chunks)
+
+        threading.Thread(target=stream_answer, daemon=True).start()
+
     def update_prompt_dropdowns():
         prompts = rag_system.list_prompts()
         options = [ft.dropdown.Option(p) for p in prompts]
@@ -229,13 +300,27 @@ def main(page: ft.Page):
                 ft.Divider(), 
                 ft.Row([user_input, send_button, progress_ring_chat])
             ], expand=True)),
-            ft.Tab(text="Biblioteca", icon=ft.Icons.BOOK, content=ft.Column(controls=[ft.Text("Añadir Nuevo Tratado", style=ft.TextThemeStyle.HEADLINE_SMALL), ft.Row([source_input, browse_button, add_button]), progress_indicator_library, ft.Divider(), ft.Text("Tratados en la Biblioteca", style=ft.TextThemeStyle.HEADLINE_SMALL), library_list_view], expand=True, spacing=10)),
+            ft.Tab(text="Biblioteca", icon=ft.Icons.BOOK, content=ft.Column(controls=[ft.Text("Añadir Nuevo Tratado", style=ft.TextThemeStyle.HEADLINE_SMALL), ft.Row([source_input, browse_button, add_button]), ft.Text("Cola de Ingesta", style=ft.TextThemeStyle.TITLE_MEDIUM), jobs_list_view, ft.Divider(), ft.Text("Tratados en la Biblioteca", style=ft.TextThemeStyle.HEADLINE_SMALL), library_list_view], expand=True, spacing=10)),
             ft.Tab(text="Personalidades", icon=ft.Icons.PSYCHOLOGY, content=ft.Column(controls=[prompt_dropdown_editor, prompt_name_input, prompt_content_input, ft.Row([save_prompt_button, new_prompt_button])], expand=True))
         ]
     )
     page.add(tabs)
+    # La biblioteca se pinta con una lectura del catálogo (SQLite); los modelos y la base de datos
+    # vectorial se preparan en segundo plano y, si alguien pregunta antes, al primer uso.
     update_library_list()
     update_prompt_dropdowns()
+    rag_system.startup_timings["ventana"] = time.perf_counter() - _LAUNCHED
+
+    # La lista de la cola se pinta con su SQLite; nos suscribimos antes de que arranque para no perder avisos.
+    rag_system.ingest_queue.subscribe(update_jobs_list)
+    update_jobs_list()
+
+    def on_warmed_up(result):
+        if not result["success"]: show_snackbar(result["message"], ft.Colors.RED)
+        # Con el arranque terminado, la cola reanuda las ingestas que quedaron a medias.
+        rag_system.ingest_queue.start()
+
+    rag_system.start_warm_up(on_warmed_up)
 
 if __name__ == "__main__":
     ft.app(target=main)
\ No newline at end of file
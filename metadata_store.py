@@ -0,0 +1,132 @@
+# metadata_store.py
+import json
+import os
+import sqlite3
+import threading
+import time
+
+
+class MetadataStore:
+    """
+    Catálogo de documentos en SQLite. Cada documento se escribe en su propia transacción,
+    así que un fallo a mitad de escritura no corrompe el resto del catálogo.
+    Los campos bibliográficos y los tags van en columnas indexadas; el Índice Maestro
+    completo (JSON) solo se carga cuando se pide.
+    """
+
+    def __init__(self, path: str, legacy_json_path: str | None = None):
+        self.path = path
+        self._lock = threading.RLock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        with self._conn:
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS documents (
+                    source TEXT PRIMARY KEY,
+                    titulo TEXT,
+                    autor TEXT,
+                    fecha TEXT,
+                    resumen TEXT,
+                    tags TEXT,
+                    master_index TEXT NOT NULL,
+                    ingest_state TEXT NOT NULL DEFAULT '{}',
+                    updated_at REAL NOT NULL
+                )""")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS document_tags (
+                    source TEXT NOT NULL REFERENCES documents(source) ON DELETE CASCADE,
+                    tag TEXT NOT NULL,
+                    PRIMARY KEY (source, tag)
+                )""")
+            for column in ("titulo", "autor", "fecha"):
+                self._conn.execute(f"CREATE INDEX IF NOT EXISTS idx_documents_{column} ON documents({column})")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_document_tags_tag ON document_tags(tag)")
+        if legacy_json_path: self._migrate_from_json(legacy_json_path)
+
+    def _migrate_from_json(self, json_path: str):
+        """
+        Importa el antiguo metadata_store.json en una sola transacción y lo renombra como migrado.
+        La migración termina con el renombrado: si se interrumpe o falla, el JSON sigue ahí y se
+        reintenta entera en el siguiente arranque (sin pisar los documentos que ya estén en SQLite).
+        """
+        if not os.path.exists(json_path): return
+        try:
+            with open(json_path, 'r', encoding='utf-8') as f: legacy_store = json.load(f)
+            with self._lock, self._conn:
+                for source, index_data in legacy_store.items():
+                    if source in self: continue
+                    index_data = dict(index_data)
+                    ingest_state = index_data.pop("_huella", {})
+                    self._write_document(source, index_data, ingest_state)
+        except Exception as e:
+            print(f"  -> ⚠️ No se pudo migrar el catálogo desde '{os.path.basename(json_path)}' (se reintentará): {e}")
+            return
+        os.replace(json_path, json_path + ".migrado")
+        print(f"  -> Catálogo migrado desde '{os.path.basename(json_path)}': {len(legacy_store)} documentos.")
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM documents").fetchone()[0]
+
+    def __contains__(self, source: str) -> bool:
+        with self._lock:
+            return self._conn.execute("SELECT 1 FROM documents WHERE source = ?", (source,)).fetchone() is not None
+
+    def get_master_index(self, source: str) -> dict | None:
+        with self._lock:
+            row = self._conn.execute("SELECT master_index FROM documents WHERE source = ?", (source,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def get_ingest_state(self, source: str) -> dict:
+        with self._lock:
+            row = self._conn.execute("SELECT ingest_state FROM documents WHERE source = ?", (source,)).fetchone()
+        return json.loads(row[0]) if row else {}
+
+    def save_document(self, source: str, master_index: dict, ingest_state: dict):
+        """Guarda (o reemplaza) un documento y sus tags de forma atómica."""
+        with self._lock, self._conn:
+            self._write_document(source, master_index, ingest_state)
+
+    def _write_document(self, source: str, master_index: dict, ingest_state: dict):
+        # Sin transacción propia: la abre quien llama (save_document o la migración completa).
+        tags = [str(tag) for tag in master_index.get('tags', [])]
+        row = (source, master_index.get('titulo', os.path.basename(source)), master_index.get('autor', 'N/A'),
+               master_index.get('fecha_publicacion', 'N/A'), master_index.get('resumen_global', 'Sin resumen.'),
+               ", ".join(tags), json.dumps(master_index, ensure_ascii=False), json.dumps(ingest_state, ensure_ascii=False), time.time())
+        self._conn.execute("INSERT OR REPLACE INTO documents VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", row)
+        self._conn.execute("DELETE FROM document_tags WHERE source = ?", (source,))
+        self._conn.executemany("INSERT OR IGNORE INTO document_tags VALUES (?, ?)", [(source, tag) for tag in tags])
+
+    def get_version(self, source: str) -> float | None:
+        """Marca de tiempo de la última escritura del documento; cambia con cada reingesta."""
+        with self._lock:
+            row = self._conn.execute("SELECT updated_at FROM documents WHERE source = ?", (source,)).fetchone()
+        return row[0] if row else None
+
+    def update_ingest_state(self, source: str, ingest_state: dict):
+        # No toca updated_at: refrescar la huella de un documento sin cambios no es una nueva versión.
+        with self._lock, self._conn:
+            self._conn.execute("UPDATE documents SET ingest_state = ? WHERE source = ?",
+                               (json.dumps(ingest_state, ensure_ascii=False), source))
+
+    def delete(self, source: str) -> bool:
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM document_tags WHERE source = ?", (source,))
+            return self._conn.execute("DELETE FROM documents WHERE source = ?", (source,)).rowcount > 0
+
+    def summaries(self, autor: str | None = None, tag: str | None = None) -> list[dict]:
+        """Resumen del catálogo leído de las columnas indexadas, sin cargar los Índices Maestros."""
+        query = "SELECT source, titulo, autor, fecha, resumen, tags FROM documents"
+        conditions, params = [], []
+        if autor: conditions.append("autor = ?"); params.append(autor)
+        if tag: conditions.append("source IN (SELECT source FROM document_tags WHERE tag = ?)"); params.append(tag)
+        if conditions: query += " WHERE " + " AND ".join(conditions)
+        with self._lock:
+            rows = self._conn.execute(query + " ORDER BY titulo COLLATE NOCASE", params).fetchall()
+        return [{'id': row[0], 'titulo': row[1], 'autor': row[2], 'fecha': row[3], 'resumen': row[4], 'tags': row[5]}
+                for row in rows]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,181 @@
+# prompt_builder.py
+import hashlib
+
+from query_cache import TTLCache
+
+
+def estimate_tokens(text: str) -> int:
+    """Estimación rápida sin tokenizador: ~4 caracteres por token."""
+    return (len(text) + 3) // 4
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """Recorta el texto al presupuesto, cortando en el último espacio para no partir palabras."""
+    max_chars = max_tokens * 4
+    if len(text) <= max_chars: return text
+    cut = text.rfind(" ", 0, max_chars)
+    return text[:cut if cut > max_chars // 2 else max_chars] + " [...]"
+
+
+def format_messages(messages: list[dict]) -> str:
+    return "\n".join(f"{msg['role']}: {msg['content']}" for msg in messages)
+
+
+def index_chapters(master_index: dict) -> list[tuple[str, str]]:
+    """Capítulos (nombre, resumen) del índice estructurado; ninguno si la IA no lo devolvió como un mapa."""
+    structure = master_index.get('indice_estructurado')
+    return [(str(chapter), str(summary)) for chapter, summary in structure.items()] if isinstance(structure, dict) else []
+
+
+def render_master_index(master_index: dict, max_tokens: int) -> str:
+    """
+    Versión compacta (texto plano, sin sangrías JSON) del Índice Maestro. Si no cabe en el
+    presupuesto, los últimos capítulos aparecen solo con su nombre y después se omiten.
+    """
+    header = [f"Título: {master_index.get('titulo', 'No disponible')}",
+              f"Autor: {master_index.get('autor', 'No disponible')} ({master_index.get('fecha_publicacion', 'No disponible')})",
+              f"Resumen: {master_index.get('resumen_global', 'No disponible')}"]
+    tags = master_index.get('tags') or []
+    footer = [f"Temas: {', '.join(map(str, tags))}"] if tags else []
+    lines = [truncate_to_tokens(line, max_tokens // 4) for line in header] + ["Índice:"]
+    used = estimate_tokens("\n".join(lines + footer))
+    chapters = index_chapters(master_index)
+    for position, (chapter, summary) in enumerate(chapters):
+        line = f"- {chapter}: {summary}"
+        if used + estimate_tokens(line) > max_tokens:
+            line = f"- {chapter}"
+            if used + estimate_tokens(line) > max_tokens:
+                lines.append(f"- ... ({len(chapters) - position} secciones más)")
+                break
+        lines.append(line); used += estimate_tokens(line) + 1
+    return "\n".join(lines + footer)
+
+
+def pack_context(retrieved: list[tuple[str, str]], max_tokens: int, min_tokens: int = 200) -> list[tuple[str, str]]:
+    """
+    Mete fragmentos (id, texto), ya ordenados por puntuación, hasta agotar el presupuesto.
+    El primero que no cabe se recorta si queda sitio suficiente; el mejor fragmento siempre entra.
+    """
+    packed, used = [], 0
+    for chunk_id, text in retrieved:
+        remaining = max_tokens - used
+        tokens = estimate_tokens(text)
+        if tokens <= remaining:
+            packed.append((chunk_id, text)); used += tokens
+            continue
+        if remaining >= min_tokens or not packed:
+            packed.append((chunk_id, truncate_to_tokens(text, max(remaining, min_tokens))))
+        break
+    return packed
+
+
+def _chain_hashes(messages: list[dict]) -> list[str]:
+    """Hash encadenado de cada prefijo del historial: hashes[i] identifica messages[:i]."""
+    hashes = [""]
+    for msg in messages:
+        payload = f"{hashes[-1]}\x00{msg['role']}\x00{msg['content']}"
+        hashes.append(hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16])
+    return hashes
+
+
+class PromptBuilder:
+    """
+    Ensambla las partes variables de los prompts con un presupuesto de tokens por sección:
+    Índice Maestro compacto (cacheado por versión del documento), historial con los turnos
+    antiguos resumidos de forma incremental y contexto empaquetado por puntuación.
+    """
+
+    def __init__(self, get_generation_model, index_tokens: int, history_tokens: int, recent_messages: int,
+                 context_tokens: int, max_cached: int = 256, ttl_seconds: float = 3600):
+        # El modelo solo hace falta para resumir historiales largos: se pide al primer resumen.
+        self._get_generation_model = get_generation_model
+        self.index_tokens = index_tokens
+        self.history_tokens = history_tokens
+        self.recent_messages = recent_messages
+        self.context_tokens = context_tokens
+        self._compact_indexes = TTLCache(max_cached, ttl_seconds, name="indices_compactos")
+        self._history_summaries = TTLCache(max_cached, ttl_seconds, name="resumenes_historial")
+
+    def compact_index(self, document_id: str, version, load_master_index) -> str | None:
+        """Índice Maestro compacto; load_master_index(document_id) solo se llama si no está en caché."""
+        key = (document_id, version, self.index_tokens)
+        rendered = self._compact_indexes.get(key)
+        if rendered is None:
+            master_index = load_master_index(document_id)
+            if not master_index: return None
+            rendered = render_master_index(master_index, self.index_tokens)
+            self._compact_indexes.put(key, rendered)
+        return rendered
+
+    def compact_library_index(self, documents: list[tuple[str, float]], load_master_index) -> str | None:
+        """
+        Índices compactos de varios documentos (source, versión) para una consulta sobre la
+        biblioteca. Se reparten el presupuesto, con un mínimo por documento.
+        """
+        per_document = max(self.index_tokens // max(len(documents), 1), 150)
+        sections = []
+        for document_id, version in documents:
+            key = (document_id, version, per_document)
+            rendered = self._compact_indexes.get(key)
+            if rendered is None:
+                master_index = load_master_index(document_id)
+                if not master_index: continue
+                rendered = render_master_index(master_index, per_document)
+                self._compact_indexes.put(key, rendered)
+            sections.append(f"[Documento: {document_id}]\n{rendered}")
+        return "\n\n".join(sections) or None
+
+    def precompute_index(self, document_id: str, version, master_index: dict):
+        self._compact_indexes.put((document_id, version, self.index_tokens), render_master_index(master_index, self.index_tokens))
+
+    async def aformat_history(self, messages: list[dict]) -> str:
+        """
+        Historial para los prompts. Si cabe en el presupuesto va literal; si no, los mensajes
+        anteriores a los recent_messages últimos se sustituyen por un resumen. El resumen se
+        amplía de forma incremental (el del prefijo más largo ya resumido + los mensajes nuevos).
+        """
+        verbatim = format_messages(messages)
+        if estimate_tokens(verbatim) <= self.history_tokens: return verbatim
+
+        split = max(len(messages) - self.recent_messages, 0)
+        older, recent = messages[:split], messages[split:]
+        per_message = max(self.history_tokens // (2 * max(len(recent), 1)), 50)
+        recent_text = format_messages([{**msg, 'content': truncate_to_tokens(msg['content'], per_message)} for msg in recent])
+        if not older: return recent_text
+
+        summary = await self._asummarize(older)
+        if not summary: return recent_text
+        return f"(Resumen de la conversación anterior: {summary})\n{recent_text}"
+
+    async def _asummarize(self, older: list[dict]) -> str | None:
+        hashes = _chain_hashes(older)
+        summary = self._history_summaries.get(hashes[-1])
+        if summary: return summary
+        # Buscamos el prefijo más largo ya resumido para resumir solo los mensajes posteriores.
+        start, previous = 0, ""
+        for i in range(len(older) - 1, 0, -1):
+            cached = self._history_summaries.get(hashes[i])
+            if cached:
+                start, previous = i, cached
+                break
+        summary_budget = self.history_tokens // 2
+        prompt = f"""
+        Resume la siguiente conversación entre un usuario y un asistente sobre un documento, en un máximo de {summary_budget * 3 // 4} palabras.
+        Conserva los temas tratados, los datos concretos y las preguntas pendientes. Responde solo con el resumen.
+        **Resumen previo de la conversación:**
+        {previous or "(ninguno)"}
+        **Mensajes nuevos:**
+        {format_messages([{**msg, 'content': truncate_to_tokens(msg['content'], self.history_tokens)} for msg in older[start:]])}
+        """
+        try:
+            response = await self._get_generation_model().generate_content_async(prompt)
+            summary = truncate_to_tokens(response.text.strip(), summary_budget)
+        except Exception as e:
+            print(f"  -> ⚠️ No se pudo resumir el historial: {e}")
+            return previous or None
+        print(f"  -> Historial resumido ({len(older) - start} mensajes nuevos en el resumen).")
+        self._history_summaries.put(hashes[-1], summary)
+        return summary
+
+    def pack_context(self, retrieved: list[tuple[str, str]]) -> list[tuple[str, str]]:
+        return pack_context(retrieved, self.context_tokens)
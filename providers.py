@@ -0,0 +1,340 @@
+# providers.py
+import asyncio
+import hashlib
+import itertools
+import json
+import random
+import re
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import Counter
+
+import numpy as np
+
+from config import (EMBEDDING_BATCH_SIZE, EMBEDDING_PROVIDER,
+                    GENERATION_PROVIDER, GENERATION_RESPONSE_TOKENS,
+                    HASHING_EMBEDDING_DIM, PROVIDER_MAX_RETRIES,
+                    PROVIDER_RATE_LIMIT_BACKOFF_SECONDS,
+                    PROVIDER_RATE_LIMIT_MAX_BACKOFF_SECONDS,
+                    PROVIDER_RATE_LIMIT_RETRIES,
+                    PROVIDER_RETRY_BACKOFF_SECONDS, PROVIDER_TIMEOUT_SECONDS)
+import telemetry
+from lexical_index import tokenize
+from prompt_builder import estimate_tokens
+from rate_limiter import RateLimiter, is_rate_limit_error, retry_after_seconds
+
+
+class CallPolicy:
+    """
+    Reintentos con espera exponencial y tiempo máximo por llamada, comunes a todos los proveedores.
+    Las funciones síncronas reciben el tiempo máximo (timeout=) y lo pasan a su petición HTTP: así
+    una llamada que no responde se corta en el propio cliente en vez de dejar un hilo colgado.
+    Con un limitador, cada intento espera su turno en la cuota y los 429 tienen reintentos propios.
+    """
+
+    def __init__(self, max_retries: int = PROVIDER_MAX_RETRIES, timeout: float = PROVIDER_TIMEOUT_SECONDS,
+                 backoff: float = PROVIDER_RETRY_BACKOFF_SECONDS, limiter: RateLimiter | None = None,
+                 rate_limit_retries: int = PROVIDER_RATE_LIMIT_RETRIES,
+                 rate_limit_backoff: float = PROVIDER_RATE_LIMIT_BACKOFF_SECONDS):
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.backoff = backoff
+        self.limiter = limiter
+        self.rate_limit_retries = rate_limit_retries
+        self.rate_limit_backoff = rate_limit_backoff
+
+    def _wait_before_retry(self, attempt: int, error: Exception) -> float:
+        """Segundos hasta el siguiente intento; relanza el error si ya no quedan."""
+        if is_rate_limit_error(error):
+            if attempt >= self.rate_limit_retries: raise error
+            delay = min(self.rate_limit_backoff * 2 ** attempt, PROVIDER_RATE_LIMIT_MAX_BACKOFF_SECONDS)
+            delay = max(delay, retry_after_seconds(error) or 0)
+            if self.limiter: self.limiter.on_rate_limited(delay)
+            telemetry.increment("provider_retries", error="429")
+            print(f"  -> ⚠️ Proveedor: cuota superada (429). Reintentando en {delay:.1f} s a menor ritmo...")
+            # Con limitador, la pausa la impone él (a todas las llamadas); el margen aleatorio evita que se despierten a la vez.
+            return delay * random.uniform(1.0, 1.25)
+        if attempt >= self.max_retries: raise error
+        delay = self.backoff * 2 ** attempt
+        telemetry.increment("provider_retries", error=type(error).__name__)
+        print(f"  -> ⚠️ Proveedor: intento {attempt + 1} fallido ({error}). Reintentando en {delay:.1f} s...")
+        return delay
+
+    def call(self, func, *args, tokens: int = 0):
+        """
+        Ejecuta func(*args, timeout=self.timeout) con la política. tokens: los que consumirá la
+        petición (estimados), para el limitador.
+        """
+        for attempt in itertools.count():
+            if self.limiter: self.limiter.acquire(tokens)
+            try:
+                result = func(*args, timeout=self.timeout)
+                if self.limiter: self.limiter.on_success()
+                return result
+            except Exception as e:
+                error = e
+            time.sleep(self._wait_before_retry(attempt, error))
+
+    async def acall(self, func, *args, tokens: int = 0):
+        for attempt in itertools.count():
+            if self.limiter: await self.limiter.aacquire(tokens)
+            try:
+                result = await asyncio.wait_for(func(*args), timeout=self.timeout)
+                if self.limiter: self.limiter.on_success()
+                return result
+            except asyncio.TimeoutError:
+                error = TimeoutError(f"sin respuesta en {self.timeout} s")
+            except Exception as e:
+                error = e
+            await asyncio.sleep(self._wait_before_retry(attempt, error))
+
+
+class GenerationResponse:
+    """Respuesta mínima con la misma forma que las de Gemini (atributo .text)."""
+
+    def __init__(self, text: str):
+        self.text = text
+
+
+class GenerationProvider(ABC):
+    """
+    Interfaz de los modelos de generación, con la forma de GenerativeModel de Gemini:
+    generate_content(prompt) y generate_content_async(prompt, stream=False). Con stream=True
+    la versión asíncrona devuelve un iterable asíncrono de trozos con atributo .text.
+    """
+    model_name = "desconocido"
+
+    def __init__(self, policy: CallPolicy | None = None):
+        self.policy = policy or CallPolicy()
+
+    def generate_content(self, prompt: str) -> GenerationResponse:
+        start = time.perf_counter()
+        response = self.policy.call(self._generate, prompt, tokens=self._request_tokens(prompt))
+        self._record_call(prompt, start, self._response_chars(response))
+        return response
+
+    async def generate_content_async(self, prompt: str, stream: bool = False):
+        start = time.perf_counter()
+        tokens = self._request_tokens(prompt)
+        if stream: return self._counted_stream(prompt, start, await self.policy.acall(self._agenerate_stream, prompt, tokens=tokens))
+        response = await self.policy.acall(self._agenerate, prompt, tokens=tokens)
+        self._record_call(prompt, start, self._response_chars(response))
+        return response
+
+    @staticmethod
+    def _request_tokens(prompt: str) -> int:
+        # El prompt más un margen para la respuesta: ambos cuentan en la cuota de tokens por minuto.
+        return estimate_tokens(prompt) + GENERATION_RESPONSE_TOKENS
+
+    def _record_call(self, prompt: str, start: float, response_chars: int):
+        telemetry.increment("llm_calls", provider=self.model_name)
+        telemetry.increment("llm_prompt_chars", len(prompt), provider=self.model_name)
+        telemetry.increment("llm_prompt_tokens_estimated", estimate_tokens(prompt), provider=self.model_name)
+        telemetry.increment("llm_response_chars", response_chars, provider=self.model_name)
+        telemetry.observe("llm_seconds", time.perf_counter() - start, provider=self.model_name)
+
+    @staticmethod
+    def _response_chars(response) -> int:
+        try:
+            return len(response.text)
+        except ValueError:
+            return 0  # Respuesta sin texto (p. ej. bloqueada por los filtros de seguridad).
+
+    async def _counted_stream(self, prompt: str, start: float, chunks):
+        response_chars = 0
+        try:
+            async for chunk in chunks:
+                response_chars += self._response_chars(chunk)
+                yield chunk
+        finally:
+            self._record_call(prompt, start, response_chars)
+
+    @abstractmethod
+    def _generate(self, prompt: str, timeout: float):
+        """Una petición al modelo, que no debe esperar más de timeout segundos."""
+
+    async def _agenerate(self, prompt: str):
+        return await asyncio.to_thread(self._generate, prompt, self.policy.timeout)
+
+    async def _agenerate_stream(self, prompt: str):
+        # Por defecto, la respuesta completa en un único trozo.
+        response = await self._agenerate(prompt)
+
+        async def single_chunk():
+            yield response
+        return single_chunk()
+
+
+class EmbeddingProvider(ABC):
+    """
+    Interfaz de los modelos de embedding, compatible con las funciones de embedding de ChromaDB
+    (__call__(input)). Divide las peticiones en lotes y aplica la política de llamadas a cada uno.
+    Con un limitador, el tamaño de lote sigue al ritmo que permite la cuota (menor tras cada 429).
+    """
+    model_name = "desconocido"
+
+    def __init__(self, policy: CallPolicy | None = None, batch_size: int = EMBEDDING_BATCH_SIZE):
+        self.policy = policy or CallPolicy()
+        self.batch_size = batch_size
+
+    def current_batch_size(self) -> int:
+        """Textos por petición: EMBEDDING_BATCH_SIZE, reducido en proporción al ritmo actual del limitador."""
+        limiter = self.policy.limiter
+        return self.batch_size if limiter is None else max(1, int(self.batch_size * limiter.scale))
+
+    def _batches(self, texts: list[str]):
+        # Cada lote, además, cabe en los tokens que la cuota deja enviar en un minuto.
+        limiter = self.policy.limiter
+        batch, batch_tokens = [], 0
+        for text in texts:
+            tokens = estimate_tokens(text)
+            if batch and (len(batch) >= self.current_batch_size() or (limiter and batch_tokens + tokens > limiter.token_capacity)):
+                yield batch, batch_tokens
+                batch, batch_tokens = [], 0
+            batch.append(text); batch_tokens += tokens
+        if batch: yield batch, batch_tokens
+
+    def __call__(self, input: list[str]) -> list[list[float]]:
+        vectors = []
+        for batch, tokens in self._batches(list(input)):
+            start = time.perf_counter()
+            vectors.extend(self.policy.call(self._embed_batch, batch, tokens=tokens))
+            telemetry.increment("embedding_batches", provider=self.model_name)
+            telemetry.increment("embedding_texts", len(batch), provider=self.model_name)
+            telemetry.observe("embedding_seconds", time.perf_counter() - start, provider=self.model_name)
+        return vectors
+
+    def embed_query(self, input: list[str]) -> list[list[float]]:
+        return self(input)
+
+    @abstractmethod
+    def _embed_batch(self, texts: list[str], timeout: float) -> list[list[float]]:
+        """Embeddings de un lote en una petición, que no debe esperar más de timeout segundos."""
+
+    def name(self) -> str:
+        return self.model_name
+
+    def get_config(self) -> dict:
+        return {"model_name": self.model_name}
+
+
+class HashingEmbeddingProvider(EmbeddingProvider):
+    """
+    Embeddings locales en CPU, sin red: hashing de términos y bigramas (con signo) sobre un
+    vector de dimensión fija, con tf sublineal y norma L2. Deterministas entre ejecuciones.
+    """
+
+    def __init__(self, dim: int = HASHING_EMBEDDING_DIM, policy: CallPolicy | None = None):
+        super().__init__(policy)
+        self.dim = dim
+        self.model_name = f"hashing-{dim}"
+
+    def _features(self, text: str) -> Counter:
+        terms = tokenize(text)
+        return Counter(terms + [f"{a} {b}" for a, b in zip(terms, terms[1:])])
+
+    def _embed_batch(self, texts: list[str], timeout: float | None = None) -> list[list[float]]:
+        matrix = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for feature, count in self._features(text).items():
+                digest = int.from_bytes(hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "little")
+                sign = 1.0 if digest & 1 else -1.0
+                matrix[row, (digest >> 1) % self.dim] += sign * (1.0 + np.log(count))
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        return (matrix / np.where(norms == 0, 1.0, norms)).tolist()
+
+
+class StubGenerationProvider(GenerationProvider):
+    """
+    LLM determinista para pruebas y entornos sin red. Reconoce los prompts del sistema
+    (Índice Maestro, resúmenes de sección, plan de búsqueda) y devuelve JSON válido construido
+    a partir del propio prompt; para el resto devuelve un extracto del contexto recibido.
+    """
+    model_name = "stub"
+
+    def _generate(self, prompt: str, timeout: float | None = None) -> GenerationResponse:
+        if '"titulo_seccion"' in prompt and "Editor Senior" not in prompt:
+            text = self._json_block(self._summary(self._between(prompt, "Texto de la Sección:", "---"), prompt))
+        elif '"indice_estructurado"' in prompt:
+            # Índice completo (con el texto del documento) o reducción (con los resúmenes de sección).
+            source_text = self._between(prompt, "Contenido del Documento", "---") or " ".join(
+                json.loads(f'"{value}"') for value in re.findall(r'"resumen": "((?:[^"\\]|\\.)*)"', prompt))
+            summary = self._summary(source_text, prompt)
+            text = self._json_block({"titulo": summary["titulo"], "autor": "No disponible", "fecha_publicacion": "No disponible",
+                                     "resumen_global": summary["resumen"], "indice_estructurado": {"Documento completo": summary["resumen"]},
+                                     "tags": summary["temas"]})
+        elif '"optimized_queries"' in prompt:
+            question = self._between(prompt, "PREGUNTA MÁS RECIENTE DEL USUARIO:**", "---").strip().strip('"')
+            text = self._json_block({"optimized_queries": [question], "keywords": self._top_terms(question, 3)})
+        else:
+            context = self._between(prompt, "Fragmentos Relevantes Recuperados para la Pregunta Actual:**", "**Pregunta Actual") or prompt
+            text = "Respuesta simulada a partir del contexto: " + " ".join(context.split())[:400]
+        return GenerationResponse(text)
+
+    async def _agenerate(self, prompt: str) -> GenerationResponse:
+        return self._generate(prompt)
+
+    async def _agenerate_stream(self, prompt: str):
+        text = self._generate(prompt).text
+
+        async def chunks():
+            for i in range(0, len(text), 80):
+                yield GenerationResponse(text[i:i + 80])
+        return chunks()
+
+    @staticmethod
+    def _between(text: str, start: str, end: str) -> str:
+        position = text.find(start)
+        if position < 0: return ""
+        rest = text[position + len(start):].lstrip()
+        # Si el marcador va seguido de un separador (---), este abre la sección: lo saltamos.
+        if rest.startswith(end): rest = rest[len(end):]
+        stop = rest.find(end)
+        return rest if stop < 0 else rest[:stop]
+
+    @staticmethod
+    def _top_terms(text: str, n: int) -> list[str]:
+        return [term for term, _ in Counter(tokenize(text)).most_common(n)]
+
+    def _summary(self, text: str, prompt: str) -> dict:
+        filename = re.search(r'Nombre de Archivo \(para contexto\): "([^"]*)"', prompt)
+        return {"titulo_seccion": "Sección", "resumen": " ".join(text.split())[:300] or "No disponible",
+                "subsecciones": {}, "temas": self._top_terms(text, 5),
+                "titulo": filename.group(1) if filename else "No disponible", "autor": "No disponible", "fecha_publicacion": "No disponible"}
+
+    @staticmethod
+    def _json_block(data: dict) -> str:
+        return "```json\n" + json.dumps(data, ensure_ascii=False) + "\n```"
+
+
+_instances = {}
+_instances_lock = threading.Lock()
+
+
+def get_generation_model() -> GenerationProvider:
+    """Modelo de generación configurado en GENERATION_PROVIDER ("gemini" o "stub"), creado una sola vez."""
+    with _instances_lock:
+        if "generation" not in _instances:
+            if GENERATION_PROVIDER == "gemini":
+                from gemini_provider import GeminiGenerationProvider
+                _instances["generation"] = GeminiGenerationProvider()
+            elif GENERATION_PROVIDER == "stub":
+                _instances["generation"] = StubGenerationProvider()
+            else:
+                raise ValueError(f"Proveedor de generación desconocido: '{GENERATION_PROVIDER}'.")
+        return _instances["generation"]
+
+
+def get_embedding_function() -> EmbeddingProvider:
+    """Función de embedding configurada en EMBEDDING_PROVIDER ("gemini" o "hashing"), creada una sola vez."""
+    with _instances_lock:
+        if "embedding" not in _instances:
+            if EMBEDDING_PROVIDER == "gemini":
+                from gemini_provider import GeminiEmbeddingProvider
+                _instances["embedding"] = GeminiEmbeddingProvider()
+            elif EMBEDDING_PROVIDER == "hashing":
+                _instances["embedding"] = HashingEmbeddingProvider()
+            else:
+                raise ValueError(f"Proveedor de embeddings desconocido: '{EMBEDDING_PROVIDER}'.")
+        return _instances["embedding"]
@@ -0,0 +1,285 @@
+# quantized_store.py
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+import telemetry
+
+QUANTIZED_DTYPES = {"int8": np.int8, "float16": np.float16}
+
+# Filas que se decuantizan a la vez al recorrer los códigos (acota la memoria temporal de la búsqueda).
+_SCAN_BLOCK_ROWS = 8192
+_INITIAL_CAPACITY = 1024
+# Valores por consulta IN (...): por debajo del límite de variables de SQLite en cualquier versión.
+_SQL_BATCH = 900
+
+
+def quantize(vectors, dtype: str) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Cuantiza vectores float32 a int8 (simétrico, con una escala por vector: max|v| / 127) o a
+    float16 (escala 1). Devuelve los códigos y las escalas.
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if dtype == "float16": return vectors.astype(np.float16), np.ones(len(vectors), dtype=np.float32)
+    scales = np.abs(vectors).max(axis=1) / 127 if vectors.size else np.ones(len(vectors), dtype=np.float32)
+    scales = np.where(scales == 0, 1, scales).astype(np.float32)
+    return np.clip(np.rint(vectors / scales[:, None]), -127, 127).astype(np.int8), scales
+
+
+def approximate_distances(codes: np.ndarray, scales: np.ndarray, squared_norms: np.ndarray, queries: np.ndarray) -> np.ndarray:
+    """
+    Distancias L2² aproximadas de cada consulta a cada vector cuantizado: el producto escalar se
+    hace con los códigos y se corrige con la escala de cada vector; las normas son las exactas.
+    """
+    dots = (queries @ codes.astype(np.float32).T) * scales[None, :]
+    return np.einsum("ij,ij->i", queries, queries)[:, None] + squared_norms[None, :] - 2 * dots
+
+
+def exact_distances(vectors: np.ndarray, queries: np.ndarray) -> np.ndarray:
+    vectors = np.asarray(vectors, dtype=np.float32)
+    return (np.einsum("ij,ij->i", queries, queries)[:, None] + np.einsum("ij,ij->i", vectors, vectors)[None, :]
+            - 2 * (queries @ vectors.T))
+
+
+def _top_k(distances: np.ndarray, k: int) -> np.ndarray:
+    """Posiciones de las k menores distancias de una fila, ordenadas."""
+    if k < len(distances): candidates = np.argpartition(distances, k - 1)[:k]
+    else: candidates = np.arange(len(distances))
+    return candidates[np.argsort(distances[candidates], kind="stable")]
+
+
+class QuantizedCollection:
+    """
+    Almacén vectorial alternativo a Chroma con la misma interfaz que usa RAGSystem (upsert, get,
+    query, delete, count y filtros where por "source"). Los embeddings se guardan cuantizados
+    (int8 o float16, con una escala por vector) en ficheros mapeados en memoria: la búsqueda
+    recorre solo los códigos (4 veces más pequeños que los float32 en int8, 2 en float16), que caben en la caché de
+    páginas del sistema aunque la biblioteca tenga millones de fragmentos. Los mejores candidatos
+    se vuelven a puntuar con los vectores float32, que están en otro fichero y solo se leen para esas filas.
+    Textos, metadatos y la fila de cada id van en SQLite.
+    """
+
+    def __init__(self, path: str, embedding_function, dtype: str = "int8", rescore_factor: int = 4):
+        if dtype not in QUANTIZED_DTYPES: raise ValueError(f"Tipo de cuantización no soportado: {dtype}")
+        self.path = path
+        self.embedding_function = embedding_function
+        self.rescore_factor = max(1, rescore_factor)
+        self._lock = threading.RLock()
+        os.makedirs(path, exist_ok=True)
+        self._conn = sqlite3.connect(os.path.join(path, "fragmentos.sqlite3"), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        with self._conn:
+            self._conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS sources (code INTEGER PRIMARY KEY, source TEXT NOT NULL UNIQUE)")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS chunks (
+                    id TEXT PRIMARY KEY,
+                    row INTEGER NOT NULL UNIQUE,
+                    document TEXT NOT NULL,
+                    metadata TEXT NOT NULL
+                )""")
+        meta = dict(self._conn.execute("SELECT key, value FROM meta").fetchall())
+        stored_dtype = meta.get("dtype")
+        if stored_dtype and stored_dtype != dtype:
+            print(f"  -> ⚠️ El almacén '{path}' ya está cuantizado en {stored_dtype}; se ignora {dtype}.")
+        self.dtype = stored_dtype or dtype
+        self.dimension = int(meta["dimension"]) if "dimension" in meta else None
+        self._rows_used = int(meta.get("rows_used", 0))
+        self._source_codes = {source: code for code, source in self._conn.execute("SELECT code, source FROM sources")}
+        self._capacity = 0
+        # Versión de cada fila (en memoria): se incrementa al escribirla o liberarla. Una búsqueda
+        # descarta las filas con versión posterior a su inicio, que pueden ser ya de otro fragmento.
+        self._version = 0
+        self._row_versions = np.zeros(0, dtype=np.int64)
+        if self.dimension:
+            self._open_maps(max(_INITIAL_CAPACITY, self._rows_used))
+            self._free_rows = [int(row) for row in np.flatnonzero(self._row_sources[:self._rows_used] < 0)]
+        else:
+            self._free_rows = []
+
+    # --- Ficheros mapeados ---
+
+    def _open_maps(self, capacity: int):
+        """(Re)abre los ficheros con espacio para `capacity` filas, ampliándolos si hace falta."""
+        layout = {"codigos.bin": (QUANTIZED_DTYPES[self.dtype], (self.dimension,)), "vectores.f32": (np.float32, (self.dimension,)),
+                  "escalas.f32": (np.float32, (2,)), "fuentes.i32": (np.int32, ())}
+        maps = {}
+        for name, (dtype, row_shape) in layout.items():
+            file_path = os.path.join(self.path, name)
+            size = capacity * int(np.prod(row_shape, dtype=np.int64)) * np.dtype(dtype).itemsize
+            previous_size = os.path.getsize(file_path) if os.path.exists(file_path) else 0
+            if previous_size < size:
+                with open(file_path, "ab") as f: f.truncate(size)
+            maps[name] = np.memmap(file_path, dtype=dtype, mode="r+", shape=(capacity, *row_shape))
+            # Las filas nuevas de fuentes.i32 se marcan libres (-1), no como de la fuente 0.
+            if name == "fuentes.i32" and previous_size < size:
+                maps[name][previous_size // 4:] = -1
+        self._codes, self._vectors = maps["codigos.bin"], maps["vectores.f32"]
+        self._aux, self._row_sources = maps["escalas.f32"], maps["fuentes.i32"]
+        self._row_versions = np.concatenate([self._row_versions, np.zeros(capacity - len(self._row_versions), dtype=np.int64)])
+        self._capacity = capacity
+
+    def _allocate_rows(self, count: int) -> list[int]:
+        rows = [self._free_rows.pop() for _ in range(min(count, len(self._free_rows)))]
+        rows += list(range(self._rows_used, self._rows_used + count - len(rows)))
+        self._rows_used = max([self._rows_used, *(row + 1 for row in rows)])
+        if self._rows_used > self._capacity:
+            capacity = self._capacity
+            while capacity < self._rows_used: capacity *= 2
+            self._flush()
+            self._open_maps(capacity)
+        return rows
+
+    def _flush(self):
+        for data in (self._codes, self._vectors, self._aux, self._row_sources): data.flush()
+
+    def _source_code(self, source: str) -> int:
+        if source not in self._source_codes:
+            code = len(self._source_codes)
+            self._conn.execute("INSERT INTO sources (code, source) VALUES (?, ?)", (code, source))
+            self._source_codes[source] = code
+        return self._source_codes[source]
+
+    # --- Interfaz de colección ---
+
+    def upsert(self, documents: list[str], metadatas: list[dict], ids: list[str]):
+        embeddings = np.asarray(self.embedding_function(documents), dtype=np.float32).reshape(len(ids), -1)
+        with self._lock:
+            if self.dimension is None:
+                self.dimension = embeddings.shape[1]
+                self._open_maps(_INITIAL_CAPACITY)
+            elif embeddings.shape[1] != self.dimension:
+                raise ValueError(f"Dimensión {embeddings.shape[1]} distinta de la del almacén ({self.dimension}).")
+            existing = {record[0]: record[1] for record in self._select("id", ids)}
+            new_rows = iter(self._allocate_rows(sum(chunk_id not in existing for chunk_id in ids)))
+            rows = np.array([existing[chunk_id] if chunk_id in existing else next(new_rows) for chunk_id in ids], dtype=np.int64)
+            codes, scales = quantize(embeddings, self.dtype)
+            self._version += 1
+            self._row_versions[rows] = self._version
+            with self._conn:
+                self._codes[rows] = codes
+                self._vectors[rows] = embeddings
+                self._aux[rows] = np.stack([scales, np.einsum("ij,ij->i", embeddings, embeddings)], axis=1)
+                self._row_sources[rows] = [self._source_code(metadata['source']) for metadata in metadatas]
+                self._flush()
+                self._conn.executemany("INSERT OR REPLACE INTO chunks (id, row, document, metadata) VALUES (?, ?, ?, ?)",
+                                       [(chunk_id, int(row), document, json.dumps(metadata, ensure_ascii=False))
+                                        for chunk_id, row, document, metadata in zip(ids, rows, documents, metadatas)])
+                self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('dtype', ?), ('dimension', ?), ('rows_used', ?)",
+                                   (self.dtype, str(self.dimension), str(self._rows_used)))
+
+    def _candidate_rows(self, where: dict | None) -> np.ndarray:
+        if not self.dimension: return np.empty(0, dtype=np.int64)
+        row_sources = self._row_sources[:self._rows_used]
+        if where is None: return np.flatnonzero(row_sources >= 0)
+        if set(where) != {"source"}: raise ValueError(f"Filtro no soportado: {where}")
+        condition = where["source"]
+        sources = condition["$in"] if isinstance(condition, dict) else [condition]
+        codes = [self._source_codes[source] for source in sources if source in self._source_codes]
+        return np.flatnonzero(np.isin(row_sources, codes)) if codes else np.empty(0, dtype=np.int64)
+
+    def _select(self, column: str, values: list) -> list[tuple]:
+        """(id, fila, texto, metadatos) de los fragmentos cuyo id o fila está en values. Con self._lock tomado."""
+        records = []
+        for start in range(0, len(values), _SQL_BATCH):
+            batch = values[start:start + _SQL_BATCH]
+            records += self._conn.execute(f"SELECT id, row, document, metadata FROM chunks WHERE {column} IN ({','.join('?' * len(batch))})", batch).fetchall()
+        return records
+
+    def _rows_by_ids(self, ids: list[str]) -> list[tuple]:
+        found = {record[0]: record for record in self._select("id", ids)}
+        return [found[chunk_id] for chunk_id in ids if chunk_id in found]
+
+    def _rows_by_position(self, rows) -> list[tuple]:
+        rows = [int(row) for row in rows]
+        found = {record[1]: record for record in self._select("row", rows)}
+        return [found[row] for row in rows if row in found]
+
+    def _records(self, ids: list[str] | None, where: dict | None) -> list[tuple]:
+        if ids is None: return self._rows_by_position(self._candidate_rows(where))
+        records = self._rows_by_ids(ids)
+        if where is not None:
+            allowed = set(self._candidate_rows(where).tolist())
+            records = [record for record in records if record[1] in allowed]
+        return records
+
+    def _result(self, records: list[tuple], include) -> dict:
+        result = {"ids": [record[0] for record in records]}
+        if "documents" in include: result["documents"] = [record[2] for record in records]
+        if "metadatas" in include: result["metadatas"] = [json.loads(record[3]) for record in records]
+        if "embeddings" in include: result["embeddings"] = [np.array(self._vectors[record[1]]) for record in records]
+        return result
+
+    def get(self, ids: list[str] | None = None, where: dict | None = None, include=("documents", "metadatas")) -> dict:
+        with self._lock:
+            return self._result(self._records(ids, where), include)
+
+    def query(self, query_texts: list[str], n_results: int, where: dict | None = None,
+              include=("documents", "metadatas", "distances")) -> dict:
+        """
+        Búsqueda en dos fases: distancias aproximadas sobre los códigos cuantizados (por bloques)
+        para n_results * rescore_factor candidatos, y distancia exacta con los float32 para ordenarlos.
+        """
+        queries = np.asarray(self.embedding_function(query_texts), dtype=np.float32).reshape(len(query_texts), -1)
+        start = time.perf_counter()
+        with self._lock:
+            rows = self._candidate_rows(where)
+            codes, vectors, aux = self._codes, self._vectors, self._aux
+            version = self._version
+        result = {"ids": [], "distances": [], **{key: [] for key in ("documents", "metadatas", "embeddings") if key in include}}
+        if not len(rows) or n_results <= 0:
+            for key in result: result[key] = [[] for _ in query_texts]
+            return result
+
+        shortlist = min(len(rows), n_results * self.rescore_factor)
+        best_rows = np.empty((len(queries), 0), dtype=np.int64)
+        best_distances = np.empty((len(queries), 0), dtype=np.float32)
+        for block_start in range(0, len(rows), _SCAN_BLOCK_ROWS):
+            block = rows[block_start:block_start + _SCAN_BLOCK_ROWS]
+            block_aux = aux[block]
+            distances = approximate_distances(codes[block], block_aux[:, 0], block_aux[:, 1], queries)
+            merged_distances = np.concatenate([best_distances, distances], axis=1)
+            merged_rows = np.concatenate([best_rows, np.broadcast_to(block, distances.shape)], axis=1)
+            keep = np.stack([_top_k(row, shortlist) for row in merged_distances])
+            best_distances = np.take_along_axis(merged_distances, keep, axis=1)
+            best_rows = np.take_along_axis(merged_rows, keep, axis=1)
+
+        for query, candidates in zip(queries, best_rows):
+            # Re-puntuación en precisión completa: solo se leen del disco las filas candidatas.
+            candidates = np.sort(candidates)
+            exact = np.maximum(exact_distances(vectors[candidates], query[None, :])[0], 0)
+            # La conexión SQLite la comparten todos los hilos: se lee con el mismo cerrojo con que escriben upsert y delete.
+            with self._lock:
+                # Filas borradas o reutilizadas por otro fragmento durante la búsqueda: su distancia ya no es la suya.
+                current = self._row_versions[candidates] <= version
+                candidates, exact = candidates[current], exact[current]
+                records = self._rows_by_position(candidates[_top_k(exact, n_results)])
+                hits = self._result(records, include)
+            distance_by_row = dict(zip(candidates.tolist(), exact.tolist()))
+            result["ids"].append(hits["ids"])
+            result["distances"].append([distance_by_row[record[1]] for record in records])
+            for key in ("documents", "metadatas", "embeddings"):
+                if key in result: result[key].append(hits[key])
+        telemetry.observe("quantized_query_seconds", time.perf_counter() - start)
+        return result
+
+    def delete(self, ids: list[str] | None = None, where: dict | None = None):
+        with self._lock:
+            records = self._records(ids, where)
+            if not records: return
+            rows = [record[1] for record in records]
+            with self._conn:
+                self._conn.executemany("DELETE FROM chunks WHERE id = ?", [(record[0],) for record in records])
+                self._row_sources[rows] = -1
+                self._row_sources.flush()
+            self._version += 1
+            self._row_versions[rows] = self._version
+            self._free_rows.extend(rows)
+
+    def count(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
@@ -0,0 +1,66 @@
+# query_cache.py
+import hashlib
+import json
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+import telemetry
+
+
+class TTLCache:
+    """Caché en memoria con caducidad (TTL) y tamaño máximo, expulsando la entrada menos usada."""
+
+    def __init__(self, max_entries: int, ttl_seconds: float, name: str = "consulta"):
+        self.name = name
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None: del self._entries[key]
+                self.misses += 1
+                telemetry.increment("cache_requests", cache=self.name, result="miss")
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+        telemetry.increment("cache_requests", cache=self.name, result="hit")
+        return entry[1]
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries: self._entries.popitem(last=False)
+
+    def invalidate(self, predicate=None):
+        """Elimina las entradas cuya clave cumple el predicado (o todas si no se indica)."""
+        with self._lock:
+            for key in [k for k in self._entries if predicate is None or predicate(k)]:
+                del self._entries[key]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "entries": len(self._entries)}
+
+
+def normalize_question(question: str) -> str:
+    """Normaliza una pregunta para que variantes triviales compartan entrada de caché."""
+    text = unicodedata.normalize("NFKD", question.lower())
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    text = re.sub(r"[¿?¡!.,;:\"'«»()]", " ", text)
+    return " ".join(text.split())
+
+
+def stable_hash(value) -> str:
+    """Hash corto y estable de cualquier valor serializable en JSON (historial, plan, prompt...)."""
+    payload = value if isinstance(value, str) else json.dumps(value, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
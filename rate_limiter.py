@@ -0,0 +1,107 @@
+# rate_limiter.py
+import asyncio
+import re
+import threading
+import time
+
+import telemetry
+
+
+def is_rate_limit_error(error: Exception) -> bool:
+    """Un 429 de la API: ResourceExhausted del SDK de Google o cualquier error con código 429 o de cuota."""
+    if type(error).__name__ in ("ResourceExhausted", "TooManyRequests"): return True
+    if 429 in (getattr(error, "code", None), getattr(error, "status_code", None)): return True
+    message = str(error).lower()
+    return "429" in message or "quota" in message or "rate limit" in message
+
+
+def retry_after_seconds(error: Exception) -> float | None:
+    """Espera que sugiere la propia respuesta 429 («retry in 12.5s», «retry_delay { seconds: 12 }»), si la trae."""
+    match = re.search(r"retry in (\d+(?:\.\d+)?)\s*s|retry_delay\s*\{\s*seconds:\s*(\d+)", str(error))
+    return float(match.group(1) or match.group(2)) if match else None
+
+
+class RateLimiter:
+    """
+    Cuota de peticiones y tokens por minuto de un modelo, compartida por todos los hilos y bucles
+    del proceso: dos cubos de tokens que se rellenan de forma continua. Se adapta a la cuota real:
+    cada 429 reduce el ritmo a la mitad y pausa todas las llamadas; cada llamada correcta lo recupera poco a poco.
+    """
+
+    def __init__(self, name: str, requests_per_minute: int, tokens_per_minute: int,
+                 min_scale: float = 0.1, recovery_step: float = 0.02):
+        self.name = name
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.min_scale = min_scale
+        self.recovery_step = recovery_step
+        self.scale = 1.0
+        self._requests = float(requests_per_minute)
+        self._tokens = float(tokens_per_minute)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def token_capacity(self) -> float:
+        """Tokens que la cuota deja enviar en un minuto al ritmo actual (el máximo de una petición)."""
+        return self.tokens_per_minute * self.scale
+
+    def _refill(self, now: float):
+        elapsed, self._updated = now - self._updated, now
+        self._requests = min(self.requests_per_minute * self.scale, self._requests + elapsed * self.requests_per_minute * self.scale / 60)
+        self._tokens = min(self.token_capacity, self._tokens + elapsed * self.token_capacity / 60)
+
+    def _reserve(self, tokens: int) -> float:
+        """Reserva la llamada y devuelve 0 si cabe; si no, los segundos que faltan para que quepa."""
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            if now < self._paused_until: return self._paused_until - now
+            # Una petición mayor que el cubo entero se deja pasar cuando este está lleno.
+            tokens = min(tokens, self.token_capacity)
+            missing_requests, missing_tokens = 1 - self._requests, tokens - self._tokens
+            if missing_requests <= 0 and missing_tokens <= 0:
+                self._requests -= 1; self._tokens -= tokens
+                return 0.0
+            return max(missing_requests * 60 / (self.requests_per_minute * self.scale),
+                       missing_tokens * 60 / self.token_capacity, 0.01)
+
+    def acquire(self, tokens: int = 0):
+        waited = 0.0
+        while (wait := self._reserve(tokens)) > 0:
+            time.sleep(wait); waited += wait
+        if waited: telemetry.observe("rate_limit_wait_seconds", waited, limiter=self.name)
+
+    async def aacquire(self, tokens: int = 0):
+        waited = 0.0
+        while (wait := self._reserve(tokens)) > 0:
+            await asyncio.sleep(wait); waited += wait
+        if waited: telemetry.observe("rate_limit_wait_seconds", waited, limiter=self.name)
+
+    def on_success(self):
+        if self.scale < 1.0:
+            with self._lock: self.scale = min(1.0, self.scale + self.recovery_step)
+
+    def on_rate_limited(self, pause: float):
+        """La API ha devuelto 429: medio ritmo y ninguna llamada (de ningún hilo) hasta que pase la pausa."""
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self.scale = max(self.min_scale, self.scale / 2)
+            self._requests = min(self._requests, self.requests_per_minute * self.scale)
+            self._tokens = min(self._tokens, self.token_capacity)
+            self._paused_until = max(self._paused_until, now + pause)
+        telemetry.increment("rate_limited", limiter=self.name)
+
+
+_limiters: dict[str, RateLimiter] = {}
+_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(name: str, requests_per_minute: int, tokens_per_minute: int) -> RateLimiter:
+    """Limitador único por nombre (modelo) en todo el proceso, creado la primera vez que se pide."""
+    with _limiters_lock:
+        if name not in _limiters:
+            _limiters[name] = RateLimiter(name, requests_per_minute, tokens_per_minute)
+        return _limiters[name]
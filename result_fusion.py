@@ -0,0 +1,53 @@
+# result_fusion.py
+import numpy as np
+
+
+def merge_query_results(results: dict) -> list[dict]:
+    """
+    Une las listas de resultados de todas las consultas de un collection.query de Chroma.
+    Cada fragmento aparece una sola vez, con la menor distancia que obtuvo en cualquiera de
+    las consultas. Devuelve {id, text, metadata, distance, embedding}, de la más cercana a la más lejana.
+    """
+    merged = {}
+    embeddings = results.get('embeddings')
+    for query_position, ids in enumerate(results.get('ids') or []):
+        for position, chunk_id in enumerate(ids):
+            distance = float(results['distances'][query_position][position])
+            if chunk_id in merged and merged[chunk_id]['distance'] <= distance: continue
+            merged[chunk_id] = {"id": chunk_id, "text": results['documents'][query_position][position],
+                                "metadata": results['metadatas'][query_position][position] or {}, "distance": distance,
+                                "embedding": embeddings[query_position][position] if embeddings is not None else None}
+    return sorted(merged.values(), key=lambda item: item['distance'])
+
+
+def maximal_marginal_relevance(embeddings: list, relevance: list[float], k: int, lambda_: float) -> list[int]:
+    """
+    Elige k candidatos equilibrando relevancia y diversidad (MMR): en cada paso, el que maximiza
+    lambda_ * relevancia - (1 - lambda_) * similitud máxima con los ya elegidos. Las similitudes
+    (coseno) se calculan de una vez en una matriz. Un candidato sin embedding no penaliza a nadie.
+    Devuelve las posiciones elegidas, en orden de selección.
+    """
+    n = len(relevance)
+    if n == 0 or k <= 0: return []
+    dimension = next((len(e) for e in embeddings if e is not None), 0)
+    if n == 1 or not dimension: return [int(i) for i in np.argsort(-np.asarray(relevance, dtype=float), kind="stable")[:k]]
+
+    vectors = np.zeros((n, dimension), dtype=np.float32)
+    for i, embedding in enumerate(embeddings):
+        if embedding is not None: vectors[i] = embedding
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    vectors /= np.where(norms == 0, 1, norms)
+    similarity = vectors @ vectors.T
+
+    scores = np.asarray(relevance, dtype=np.float32)
+    if scores.max() > 0: scores = scores / scores.max()
+    selected = [int(np.argmax(scores))]
+    available = np.ones(n, dtype=bool); available[selected[0]] = False
+    max_similarity = similarity[selected[0]].copy()
+    while len(selected) < min(k, n):
+        marginal = lambda_ * scores - (1 - lambda_) * max_similarity
+        marginal[~available] = -np.inf
+        best = int(np.argmax(marginal))
+        selected.append(best); available[best] = False
+        np.maximum(max_similarity, similarity[best], out=max_similarity)
+    return selected
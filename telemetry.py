@@ -0,0 +1,258 @@
+# telemetry.py
+import atexit
+import contextvars
+import cProfile
+import json
+import os
+import threading
+import time
+import uuid
+from bisect import bisect_left
+
+from config import (TELEMETRY_CONSOLE, TELEMETRY_DIR, TELEMETRY_EXPORTERS,
+                    TELEMETRY_FLUSH_INTERVAL_SECONDS)
+
+# Límites (segundos) de los histogramas de duración exportados a Prometheus.
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+_current_span = contextvars.ContextVar("rag_span", default=None)
+
+
+class MetricsRegistry:
+    """Contadores e histogramas en memoria, con etiquetas. Seguro entre hilos."""
+
+    def __init__(self):
+        self._counters: dict[tuple, float] = {}
+        self._histograms: dict[tuple, list] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(name: str, labels: dict) -> tuple:
+        return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+    def increment(self, name: str, value: float = 1, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            histogram = self._histograms.setdefault(key, [0, 0.0, [0] * len(DURATION_BUCKETS)])
+            histogram[0] += 1; histogram[1] += value
+            position = bisect_left(DURATION_BUCKETS, value)
+            if position < len(DURATION_BUCKETS): histogram[2][position] += 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            counters = [{"name": n, "labels": dict(l), "value": v} for (n, l), v in self._counters.items()]
+            histograms = [{"name": n, "labels": dict(l), "count": h[0], "sum": h[1], "buckets": list(h[2])}
+                          for (n, l), h in self._histograms.items()]
+        return {"counters": counters, "histograms": histograms}
+
+
+class Span:
+    """Tramo cronometrado de una etapa. Los tramos anidados comparten trace_id."""
+
+    def __init__(self, name: str, attributes: dict, profile: bool = False):
+        parent = _current_span.get()
+        self.name = name
+        self.attributes = attributes
+        self.trace_id = parent.trace_id if parent else uuid.uuid4().hex[:16]
+        self.span_id = uuid.uuid4().hex[:8]
+        self.parent_id = parent.span_id if parent else None
+        self.status = "ok"
+        self.start_time = time.time()
+        self.started = time.perf_counter()
+        self._token = _current_span.set(self)
+        # El perfilado (cProfile) solo cubre el hilo que abre el tramo.
+        self._profiler = cProfile.Profile() if profile else None
+        if self._profiler:
+            try:
+                self._profiler.enable()
+            except ValueError:
+                # Ya hay otro perfilador activo en este hilo (p. ej. dos consultas perfiladas a la vez).
+                self._profiler = None
+                self.attributes["perfil"] = "no disponible"
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def end(self, error: BaseException | None = None):
+        duration = time.perf_counter() - self.started
+        if self._profiler:
+            self._profiler.disable()
+            os.makedirs(TELEMETRY_DIR, exist_ok=True)
+            profile_path = os.path.join(TELEMETRY_DIR, f"perfil_{self.name}_{self.trace_id}.prof")
+            self._profiler.dump_stats(profile_path)
+            self.attributes["perfil"] = profile_path
+        if error is not None:
+            self.status = "cancelled" if isinstance(error, (GeneratorExit, KeyboardInterrupt)) else "error"
+            self.attributes.setdefault("error", repr(error))
+        try:
+            _current_span.reset(self._token)
+        except ValueError:
+            # Se cierra desde otro contexto (p. ej. un generador abandonado), que ya no se usa.
+            pass
+        metrics.observe("stage_seconds", duration, stage=self.name, status=self.status)
+        record = {"type": "span", "name": self.name, "trace_id": self.trace_id, "span_id": self.span_id,
+                  "parent_id": self.parent_id, "start": self.start_time, "duration_s": round(duration, 6),
+                  "status": self.status, "attributes": self.attributes}
+        for exporter in _get_exporters(): exporter.export_span(record)
+        if self.parent_id is None: flush()
+
+
+class _SpanContext:
+    def __init__(self, name: str, message: str | None, profile: bool, attributes: dict):
+        self._args = (name, message, profile, attributes)
+        self.span = None
+
+    def __enter__(self) -> Span:
+        name, message, profile, attributes = self._args
+        if message and TELEMETRY_CONSOLE: print(f"--- {message} ---")
+        self.span = Span(name, attributes, profile)
+        return self.span
+
+    def __exit__(self, exc_type, exc, tb):
+        self.span.end(exc)
+        return False
+
+
+def span(name: str, message: str | None = None, profile: bool = False, **attributes) -> _SpanContext:
+    """
+    Cronometra una etapa: `with span("consulta.recuperacion", documento=...)`. Si se indica
+    `message`, se muestra en consola al empezar (el progreso de siempre). Con profile=True se
+    guarda un perfil cProfile de la etapa en TELEMETRY_DIR.
+    """
+    return _SpanContext(name, message, profile, attributes)
+
+
+def annotate(**attributes):
+    """Añade atributos al tramo abierto en el contexto actual, si lo hay (p. ej. desde funciones internas)."""
+    current = _current_span.get()
+    if current: current.set(**attributes)
+
+
+def start_span(name: str, message: str | None = None, profile: bool = False, **attributes) -> Span:
+    """Como span(), para tramos que no caben en un bloque with (p. ej. generadores): cerrar con end()."""
+    return _SpanContext(name, message, profile, attributes).__enter__()
+
+
+class JsonLinesExporter:
+    """Un JSON por línea: cada tramo al terminar y una instantánea de las métricas en cada volcado."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+
+    def _write(self, record: dict):
+        line = json.dumps(record, ensure_ascii=False, default=str) + "\n"
+        with self._lock, open(self.path, 'a', encoding='utf-8') as f: f.write(line)
+
+    def export_span(self, record: dict):
+        self._write(record)
+
+    def export_metrics(self, snapshot: dict):
+        self._write({"type": "metrics", "time": time.time(), **snapshot})
+
+
+class PrometheusTextfileExporter:
+    """Fichero de texto en formato Prometheus (para el textfile collector de node_exporter)."""
+
+    def __init__(self, path: str, prefix: str = "rag_"):
+        self.path = path
+        self.prefix = prefix
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+
+    @staticmethod
+    def _labels(labels: dict, extra: dict | None = None) -> str:
+        items = {**labels, **(extra or {})}
+        if not items: return ""
+        escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for v in items.values())
+        return "{" + ",".join(f'{k}="{v}"' for k, v in zip(items, escaped)) + "}"
+
+    def export_span(self, record: dict):
+        pass
+
+    def export_metrics(self, snapshot: dict):
+        lines = []
+        for counter in sorted(snapshot["counters"], key=lambda c: c["name"]):
+            lines.append(f"{self.prefix}{counter['name']}_total{self._labels(counter['labels'])} {counter['value']}")
+        for histogram in sorted(snapshot["histograms"], key=lambda h: h["name"]):
+            name, labels = self.prefix + histogram["name"], histogram["labels"]
+            cumulative = 0
+            for bound, count in zip(DURATION_BUCKETS, histogram["buckets"]):
+                cumulative += count
+                lines.append(f"{name}_bucket{self._labels(labels, {'le': bound})} {cumulative}")
+            lines.append(f"{name}_bucket{self._labels(labels, {'le': '+Inf'})} {histogram['count']}")
+            lines.append(f"{name}_sum{self._labels(labels)} {histogram['sum']}")
+            lines.append(f"{name}_count{self._labels(labels)} {histogram['count']}")
+        # Escritura atómica: el collector nunca lee un fichero a medias.
+        with open(self.path + ".tmp", 'w', encoding='utf-8') as f: f.write("\n".join(lines) + "\n")
+        os.replace(self.path + ".tmp", self.path)
+
+
+metrics = MetricsRegistry()
+increment = metrics.increment
+observe = metrics.observe
+
+# Los exportadores (y sus directorios) se crean al exportar por primera vez: importar el módulo no escribe nada.
+_exporters: list | None = None
+_exports_metrics = True
+_setup_lock = threading.Lock()
+_last_flush = 0.0
+_flush_lock = threading.Lock()
+
+
+def configure(exporters: list):
+    """Sustituye los exportadores activos (p. ej. en pruebas o desde otra aplicación)."""
+    global _exporters
+    with _setup_lock:
+        _exporters = list(exporters)
+
+
+def mark_worker_process():
+    """
+    Inicializador de los pools de procesos: el trabajador exporta sus tramos, pero no las métricas,
+    que son del proceso principal (con spawn, cada trabajador sobrescribiría rag.prom al salir).
+    """
+    global _exports_metrics
+    _exports_metrics = False
+
+
+def _get_exporters() -> list:
+    global _exporters
+    with _setup_lock:
+        if _exporters is None:
+            _exporters = _default_exporters()
+        return _exporters
+
+
+def flush(force: bool = False):
+    """Vuelca las métricas a los exportadores, como mucho una vez cada TELEMETRY_FLUSH_INTERVAL_SECONDS."""
+    global _last_flush
+    if not _exports_metrics: return
+    with _flush_lock:
+        now = time.monotonic()
+        if not force and now - _last_flush < TELEMETRY_FLUSH_INTERVAL_SECONDS: return
+        _last_flush = now
+    snapshot = metrics.snapshot()
+    # Sin nada medido no hay nada que volcar (y no se pisa el fichero de otra ejecución).
+    if not snapshot["counters"] and not snapshot["histograms"]: return
+    for exporter in _get_exporters():
+        try:
+            exporter.export_metrics(snapshot)
+        except OSError as e:
+            print(f"  -> ⚠️ Telemetría: no se pudieron exportar las métricas: {e}")
+
+
+def _default_exporters() -> list:
+    exporters = []
+    if "jsonl" in TELEMETRY_EXPORTERS: exporters.append(JsonLinesExporter(os.path.join(TELEMETRY_DIR, "trazas.jsonl")))
+    if "prometheus" in TELEMETRY_EXPORTERS: exporters.append(PrometheusTextfileExporter(os.path.join(TELEMETRY_DIR, "rag.prom")))
+    return exporters
+
+
+# El volcado final no escribe nada si no se midió nada, ni en los trabajadores marcados.
+atexit.register(flush, True)
@@ -0,0 +1,35 @@
+# Los módulos de la aplicación están en la raíz del repositorio.
+import os
+import sys
+import tempfile
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# Telemetría, cachés y base de datos de las pruebas fuera de la biblioteca real, y proveedores sin red.
+os.environ.setdefault("RAG_DB_PATH", tempfile.mkdtemp(prefix="rag_tests_"))
+os.environ.setdefault("RAG_VECTOR_STORE", "cuantizado")
+os.environ.setdefault("RAG_GENERATION_PROVIDER", "stub")
+os.environ.setdefault("RAG_EMBEDDING_PROVIDER", "hashing")
+
+
+@pytest.fixture(scope="session")
+def rag_system():
+    """Un RAGSystem sin red (LLM simulado, embeddings por hashing, almacén cuantizado) para toda la sesión."""
+    from backend_controller import RAGSystem
+    return RAGSystem()
+
+
+def sample_text(topic: str, paragraphs: int = 12) -> str:
+    """Documento de prueba con contenido suficiente para ingerirse (más de 500 caracteres útiles)."""
+    return "\n\n".join(f"Párrafo {n} sobre {topic}: el {topic} se estudia aquí con detalle, "
+                       f"con ejemplos del caso {n} y referencias cruzadas al apartado {n + 1}." for n in range(paragraphs))
+
+
+def ingest_sample(rag_system, directory, topic: str, paragraphs: int = 12) -> str:
+    """Escribe e ingiere un documento de prueba; devuelve su ruta (el id del documento)."""
+    source = os.path.join(str(directory), f"{topic}.txt")
+    with open(source, "w", encoding="utf-8") as f: f.write(sample_text(topic, paragraphs))
+    result = rag_system.add_document_pipeline(source)
+    assert result["success"], result["message"]
+    return source
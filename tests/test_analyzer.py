@@ -0,0 +1,20 @@
+from analyzer import _merge_summaries_locally
+from document_router import routing_text
+from prompt_builder import render_master_index
+
+
+def test_local_merge_accepts_subsections_that_are_not_a_map():
+    summaries = [{"titulo_seccion": "Parte 1", "resumen": "Uno.", "subsecciones": ["Cap. 1", "Cap. 2"], "temas": ["a"]},
+                 {"titulo_seccion": "Parte 2", "resumen": "Dos.", "subsecciones": "Cap. 3", "temas": "b"},
+                 {"resumen": "Tres.", "subsecciones": {"Cap. 4": "Cuatro."}, "temas": ["a", "c"]}]
+    master_index = _merge_summaries_locally(summaries)
+    assert master_index["indice_estructurado"] == {"Parte 1": "Uno.", "Parte 2": "Dos.", "Cap. 4": "Cuatro."}
+    assert master_index["tags"] == ["a", "c"]
+
+
+def test_index_that_is_not_a_map_is_skipped_when_rendering():
+    master_index = {"titulo": "Libro", "resumen_global": "Un resumen.", "indice_estructurado": ["Cap. 1", "Cap. 2"]}
+    assert "Cap. 1" not in routing_text(master_index, "libro.pdf")
+    rendered = render_master_index(master_index, 500)
+    assert "Título: Libro" in rendered and "Cap. 1" not in rendered
+    assert "- Cap. 1: Uno." in render_master_index({**master_index, "indice_estructurado": {"Cap. 1": "Uno."}}, 500)
@@ -0,0 +1,23 @@
+import asyncio
+import threading
+
+import pytest
+
+
+def test_sync_wrappers_refuse_to_run_on_the_background_loop(rag_system):
+    async def call_sync_wrapper():
+        return rag_system.query_document_pipeline("¿Qué es?", "no-existe.pdf", "ninguno")
+
+    future = asyncio.run_coroutine_threadsafe(call_sync_wrapper(), rag_system._get_event_loop())
+    with pytest.raises(RuntimeError, match="versiones asíncronas"):
+        future.result(timeout=10)
+    # Fuera del bucle, el envoltorio funciona (aquí, sin Índice Maestro del documento).
+    assert rag_system.query_document_pipeline("¿Qué es?", "no-existe.pdf", "ninguno")[0].startswith("Error")
+
+
+def test_event_loop_does_not_wait_for_source_locks(rag_system):
+    loop = []
+    with rag_system._source_locks_guard:
+        thread = threading.Thread(target=lambda: loop.append(rag_system._get_event_loop()))
+        thread.start(); thread.join(timeout=5)
+    assert loop and loop[0].is_running()
@@ -0,0 +1,99 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from add_to_database import ingest_sources
+from conftest import sample_text
+
+
+class _Article(BaseHTTPRequestHandler):
+    """Un artículo con ETag que registra el método y las cabeceras condicionales de cada petición."""
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def _reply(self, send_body: bool):
+        self.server.requests.append((self.command, self.headers.get("If-None-Match")))
+        if self.headers.get("If-None-Match") == '"v1"':
+            self.send_response(304); self.end_headers()
+            return
+        body = ("<html><body><article>" + "".join(f"<p>{p}</p>" for p in sample_text("faro").split("\n\n"))
+                + "</article></body></html>").encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("ETag", '"v1"')
+        self.end_headers()
+        if send_body: self.wfile.write(body)
+
+    def do_GET(self):
+        self._reply(True)
+
+    def do_HEAD(self):
+        self._reply(False)
+
+
+@pytest.fixture
+def article():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _Article)
+    server.daemon_threads = True
+    server.requests = []
+    threading.Thread(target=server.serve_forever, kwargs={"poll_interval": 0.05}, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_port}/articulo", server.requests
+    server.shutdown()
+    server.server_close()
+
+
+def test_urls_cost_one_conditional_get_each(rag_system, article):
+    url, requests = article
+    first = ingest_sources(rag_system, [url], process_workers=1, io_threads=1)[url]
+    second = ingest_sources(rag_system, [url], process_workers=1, io_threads=1)[url]
+    assert first["success"] and not first.get("unchanged")
+    assert second["success"] and second.get("unchanged")
+    assert requests == [("GET", None), ("GET", '"v1"')]
+
+
+def test_single_url_ingest_uses_the_same_conditional_get(rag_system, article):
+    url, requests = article
+    assert not rag_system.add_document_pipeline(url).get("unchanged")
+    assert rag_system.add_document_pipeline(url).get("unchanged")
+    assert requests == [("GET", None), ("GET", '"v1"')]
+
+
+def test_interrupted_bulk_ingest_resumes_from_its_checkpoint(rag_system, tmp_path, monkeypatch):
+    source = str(tmp_path / "largo.txt")
+    with open(source, "w", encoding="utf-8") as f: f.write(sample_text("puente", paragraphs=400))
+    monkeypatch.setattr(rag_system.embedding_function, "current_batch_size", lambda: 3)
+    collection = rag_system.collection
+    upsert, upserted = collection.upsert, []
+
+    def failing_upsert(documents, metadatas, ids):
+        if len(upserted) == 6: raise ConnectionError("API caída")  # Tercer lote.
+        upserted.extend(ids)
+        upsert(documents=documents, metadatas=metadatas, ids=ids)
+
+    monkeypatch.setattr(collection, "upsert", failing_upsert)
+    first = ingest_sources(rag_system, [source], process_workers=1, io_threads=1)[source]
+    assert not first["success"] and len(upserted) == 6
+
+    monkeypatch.setattr(collection, "upsert", lambda documents, metadatas, ids: (upserted.extend(ids), upsert(documents=documents, metadatas=metadatas, ids=ids)))
+    second = ingest_sources(rag_system, [source], process_workers=1, io_threads=1)[source]
+    assert second["success"]
+    # Los dos lotes guardados antes del fallo no se vuelven a embeber.
+    assert len(upserted) == len(set(upserted)) > 6
+    assert rag_system.check_source_unchanged(source)[0]["unchanged"]
+
+
+def test_bulk_ingest_waits_for_the_source_lock(rag_system, tmp_path):
+    source = str(tmp_path / "bloqueado.txt")
+    with open(source, "w", encoding="utf-8") as f: f.write(sample_text("muralla"))
+    results = []
+    with rag_system._source_lock(source):
+        thread = threading.Thread(target=lambda: results.append(ingest_sources(rag_system, [source], process_workers=1, io_threads=1)))
+        thread.start(); thread.join(timeout=2)
+        assert thread.is_alive()
+    thread.join(timeout=30)
+    assert results[0][source]["success"]
@@ -0,0 +1,32 @@
+from chunker import chunk_pages
+
+# Fragmento de documentos_para_rag/el_libro.txt: una línea por párrafo, sin líneas en blanco entre
+# los encabezados y el texto.
+SNIPPET = """[Pg 39]
+BOOK I
+THE DERIVATIONS OF MAGIC
+א—ALEPH
+CHAPTER I
+FABULOUS SOURCES
+The apocryphal Book of Enoch says that there were angels who consented to fall from heaven that they might have intercourse with the daughters of earth.[23] “For in those days the sons of men having multiplied, there were born to them daughters of great beauty. And when the angels, or sons of heaven, beheld them, they were filled with desire; wherefore they said to one another: ‘Come, let us choose wives from among the race of man, and let us beget children.’”
+This legend of the Kabalistic Book of Enoch is a variant account of the same profanation of Mysteries which we meet with under another form of symbolism in the history of the sin of Adam. Those angels, the sons of God, of whom Enoch speaks, were initiates of Magic, and it was this that they communicated to profane men, using incautious women as their instruments.
+THE MAGICAL HEAD OF THE ZOHAR
+In the Arsenal Library there is a very curious manuscript entitled The Book of the Penitence of Adam, and herein Kabalistic tradition is presented under the guise of legend to the following effect: “Adam had two sons—Cain, who signifies brute force, and Abel, the type of intelligence and mildness.”
+אהיה אשר אהיה
+signifying He Who is and is to come. Moses plucked a triple branch of the sacred bush and used it as his miraculous wand."""
+
+
+def test_headings_inside_paragraphs_open_sections():
+    chunks = list(chunk_pages([(39, SNIPPET)], max_tokens=200, min_tokens=50, overlap_tokens=0))
+    headings = [metadata.get("heading") for _, metadata in chunks]
+    assert headings[0] == "FABULOUS SOURCES"
+    assert headings[-1] == "THE MAGICAL HEAD OF THE ZOHAR"
+    assert "\n\nTHE MAGICAL HEAD OF THE ZOHAR\n\n" in chunks[-1][0]
+    # Las líneas que no son encabezados siguen en el texto del fragmento.
+    assert "אהיה אשר אהיה" in chunks[-1][0]
+
+
+def test_body_text_is_preserved():
+    chunks = list(chunk_pages([(39, SNIPPET)], max_tokens=200, min_tokens=50, overlap_tokens=0))
+    words = " ".join(text for text, _ in chunks).split()
+    assert words == SNIPPET.split()
@@ -0,0 +1,71 @@
+from conftest import ingest_sample
+from document_router import DocumentRouter, routing_text
+from providers import HashingEmbeddingProvider
+from quantized_store import QuantizedCollection
+
+
+class _Catalog:
+    """Catálogo mínimo con la interfaz de MetadataStore que usa el enrutado."""
+
+    def __init__(self, indexes: dict):
+        self.indexes = indexes
+        self.loaded = []
+
+    def summaries(self):
+        return [{'id': source} for source in self.indexes]
+
+    def get_master_index(self, source):
+        self.loaded.append(source)
+        return self.indexes[source]
+
+
+def _index(title, topic):
+    return {'titulo': title, 'resumen_global': f"Un tratado sobre {topic}.", 'tags': [topic],
+            'indice_estructurado': {f"{topic} {i}": f"Capítulo dedicado a {topic}." for i in range(3)}}
+
+
+def _router(tmp_path):
+    return DocumentRouter(QuantizedCollection(str(tmp_path / "documentos"), HashingEmbeddingProvider()))
+
+
+def test_routing_text_tolerates_a_malformed_index():
+    text = routing_text({'titulo': None, 'indice_estructurado': ["no", "es", "un", "mapa"], 'tags': None}, "/libros/a.pdf")
+    assert text == "a.pdf"
+    assert "astronomía 0: Capítulo dedicado a astronomía." in routing_text(_index("Cielos", "astronomía"), "c.pdf")
+
+
+def test_route_returns_the_closest_documents_first(tmp_path):
+    router = _router(tmp_path)
+    assert router.route("lo que sea", top_n=3) == []
+    for source, topic in [("astro.pdf", "astronomía planetas estrellas"), ("cocina.pdf", "recetas cocina guisos"),
+                          ("botanica.pdf", "plantas flores botánica")]:
+        router.upsert(source, _index(source, topic))
+    assert router.route("recetas de cocina y guisos", top_n=1) == ["cocina.pdf"]
+    assert router.route("planetas y estrellas", top_n=10)[0] == "astro.pdf"
+    assert len(router.route("planetas y estrellas", top_n=10)) == 3
+    router.delete("cocina.pdf")
+    assert "cocina.pdf" not in router.route("recetas de cocina y guisos", top_n=3)
+
+
+def test_sync_adds_missing_documents_and_drops_stale_ones_once(tmp_path):
+    router = _router(tmp_path)
+    router.upsert("antiguo.pdf", _index("Antiguo", "historia"))
+    router.upsert("astro.pdf", _index("Astro", "astronomía"))
+    catalog = _Catalog({"astro.pdf": _index("Astro", "astronomía"), "cocina.pdf": _index("Cocina", "cocina")})
+
+    router.sync(catalog)
+    assert sorted(router.collection.get(include=[])['ids']) == ["astro.pdf", "cocina.pdf"]
+    assert catalog.loaded == ["cocina.pdf"]
+
+    catalog.indexes["nuevo.pdf"] = _index("Nuevo", "música")
+    router.sync(catalog)
+    assert catalog.loaded == ["cocina.pdf"]
+
+
+def test_library_questions_are_routed_to_the_ingested_documents(rag_system, tmp_path):
+    source = ingest_sample(rag_system, tmp_path, "cartografía")
+    ingest_sample(rag_system, tmp_path, "metalurgia")
+    sources, documents, library_index = rag_system._route_question("¿Qué se estudia sobre la cartografía?")
+    assert sources[0] == source
+    assert dict(documents)[source] == rag_system.metadata_store.get_version(source)
+    assert f"[Documento: {source}]" in library_index
@@ -0,0 +1,40 @@
+from embedding_cache import CachedEmbeddingFunction, EmbeddingCache
+
+
+def _vector(text):
+    return [float(len(text)), float(sum(map(ord, text)) % 13), 1.0, 0.0]
+
+
+def test_cached_texts_are_not_embedded_again(tmp_path):
+    calls = []
+
+    def embed(texts):
+        calls.append(list(texts))
+        return [_vector(t) for t in texts]
+
+    function = CachedEmbeddingFunction(embed, EmbeddingCache(str(tmp_path / "e.sqlite3"), "modelo"))
+    assert function(["a", "b", "a"]) == [_vector("a"), _vector("b"), _vector("a")]
+    assert function(["b", "c"]) == [_vector("b"), _vector("c")]
+    assert calls == [["a", "b"], ["c"]]
+    assert function.cache.stats()["entries"] == 3
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    cache = EmbeddingCache(str(tmp_path / "e.sqlite3"), "modelo", max_entries=3)
+    for text in ("a", "b", "c"): cache.put_many([text], [_vector(text)])
+    cache.get_many(["a"])
+    cache.put_many(["d"], [_vector("d")])
+    assert [v is not None for v in cache.get_many(["a", "b", "c", "d"])] == [True, False, True, True]
+    assert cache.stats()["entries"] == 3
+
+
+def test_byte_limit_and_counters_survive_reopening(tmp_path):
+    path = str(tmp_path / "e.sqlite3")
+    cache = EmbeddingCache(path, "modelo", max_bytes=16 * 3)  # Tres vectores de 4 floats.
+    cache.put_many(["a", "b"], [_vector("a"), _vector("b")])
+    cache.put_many(["a"], [_vector("a")])  # Sustituir una entrada no la cuenta dos veces.
+    assert (cache._entries, cache._bytes) == (2, 32)
+    cache.close()
+    cache = EmbeddingCache(path, "modelo", max_bytes=16 * 3)
+    cache.put_many(["c", "d"], [_vector("c"), _vector("d")])
+    assert (cache._entries, cache._bytes) == (3, 48) == tuple(cache._totals())
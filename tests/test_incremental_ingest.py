@@ -0,0 +1,62 @@
+import os
+
+from conftest import sample_text
+
+
+def _write(path, text):
+    with open(path, "w", encoding="utf-8") as f: f.write(text)
+
+
+def _count_upserts(rag_system, monkeypatch):
+    collection, upserted = rag_system.collection, []
+    upsert = collection.upsert
+
+    def counted(documents, metadatas, ids):
+        upserted.extend(ids)
+        upsert(documents=documents, metadatas=metadatas, ids=ids)
+
+    monkeypatch.setattr(collection, "upsert", counted)
+    return upserted
+
+
+def test_reingest_upserts_only_changed_chunks(rag_system, tmp_path, monkeypatch):
+    source = str(tmp_path / "tratado.txt")
+    paragraphs = sample_text("tratado", 400).split("\n\n")
+    _write(source, "\n\n".join(paragraphs))
+    upserted = _count_upserts(rag_system, monkeypatch)
+    assert rag_system.add_document_pipeline(source)["success"]
+    total = len(upserted)
+    assert total > 5
+
+    upserted.clear()
+    paragraphs[-1] = "Un párrafo final reescrito por completo con otras palabras distintas."
+    _write(source, "\n\n".join(paragraphs))
+    assert rag_system.add_document_pipeline(source)["success"]
+    assert upserted == [f"{source}_{total - 1}"]
+
+    # Mismo contenido con otra fecha: no se reingiere (la huella es el hash del contenido).
+    upserted.clear()
+    os.utime(source, (1, 1))
+    assert rag_system.add_document_pipeline(source).get("unchanged") and upserted == []
+
+
+def test_shorter_version_deletes_stale_chunks(rag_system, tmp_path):
+    source = str(tmp_path / "menguante.txt")
+    _write(source, sample_text("menguante", 400))
+    rag_system.add_document_pipeline(source)
+    before = len(rag_system.collection.get(where={"source": source}, include=[])["ids"])
+    _write(source, sample_text("menguante", 100))
+    rag_system.add_document_pipeline(source)
+    after = rag_system.collection.get(where={"source": source}, include=[])["ids"]
+    assert 0 < len(after) < before
+    assert sorted(after) == sorted(f"{source}_{i}" for i in range(len(after)))
+
+
+def test_force_reembeds_everything(rag_system, tmp_path, monkeypatch):
+    source = str(tmp_path / "forzado.txt")
+    _write(source, sample_text("forzado", 200))
+    rag_system.add_document_pipeline(source)
+    upserted = _count_upserts(rag_system, monkeypatch)
+    assert rag_system.add_document_pipeline(source).get("unchanged")
+    assert rag_system.add_document_pipeline(source, force=True)["success"]
+    assert len(upserted) == len(rag_system.collection.get(where={"source": source}, include=[])["ids"])
@@ -0,0 +1,71 @@
+import threading
+import time
+
+from ingest_jobs import DONE, FAILED, RUNNING, IngestJobStore, IngestQueue
+
+
+class _FlakyIngest:
+    """Ingesta simulada: guarda un lote en el punto de control y falla las primeras `failures` veces."""
+
+    def __init__(self, failures: int):
+        self.failures = failures
+        self.resumed_from = []
+
+    def run_ingest_job(self, source, force, cancel_event, checkpoint):
+        self.resumed_from.append(checkpoint.get("embebidos", 0))
+        checkpoint.save("embebiendo", embebidos=checkpoint.get("embebidos", 0) + 10)
+        if len(self.resumed_from) <= self.failures: return {"success": False, "message": "API caída"}
+        return {"success": True, "message": "ok"}
+
+
+def _wait_for(store, job_id, statuses, timeout=10):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        job = store.get(job_id)
+        if job["status"] in statuses: return job
+        time.sleep(0.02)
+    raise AssertionError(f"El trabajo sigue en '{job['status']}'")
+
+
+def test_failed_job_is_retried_from_its_checkpoint(tmp_path):
+    store = IngestJobStore(str(tmp_path / "cola.sqlite3"))
+    ingest = _FlakyIngest(failures=1)
+    ingest_queue = IngestQueue(ingest, store, workers=1, max_attempts=3, retry_seconds=0.01)
+    ingest_queue.start()
+    job = _wait_for(store, ingest_queue.submit("a.pdf"), (DONE, FAILED))
+    ingest_queue.stop()
+    assert job["status"] == DONE and job["attempts"] == 2
+    assert ingest.resumed_from == [0, 10] and job["progress"] == {"embebidos": 20}
+
+
+def test_job_gives_up_after_max_attempts(tmp_path):
+    store = IngestJobStore(str(tmp_path / "cola.sqlite3"))
+    ingest_queue = IngestQueue(_FlakyIngest(failures=5), store, workers=1, max_attempts=2, retry_seconds=0.01)
+    ingest_queue.start()
+    job = _wait_for(store, ingest_queue.submit("a.pdf"), (DONE, FAILED))
+    ingest_queue.stop()
+    assert job["status"] == FAILED and job["attempts"] == 2 and job["message"] == "API caída"
+
+
+def test_interrupted_jobs_resume_only_when_the_queue_starts(tmp_path):
+    store = IngestJobStore(str(tmp_path / "cola.sqlite3"))
+    job_id = store.add("a.pdf")
+    store.claim()  # La aplicación se cerró con el trabajo en curso.
+    ingest_queue = IngestQueue(_FlakyIngest(failures=0), store, workers=1, max_attempts=3, retry_seconds=0.01)
+    seen, done = [], threading.Event()
+
+    def listener(job):
+        seen.append(job["status"])
+        if job["status"] == DONE: done.set()
+
+    ingest_queue.subscribe(listener)
+    time.sleep(0.1)
+    assert store.get(job_id)["status"] == RUNNING and not seen
+    ingest_queue.start()
+    assert done.wait(10)
+    ingest_queue.stop()
+    assert seen[0] == RUNNING and seen[-1] == DONE
+
+
+def test_rag_system_creates_its_queue_without_starting_it(rag_system):
+    assert rag_system.ingest_queue._threads == []
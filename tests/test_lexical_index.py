@@ -0,0 +1,37 @@
+from lexical_index import BM25Index, LexicalIndexStore, reciprocal_rank_fusion, tokenize
+
+
+def _index():
+    index = BM25Index()
+    index.add("alquimia", "La alquimia transmuta los metales en oro.")
+    index.add("cabala", "La cábala estudia los nombres divinos y el Zohar.")
+    index.add("ambos", "Alquimia y cábala comparten símbolos; la alquimia busca la piedra filosofal.")
+    return index
+
+
+def test_tokenize_drops_accents_case_and_stopwords():
+    assert tokenize("La Cábala y el ZOHAR de Alquímia") == ["cabala", "zohar", "alquimia"]
+
+
+def test_bm25_ranks_by_term_frequency_and_rarity():
+    results = _index().search("alquimia", top_k=5)
+    assert [chunk_id for chunk_id, _ in results] == ["ambos", "alquimia"]
+    assert _index().search("zohar")[0][0] == "cabala"
+    assert _index().search("inexistente") == []
+
+
+def test_store_round_trips_indexes_and_keeps_a_bounded_cache(tmp_path):
+    store = LexicalIndexStore(str(tmp_path), max_cached=1)
+    store.save("a.pdf", _index())
+    store.save("b.pdf", BM25Index())
+    assert list(store._cache) == ["b.pdf"]
+    assert store.load("a.pdf").search("zohar") == _index().search("zohar")
+    store.delete("a.pdf")
+    assert store.load("a.pdf") is None
+
+
+def test_reciprocal_rank_fusion_rewards_agreement():
+    fused = reciprocal_rank_fusion([["a", "b", "c"], ["c", "b", "d"]], k=60)
+    # c (1.º y 3.º) supera por poco a b (2.º en las dos); ambos, a los que solo aparecen en una lista.
+    assert [item for item, _ in fused] == ["c", "b", "a", "d"]
+    assert dict(fused)["b"] == 1 / 62 + 1 / 62
@@ -0,0 +1,34 @@
+import json
+
+from metadata_store import MetadataStore
+
+
+def _write_legacy(path, documents: dict):
+    path.write_text(json.dumps(documents), encoding="utf-8")
+
+
+def test_migrates_legacy_json_once(tmp_path):
+    legacy = tmp_path / "metadata_store.json"
+    _write_legacy(legacy, {"a.pdf": {"titulo": "A", "tags": ["x"], "_huella": {"size": 1}},
+                           "b.pdf": {"titulo": "B"}})
+    store = MetadataStore(str(tmp_path / "catalogo.sqlite3"), str(legacy))
+    assert len(store) == 2
+    assert store.get_ingest_state("a.pdf") == {"size": 1}
+    assert "_huella" not in store.get_master_index("a.pdf")
+    assert not legacy.exists() and (tmp_path / "metadata_store.json.migrado").exists()
+
+
+def test_failed_migration_is_retried_on_next_start(tmp_path):
+    legacy = tmp_path / "metadata_store.json"
+    # La segunda entrada no es un Índice Maestro válido: la importación falla a mitad.
+    _write_legacy(legacy, {"a.pdf": {"titulo": "A"}, "b.pdf": None})
+    db_path = str(tmp_path / "catalogo.sqlite3")
+    store = MetadataStore(db_path, str(legacy))
+    assert len(store) == 0 and legacy.exists()
+    store.save_document("nuevo.pdf", {"titulo": "Nuevo"}, {})
+    store.close()
+
+    _write_legacy(legacy, {"a.pdf": {"titulo": "A"}, "b.pdf": {"titulo": "B"}})
+    store = MetadataStore(db_path, str(legacy))
+    assert sorted(d["id"] for d in store.summaries()) == ["a.pdf", "b.pdf", "nuevo.pdf"]
+    assert not legacy.exists()
@@ -0,0 +1,105 @@
+import asyncio
+from types import SimpleNamespace
+
+from prompt_builder import PromptBuilder, estimate_tokens, pack_context, render_master_index, truncate_to_tokens
+
+
+class _FakeModel:
+    def __init__(self):
+        self.prompts = []
+
+    async def generate_content_async(self, prompt):
+        self.prompts.append(prompt)
+        return SimpleNamespace(text=f"resumen {len(self.prompts)}")
+
+
+def _builder(model=None, **budgets):
+    settings = dict(index_tokens=400, history_tokens=60, recent_messages=2, context_tokens=300)
+    settings.update(budgets)
+    return PromptBuilder(lambda: model, **settings)
+
+
+def _master_index(chapters=10):
+    return {"titulo": "Tratado", "autor": "Anónimo", "fecha_publicacion": "1900", "resumen_global": "Un resumen.",
+            "indice_estructurado": {f"Capítulo {i}": "resumen largo del capítulo " * 5 for i in range(chapters)},
+            "tags": ["uno", "dos"]}
+
+
+def test_truncate_to_tokens_cuts_on_a_word_boundary():
+    text = "palabra " * 50
+    truncated = truncate_to_tokens(text, 10)
+    assert truncated.endswith(" [...]") and len(truncated) <= 40 + len(" [...]")
+    assert set(truncated[:-len(" [...]")].split()) == {"palabra"}
+    assert truncate_to_tokens("corto", 10) == "corto"
+    assert estimate_tokens("abcd") == 1 and estimate_tokens("abcde") == 2
+
+
+def test_master_index_fits_its_budget_with_names_then_a_count():
+    full = render_master_index(_master_index(), 10_000)
+    assert full.count(": resumen largo") == 10 and full.endswith("Temas: uno, dos")
+
+    rendered = render_master_index(_master_index(chapters=60), 200)
+    lines = rendered.splitlines()
+    assert estimate_tokens(rendered) <= 200
+    assert "- Capítulo 0: resumen largo" in rendered
+    assert any(line == f"- Capítulo {i}" for line in lines for i in range(60))
+    assert lines[-2].startswith("- ... (") and lines[-2].endswith(" secciones más)")
+    assert lines[-1] == "Temas: uno, dos"
+
+
+def test_pack_context_respects_the_budget():
+    retrieved = [("a", "x" * 400), ("b", "y" * 400), ("c", "z" * 4000)]
+    # a y b caben enteros (100 tokens cada uno); c se recorta a lo que queda.
+    packed = pack_context(retrieved, max_tokens=450, min_tokens=100)
+    assert [chunk_id for chunk_id, _ in packed] == ["a", "b", "c"]
+    assert packed[:2] == retrieved[:2] and estimate_tokens(packed[2][1]) <= 250 + 2
+
+    # Si lo que queda no llega al mínimo, el fragmento se descarta.
+    assert [chunk_id for chunk_id, _ in pack_context(retrieved, max_tokens=250, min_tokens=100)] == ["a", "b"]
+    # El mejor fragmento entra siempre, aunque haya que recortarlo.
+    best = pack_context([("c", "z" * 4000)], max_tokens=10, min_tokens=100)
+    assert [chunk_id for chunk_id, _ in best] == ["c"] and estimate_tokens(best[0][1]) <= 100 + 2
+
+
+def test_short_history_goes_in_verbatim():
+    model = _FakeModel()
+    messages = [{"role": "user", "content": "hola"}, {"role": "model", "content": "buenas"}]
+    assert asyncio.run(_builder(model).aformat_history(messages)) == "user: hola\nmodel: buenas"
+    assert model.prompts == []
+
+
+def test_long_history_is_summarized_incrementally():
+    model = _FakeModel()
+    builder = _builder(model)
+    messages = [{"role": "user" if i % 2 == 0 else "model", "content": f"mensaje {i} " + "texto " * 20} for i in range(6)]
+
+    history = asyncio.run(builder.aformat_history(messages))
+    assert history.startswith("(Resumen de la conversación anterior: resumen 1)")
+    assert "mensaje 5" in history and "mensaje 3" not in history
+    assert "mensaje 0" in model.prompts[0] and "mensaje 3" in model.prompts[0]
+
+    # El mismo historial reutiliza el resumen; dos turnos más solo resumen los mensajes nuevos.
+    asyncio.run(builder.aformat_history(messages))
+    assert len(model.prompts) == 1
+    messages += [{"role": "user", "content": "mensaje 6 " + "texto " * 20}, {"role": "model", "content": "mensaje 7"}]
+    history = asyncio.run(builder.aformat_history(messages))
+    assert history.startswith("(Resumen de la conversación anterior: resumen 2)")
+    assert "resumen 1" in model.prompts[1] and "mensaje 4" in model.prompts[1] and "mensaje 0" not in model.prompts[1]
+
+
+def test_library_index_splits_the_budget_and_loads_each_index_once():
+    loads = []
+
+    def load(document_id):
+        loads.append(document_id)
+        return None if document_id == "vacío.pdf" else _master_index()
+
+    builder = _builder(index_tokens=400)
+    documents = [("a.pdf", 1), ("b.pdf", 1), ("vacío.pdf", 1)]
+    rendered = builder.compact_library_index(documents, load)
+    sections = rendered.split("\n\n")
+    assert [section.splitlines()[0] for section in sections] == ["[Documento: a.pdf]", "[Documento: b.pdf]"]
+    assert all(estimate_tokens(section) <= 150 + 10 for section in sections)
+    builder.compact_library_index(documents, load)
+    assert loads == ["a.pdf", "b.pdf", "vacío.pdf", "vacío.pdf"]
+    assert builder.compact_library_index([("vacío.pdf", 1)], load) is None
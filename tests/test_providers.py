@@ -0,0 +1,78 @@
+import asyncio
+
+import pytest
+
+from providers import CallPolicy, EmbeddingProvider, GenerationProvider, HashingEmbeddingProvider
+from rate_limiter import RateLimiter
+
+
+class ResourceExhausted(Exception):
+    pass
+
+
+def _policy(**kwargs):
+    return CallPolicy(**{"max_retries": 2, "backoff": 0, "rate_limit_retries": 3, "rate_limit_backoff": 0, **kwargs})
+
+
+def test_call_passes_the_timeout_and_retries_failures():
+    calls = []
+
+    def flaky(text, timeout):
+        calls.append(timeout)
+        if len(calls) < 3: raise ConnectionError("caída")
+        return text.upper()
+
+    assert _policy(timeout=7).call(flaky, "hola") == "HOLA"
+    assert calls == [7, 7, 7]
+
+
+def test_call_gives_up_after_max_retries():
+    def broken(timeout):
+        raise ConnectionError("caída")
+
+    with pytest.raises(ConnectionError):
+        _policy().call(broken)
+
+
+def test_rate_limited_calls_slow_the_limiter_and_have_their_own_retries():
+    limiter = RateLimiter("prueba", 10_000, 10_000_000)
+    calls = []
+
+    def quota(timeout):
+        calls.append(1)
+        if len(calls) <= 3: raise ResourceExhausted("429 quota exceeded")
+        return "ok"
+
+    # Tres 429 seguidos superan max_retries (2), pero no rate_limit_retries (3).
+    assert _policy(limiter=limiter).call(quota) == "ok"
+    assert limiter.scale == pytest.approx(0.125 + limiter.recovery_step)
+
+
+def test_async_call_times_out_and_retries():
+    attempts = []
+
+    async def slow():
+        attempts.append(1)
+        if len(attempts) == 1: await asyncio.sleep(1)
+        return "ok"
+
+    assert asyncio.run(_policy(timeout=0.05).acall(slow)) == "ok"
+    assert len(attempts) == 2
+
+
+def test_incomplete_providers_fail_when_created():
+    class NoGeneration(GenerationProvider):
+        pass
+
+    class NoEmbedding(EmbeddingProvider):
+        pass
+
+    with pytest.raises(TypeError): NoGeneration()
+    with pytest.raises(TypeError): NoEmbedding()
+
+
+def test_embeddings_are_batched():
+    provider = HashingEmbeddingProvider(dim=32, policy=_policy())
+    provider.batch_size = 2
+    vectors = provider(["uno", "dos", "tres", "uno"])
+    assert len(vectors) == 4 and len(vectors[0]) == 32 and vectors[0] == vectors[3]
@@ -0,0 +1,51 @@
+import numpy as np
+
+import quantized_store
+from quantized_store import QuantizedCollection
+
+
+def _embed(texts):
+    return np.array([[len(text), sum(map(ord, text)) % 97, text.count("a"), 1.0] for text in texts], dtype=np.float32)
+
+
+class _LockCheckingConnection:
+    """Conexión que anota las sentencias ejecutadas sin el cerrojo del almacén."""
+
+    def __init__(self, conn, lock):
+        self._conn, self._lock, self.unlocked = conn, lock, []
+
+    def execute(self, sql, *args):
+        if not self._lock._is_owned(): self.unlocked.append(sql)
+        return self._conn.execute(sql, *args)
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+
+def test_query_and_get_read_sqlite_under_the_store_lock(tmp_path):
+    store = QuantizedCollection(str(tmp_path / "q"), _embed)
+    store.upsert([f"fragmento {i} de a" for i in range(50)], [{"source": "base"} for _ in range(50)], [f"b{i}" for i in range(50)])
+    store._conn = _LockCheckingConnection(store._conn, store._lock)
+    result = store.query(["fragmento de a"], n_results=5)
+    store.get(where={"source": "base"})
+    assert len(result["ids"][0]) == len(result["metadatas"][0]) == 5
+    assert store._conn.unlocked == []
+
+
+def test_rows_reused_during_a_query_are_not_returned_with_stale_distances(tmp_path, monkeypatch):
+    store = QuantizedCollection(str(tmp_path / "q"), _embed)
+    store.upsert(["aaaa", "zzzzzzzzzzzzzz"], [{"source": "x"}, {"source": "x"}], ["cerca", "lejos"])
+    exact_distances = quantized_store.exact_distances
+
+    def reuse_row_while_rescoring(vectors, queries):
+        # Otro hilo borra "cerca" y su fila libre pasa a otro fragmento mientras se re-puntúa.
+        monkeypatch.setattr(quantized_store, "exact_distances", exact_distances)
+        distances = exact_distances(vectors, queries)
+        store.delete(ids=["cerca"])
+        store.upsert(["otro texto muy distinto"], [{"source": "y"}], ["otro"])
+        return distances
+
+    monkeypatch.setattr(quantized_store, "exact_distances", reuse_row_while_rescoring)
+    result = store.query(["aaaa"], n_results=2)
+    assert result["ids"] == [["lejos"]]
+    assert store.get(ids=["otro"])["ids"] == ["otro"]
@@ -0,0 +1,56 @@
+from conftest import ingest_sample
+from query_cache import TTLCache, normalize_question, stable_hash
+import query_cache
+
+
+def test_entries_expire_after_their_ttl(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(query_cache.time, "monotonic", lambda: now[0])
+    cache = TTLCache(max_entries=10, ttl_seconds=60)
+    cache.put("clave", "valor")
+    now[0] += 59
+    assert cache.get("clave") == "valor"
+    now[0] += 2
+    assert cache.get("clave") is None
+    assert cache.stats() == {"hits": 1, "misses": 1, "entries": 0}
+
+
+def test_size_bound_evicts_the_least_recently_used():
+    cache = TTLCache(max_entries=2, ttl_seconds=60)
+    cache.put("a", 1); cache.put("b", 2)
+    cache.get("a")
+    cache.put("c", 3)
+    assert (cache.get("a"), cache.get("b"), cache.get("c")) == (1, None, 3)
+
+
+def test_invalidate_by_predicate():
+    cache = TTLCache(max_entries=10, ttl_seconds=60)
+    cache.put(("a.pdf", 1), "x"); cache.put(("b.pdf", 1), "y")
+    cache.invalidate(lambda key: key[0] == "a.pdf")
+    assert cache.get(("a.pdf", 1)) is None and cache.get(("b.pdf", 1)) == "y"
+
+
+def test_trivial_variants_share_a_key():
+    assert normalize_question("¿Qué es la Cábala?") == normalize_question("que es la cabala")
+    assert stable_hash([{"role": "user"}]) == stable_hash([{"role": "user"}]) != stable_hash([])
+
+
+def test_repeated_question_reuses_plan_and_answer(rag_system, tmp_path, monkeypatch):
+    source = ingest_sample(rag_system, tmp_path, "alquimia")
+    model = rag_system.generation_model
+    calls = []
+    generate = model._agenerate
+
+    async def counted(prompt):
+        calls.append(prompt)
+        return await generate(prompt)
+
+    monkeypatch.setattr(model, "_agenerate", counted)
+    first = rag_system.query_document_pipeline("¿Qué es la alquimia?", source, "redactor")
+    second = rag_system.query_document_pipeline("que es la ALQUIMIA", source, "redactor")
+    assert first == second and not first[0].startswith("Error")
+    assert len(calls) == 2  # Plan y respuesta, solo la primera vez.
+    # Reingerir el documento (o borrarlo) invalida lo cacheado.
+    rag_system._invalidate_query_caches(source)
+    rag_system.query_document_pipeline("¿Qué es la alquimia?", source, "redactor")
+    assert len(calls) == 4
@@ -0,0 +1,81 @@
+import asyncio
+
+import pytest
+
+import rate_limiter
+from rate_limiter import RateLimiter, get_rate_limiter, is_rate_limit_error, retry_after_seconds
+
+
+class _Clock:
+    """Reloj falso: time.sleep y asyncio.sleep avanzan el tiempo en lugar de esperar."""
+
+    def __init__(self, monkeypatch):
+        self.now, self.slept = 1000.0, []
+        monkeypatch.setattr(rate_limiter.time, "monotonic", lambda: self.now)
+        monkeypatch.setattr(rate_limiter.time, "sleep", self.sleep)
+
+        async def asleep(seconds):
+            self.sleep(seconds)
+        monkeypatch.setattr(rate_limiter.asyncio, "sleep", asleep)
+
+    def sleep(self, seconds):
+        self.slept.append(seconds); self.now += seconds
+
+
+class ResourceExhausted(Exception):
+    pass
+
+
+def test_rate_limit_errors_and_suggested_delays_are_recognised():
+    assert is_rate_limit_error(ResourceExhausted("cuota"))
+    assert is_rate_limit_error(Exception("429 Too Many Requests"))
+    assert is_rate_limit_error(Exception("Quota exceeded for metric"))
+    assert not is_rate_limit_error(TimeoutError("timed out"))
+    assert retry_after_seconds(Exception("Please retry in 12.5s.")) == 12.5
+    assert retry_after_seconds(Exception("retry_delay { seconds: 7 }")) == 7
+    assert retry_after_seconds(Exception("429")) is None
+
+
+def test_calls_wait_once_the_request_bucket_is_empty(monkeypatch):
+    clock = _Clock(monkeypatch)
+    limiter = RateLimiter("prueba", requests_per_minute=60, tokens_per_minute=1_000_000)
+    for _ in range(60): limiter.acquire()
+    assert clock.slept == []
+    limiter.acquire()
+    # A 60 peticiones por minuto se recupera una por segundo.
+    assert sum(clock.slept) == pytest.approx(1.0)
+
+
+def test_token_budget_limits_large_requests(monkeypatch):
+    clock = _Clock(monkeypatch)
+    limiter = RateLimiter("prueba", requests_per_minute=1000, tokens_per_minute=600)
+    asyncio.run(limiter.aacquire(500))
+    asyncio.run(limiter.aacquire(400))
+    assert sum(clock.slept) == pytest.approx(30.0)
+    # Una petición mayor que el cubo entero pasa cuando está lleno, en lugar de esperar para siempre.
+    clock.now += 60
+    limiter.acquire(5000)
+    assert sum(clock.slept) == pytest.approx(30.0)
+
+
+def test_a_429_halves_the_rate_and_pauses_every_caller(monkeypatch):
+    clock = _Clock(monkeypatch)
+    limiter = RateLimiter("prueba", requests_per_minute=60, tokens_per_minute=1000, min_scale=0.2, recovery_step=0.1)
+    limiter.on_rate_limited(pause=5)
+    assert limiter.scale == 0.5 and limiter.token_capacity == 500
+    limiter.acquire()
+    assert clock.slept[0] == pytest.approx(5.0)
+
+    for _ in range(3): limiter.on_rate_limited(pause=0)
+    assert limiter.scale == 0.2
+    limiter.on_success(); limiter.on_success()
+    assert limiter.scale == pytest.approx(0.4)
+    for _ in range(10): limiter.on_success()
+    assert limiter.scale == 1.0
+
+
+def test_one_limiter_per_model_name():
+    limiter = get_rate_limiter("modelo-de-prueba", 10, 100)
+    assert get_rate_limiter("modelo-de-prueba", 99, 999) is limiter
+    assert limiter.requests_per_minute == 10
+    assert get_rate_limiter("otro-modelo-de-prueba", 10, 100) is not limiter
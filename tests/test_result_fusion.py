@@ -0,0 +1,31 @@
+from result_fusion import maximal_marginal_relevance, merge_query_results
+
+
+def test_merge_keeps_each_chunk_once_with_its_best_distance():
+    results = {'ids': [["a", "b"], ["b", "c"]],
+               'documents': [["texto a", "texto b"], ["texto b", "texto c"]],
+               'metadatas': [[{'source': "x"}, None], [None, {'source': "y"}]],
+               'distances': [[0.2, 0.5], [0.1, 0.3]],
+               'embeddings': [[[1, 0], [0, 1]], [[0, 1], [1, 1]]]}
+    merged = merge_query_results(results)
+    assert [(item['id'], item['distance']) for item in merged] == [("b", 0.1), ("a", 0.2), ("c", 0.3)]
+    assert merged[0]['metadata'] == {} and merged[0]['embedding'] == [0, 1]
+    assert merge_query_results({'ids': [], 'distances': []}) == []
+    assert merge_query_results({**results, 'embeddings': None})[0]['embedding'] is None
+
+
+def test_mmr_skips_near_duplicates_of_what_was_already_chosen():
+    embeddings = [[1.0, 0.0], [0.99, 0.01], [0.0, 1.0]]
+    relevance = [1.0, 0.95, 0.6]
+    # Solo relevancia: el casi duplicado va segundo; con diversidad, el candidato distinto pasa delante.
+    assert maximal_marginal_relevance(embeddings, relevance, k=3, lambda_=1.0) == [0, 1, 2]
+    assert maximal_marginal_relevance(embeddings, relevance, k=2, lambda_=0.5) == [0, 2]
+
+
+def test_mmr_edge_cases():
+    assert maximal_marginal_relevance([], [], k=3, lambda_=0.5) == []
+    assert maximal_marginal_relevance([[1.0, 0.0]], [0.4], k=0, lambda_=0.5) == []
+    # Sin embeddings se ordena por relevancia; k mayor que los candidatos devuelve todos.
+    assert maximal_marginal_relevance([None, None, None], [0.2, 0.9, 0.5], k=5, lambda_=0.5) == [1, 2, 0]
+    # Un candidato sin embedding no se parece a nadie.
+    assert maximal_marginal_relevance([[1.0, 0.0], [1.0, 0.0], None], [1.0, 0.9, 0.5], k=2, lambda_=0.5) == [0, 2]
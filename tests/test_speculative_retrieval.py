@@ -0,0 +1,34 @@
+import asyncio
+import time
+
+import backend_controller
+from conftest import ingest_sample
+
+
+def test_slow_planner_falls_back_to_the_speculative_retrieval(rag_system, tmp_path, monkeypatch):
+    source = ingest_sample(rag_system, tmp_path, "astrolabio")
+    monkeypatch.setattr(backend_controller, "PLANNER_DEADLINE_SECONDS", 0.2)
+
+    async def slow_plan(question, index_text, formatted_history):
+        await asyncio.sleep(1.0)
+        return {"optimized_queries": ["astrolabio medieval"], "keywords": ["astrolabio"]}
+
+    monkeypatch.setattr(rag_system, "_agenerate_search_plan", slow_plan)
+    start = time.monotonic()
+    answer, context, sources = rag_system.query_document_pipeline("¿Para qué sirve el astrolabio?", source, "redactor")
+    assert time.monotonic() - start < 0.9
+    assert not answer.startswith("Error") and "astrolabio" in context and sources == [source]
+    # El plan que llega tarde se guarda para la próxima vez.
+    time.sleep(1.0)
+    assert any(key[0] == source for key in rag_system.plan_cache._entries)
+
+
+def test_planner_failure_still_answers(rag_system, tmp_path, monkeypatch):
+    source = ingest_sample(rag_system, tmp_path, "clepsidra")
+
+    async def broken_plan(question, index_text, formatted_history):
+        raise ConnectionError("API caída")
+
+    monkeypatch.setattr(rag_system, "_agenerate_search_plan", broken_plan)
+    answer, context, _ = rag_system.query_document_pipeline("¿Qué es la clepsidra?", source, "redactor")
+    assert not answer.startswith("Error") and "clepsidra" in context
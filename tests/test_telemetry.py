@@ -0,0 +1,47 @@
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Con spawn, cada trabajador vuelve a importar telemetry; al salir no debe pisar rag.prom.
+SPAWN_POOL_SCRIPT = """
+import multiprocessing
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.insert(0, {root!r})
+import telemetry
+
+
+def work(n):
+    with telemetry.span("trabajo"):
+        return n
+
+
+if __name__ == "__main__":
+    telemetry.increment("llm_calls", 2, model="x")
+    with ProcessPoolExecutor(2, mp_context=multiprocessing.get_context("spawn"),
+                             initializer=telemetry.mark_worker_process) as pool:
+        list(pool.map(work, range(4)))
+"""
+
+
+def _run(args: list[str], db_path):
+    env = {**os.environ, "RAG_DB_PATH": str(db_path), "RAG_TELEMETRY_EXPORTERS": "jsonl,prometheus"}
+    subprocess.run([sys.executable, *args], cwd=ROOT, env=env, check=True, capture_output=True)
+
+
+def test_import_writes_nothing(tmp_path):
+    _run(["-c", "import telemetry, chunker"], tmp_path / "db")
+    assert not (tmp_path / "db").exists()
+
+
+def test_spawned_workers_do_not_overwrite_metrics(tmp_path):
+    script = tmp_path / "pool.py"
+    script.write_text(SPAWN_POOL_SCRIPT.format(root=ROOT))
+    _run([str(script)], tmp_path / "db")
+    metrics = (tmp_path / "db" / "telemetria" / "rag.prom").read_text()
+    assert 'rag_llm_calls_total{model="x"} 2' in metrics
+    # Los tramos de los trabajadores sí se exportan.
+    assert (tmp_path / "db" / "telemetria" / "trazas.jsonl").read_text().count('"trabajo"') == 4
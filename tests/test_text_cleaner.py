@@ -0,0 +1,28 @@
+from text_cleaner import normalize_pages
+
+
+_WORDS = "agua piedra fuego viento tierra árbol río monte nube camino puerta ventana".split()
+
+
+def _body(n: int) -> str:
+    # Líneas distintas en cada página (no solo en los números), para que no parezcan cabeceras.
+    return "\n".join(" ".join(_WORDS[(n * 7 + i * 3 + k) % len(_WORDS)] for k in range(8)) for i in range(6))
+
+
+def test_keeps_words_that_look_like_roman_numerals():
+    pages = [(1, "VII\n" + _body(1)), (2, _body(2) + "\nCivil")]
+    cleaned = dict(normalize_pages(pages))
+    assert cleaned[1].splitlines()[0] == "VII"
+    assert cleaned[2].splitlines()[-1] == "Civil"
+
+
+def test_single_lowercase_roman_word_is_kept():
+    pages = [(1, "mix\n" + _body(1)), (2, _body(2))]
+    assert dict(normalize_pages(pages))[1].splitlines()[0] == "mix"
+
+
+def test_strips_page_numbers():
+    pages = [(n, f"{_body(n)}\n{roman}") for n, roman in enumerate(["i", "ii", "iii", "iv"], 1)]
+    pages += [(5, f"{_body(5)}\n- 5 -"), (6, f"Página 6 de 40\n{_body(6)}")]
+    for number, text in normalize_pages(pages):
+        assert text == _body(number)
@@ -0,0 +1,73 @@
+import numpy as np
+import pytest
+
+from vector_cache import DocumentVectorCache
+
+
+class _Collection:
+    """Colección en memoria con la forma de collection.get de Chroma; cuenta las cargas."""
+
+    def __init__(self, documents: dict):
+        self.documents = documents
+        self.loads = []
+        self.on_load = None
+
+    def get(self, where, include):
+        source = where["source"]
+        self.loads.append(source)
+        if self.on_load: self.on_load(source)
+        chunks = self.documents.get(source, [])
+        return {'ids': [f"{source}_{i}" for i in range(len(chunks))], 'documents': [f"texto {i}" for i in range(len(chunks))],
+                'metadatas': [{'source': source} for _ in chunks], 'embeddings': chunks}
+
+
+def _vectors(seed, n=8, dim=4):
+    return np.random.default_rng(seed).normal(size=(n, dim)).astype(np.float32).tolist()
+
+
+def test_query_matches_brute_force_squared_l2_across_documents():
+    collection = _Collection({"a.pdf": _vectors(1), "b.pdf": _vectors(2)})
+    cache = DocumentVectorCache(collection, max_documents=4, max_bytes=10**6)
+    queries = np.random.default_rng(3).normal(size=(2, 4)).astype(np.float32)
+    results = cache.query(["a.pdf", "b.pdf", "falta.pdf"], queries, n_results=5)
+
+    everything = np.array(collection.documents["a.pdf"] + collection.documents["b.pdf"])
+    ids = [f"a.pdf_{i}" for i in range(8)] + [f"b.pdf_{i}" for i in range(8)]
+    for query, hit_ids, distances in zip(queries, results["ids"], results["distances"]):
+        expected = ((everything - query) ** 2).sum(axis=1)
+        order = np.argsort(expected)[:5]
+        assert hit_ids == [ids[i] for i in order]
+        assert distances == pytest.approx(expected[order].tolist(), rel=1e-4, abs=1e-5)
+    assert results["metadatas"][0][0]["source"] in ("a.pdf", "b.pdf")
+    assert cache.query(["falta.pdf"], queries, n_results=5)["ids"] == []
+
+
+def test_documents_are_loaded_once_and_evicted_in_lru_order():
+    collection = _Collection({name: _vectors(i) for i, name in enumerate(["a", "b", "c"])})
+    cache = DocumentVectorCache(collection, max_documents=2, max_bytes=10**6)
+    cache.get("a"); cache.get("b"); cache.get("a")
+    cache.get("c")
+    cache.get("a")
+    assert collection.loads == ["a", "b", "c"]
+    cache.get("b")
+    assert collection.loads == ["a", "b", "c", "b"]
+
+    # El límite de bytes también expulsa, pero siempre queda el último documento cargado.
+    tiny = DocumentVectorCache(collection, max_documents=10, max_bytes=1)
+    tiny.get("a"); tiny.get("b")
+    assert list(tiny._entries) == ["b"]
+
+
+def test_invalidation_during_a_load_discards_the_stale_vectors():
+    collection = _Collection({"a.pdf": _vectors(1)})
+    cache = DocumentVectorCache(collection, max_documents=4, max_bytes=10**6)
+    collection.on_load = lambda source: cache.invalidate(source)
+    assert cache.get("a.pdf") is not None
+    collection.on_load = None
+    cache.get("a.pdf")
+    assert collection.loads == ["a.pdf", "a.pdf"]
+    cache.get("a.pdf")
+    assert len(collection.loads) == 2
+    cache.invalidate()
+    cache.get("a.pdf")
+    assert len(collection.loads) == 3
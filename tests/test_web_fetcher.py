@@ -0,0 +1,140 @@
+import gzip
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from web_fetcher import FetchedPage, HttpCache, WebFetcher
+
+LAST_MODIFIED = "Wed, 01 Jan 2025 00:00:00 GMT"
+
+
+class _Site(BaseHTTPRequestHandler):
+    """Servidor de prueba: páginas con ETag o Last-Modified, una página lenta y sitemaps."""
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, status, body=b"", content_type="text/html; charset=utf-8", **headers):
+        self.send_response(status)
+        if status != 304:
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+        for name, value in headers.items(): self.send_header(name.replace("_", "-"), value)
+        self.end_headers()
+        if status != 304: self.wfile.write(body)
+
+    def do_GET(self):
+        site = self.server.site
+        with site["lock"]: site["requests"].append(self.path)
+        base = f"http://127.0.0.1:{self.server.server_port}"
+        if self.path == "/etag":
+            if self.headers.get("If-None-Match") == '"v1"': return self._send(304)
+            return self._send(200, b"<p>con etag</p>", ETag='"v1"')
+        if self.path == "/fecha":
+            if self.headers.get("If-Modified-Since") == LAST_MODIFIED: return self._send(304)
+            return self._send(200, b"<p>con fecha</p>", Last_Modified=LAST_MODIFIED)
+        if self.path.startswith("/lenta"):
+            with site["lock"]:
+                site["active"] += 1
+                site["max_active"] = max(site["max_active"], site["active"])
+            time.sleep(0.1)
+            with site["lock"]: site["active"] -= 1
+            return self._send(200, b"<p>lenta</p>")
+        if self.path == "/sitemap.xml":
+            return self._send(200, f"""<?xml version="1.0" encoding="UTF-8"?>
+<sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">
+  <sitemap><loc>{base}/sitemap_a.xml</loc></sitemap>
+  <sitemap><loc>{base}/sitemap_b.xml.gz</loc></sitemap>
+</sitemapindex>""".encode(), content_type="application/xml")
+        if self.path == "/sitemap_a.xml":
+            return self._send(200, f"""<?xml version="1.0" encoding="UTF-8"?>
+<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">
+  <url><loc>{base}/p1</loc></url><url><loc>{base}/p2</loc></url>
+</urlset>""".encode(), content_type="application/xml")
+        if self.path == "/sitemap_b.xml.gz":
+            return self._send(200, gzip.compress(f"""<?xml version="1.0" encoding="UTF-8"?>
+<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">
+  <url><loc>{base}/p2</loc></url><url><loc>{base}/p3</loc></url>
+</urlset>""".encode()), content_type="application/gzip")
+        if self.path == "/enlaces.txt":
+            return self._send(200, f"{base}/p4\n# comentario\n\n{base}/p5\n".encode(), content_type="text/plain")
+        self._send(404, b"no existe")
+
+
+@pytest.fixture
+def site():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _Site)
+    server.daemon_threads = True
+    server.site = {"lock": threading.Lock(), "requests": [], "active": 0, "max_active": 0}
+    thread = threading.Thread(target=server.serve_forever, kwargs={"poll_interval": 0.05}, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_port}", server.site
+    server.shutdown()
+    server.server_close()
+
+
+def _fetcher(tmp_path, **kwargs):
+    fetcher = WebFetcher(HttpCache(str(tmp_path / "http.sqlite3"), 1024 * 1024), **kwargs)
+    fetcher.session.trust_env = False
+    return fetcher
+
+
+@pytest.mark.parametrize("path, body", [("/etag", b"<p>con etag</p>"), ("/fecha", b"<p>con fecha</p>")])
+def test_unchanged_page_is_reused_from_cache_after_304(tmp_path, site, path, body):
+    base, state = site
+    first = _fetcher(tmp_path).fetch(base + path)
+    # Otro descargador sobre la misma caché en disco: la petición condicional sale de lo guardado.
+    second = _fetcher(tmp_path).fetch(base + path)
+    assert not first.from_cache and first.content == body
+    assert second.from_cache and second.content == body and second.validators == first.validators
+    assert state["requests"] == [path, path]
+
+
+def test_pages_without_validators_are_not_cached(tmp_path, site):
+    base, _ = site
+    fetcher = _fetcher(tmp_path)
+    fetcher.fetch(base + "/lenta")
+    assert fetcher.cache.get(base + "/lenta") is None
+
+
+def test_concurrent_downloads_per_host_are_bounded(tmp_path, site):
+    base, state = site
+    fetcher = _fetcher(tmp_path, max_per_host=2, workers=8)
+    results = fetcher.fetch_many([f"{base}/lenta/{i}" for i in range(8)])
+    assert all(not isinstance(page, Exception) for _, page in results)
+    assert [url for url, _ in results] == [f"{base}/lenta/{i}" for i in range(8)]
+    assert state["max_active"] == 2
+
+
+def test_expands_sitemap_index_with_gzip_children(tmp_path, site):
+    base, _ = site
+    assert _fetcher(tmp_path).expand_url_list(base + "/sitemap.xml") == [f"{base}/p1", f"{base}/p2", f"{base}/p3"]
+
+
+def test_expands_plain_text_link_list(tmp_path, site):
+    base, _ = site
+    assert _fetcher(tmp_path).expand_url_list(base + "/enlaces.txt") == [f"{base}/p4", f"{base}/p5"]
+
+
+def test_failed_download_is_returned_not_raised(tmp_path, site):
+    base, _ = site
+    [(url, error)] = _fetcher(tmp_path).fetch_many([base + "/falta"])
+    assert url == base + "/falta" and isinstance(error, Exception)
+
+
+def test_cache_evicts_least_recently_used_pages_over_budget(tmp_path):
+    def page(name):
+        return FetchedPage(f"http://ejemplo/{name}", bytes(range(256)) * 4, "utf-8", f'"{name}"', None)
+
+    size = len(zlib.compress(page("a").content))
+    cache = HttpCache(str(tmp_path / "http.sqlite3"), size * 2)
+    cache.put(page("a")); cache.put(page("b"))
+    cache.put(page("a"))  # Sustituir una página no la cuenta dos veces.
+    cache.put(page("c"))
+    assert [cache.get(f"http://ejemplo/{name}") is not None for name in "abc"] == [True, False, True]
+    assert cache._bytes == cache._total_bytes() == size * 2
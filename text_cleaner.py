@@ -1,27 +1,155 @@
 # text_cleaner.py
+import hashlib
+import math
 import re
+from collections import Counter, deque
+
+from config import (RUNNING_LINES_MIN_PAGES, RUNNING_LINES_MIN_RATIO,
+                    RUNNING_LINES_SCAN, RUNNING_LINES_WINDOW,
+                    STRIP_RUNNING_LINES)
+
+# Espacios horizontales (incluidos tabuladores y espacios duros) que se colapsan en uno.
+_SPACES = re.compile(r'[ \t\f\v\u00a0]+')
+_DIGITS = re.compile(r'\d+')
+# Número romano en minúsculas y bien formado (i, iv, xii, xl...): "VII" o "civil" son texto, no paginación.
+_ROMAN = r'(?=[ivxlc])m{0,3}(?:c[md]|d?c{0,3})(?:x[cl]|l?x{0,3})(?:i[xv]|v?i{0,3})'
+# Número de página suelto: "12", "- 12 -", "Página 12 de 300", "p. 7", "xii"...
+_PAGE_NUMBER = re.compile(rf'^[\W_]*(?:(?i:p[aá]g(?:ina)?|page|p)\.?\s*)?(?:\d{{1,4}}|{_ROMAN})(?:\s*(?i:/|de|of)\s*\d{{1,4}})?[\W_]*$')
+# Un romano sin más ("xii") puede ser una palabra ("mix", "di"): solo se quita si otras páginas cercanas
+# también tienen uno en el borde. Las páginas que lo tienen cuentan esta firma especial.
+_BARE_ROMAN = re.compile(rf'^[\W_]*{_ROMAN}[\W_]*$')
+_ROMAN_SIGNATURE = "\0romano"
+# Las cabeceras y pies son cortos: una línea más larga en el borde de la página es contenido.
+_MAX_RUNNING_LINE_CHARS = 100
+
+
+class TextNormalizer:
+    """
+    Normalizador de texto de una sola pasada por línea: recorta cada línea, colapsa los espacios,
+    deja como mucho una línea en blanco seguida y aplica las reglas extra (patrón, reemplazo).
+
+    Sobre un flujo de páginas, además, detecta por estadística las cabeceras, pies y números de
+    página que se repiten y los elimina. Cada página se decide con una ventana de páginas vecinas
+    (RUNNING_LINES_WINDOW antes y después), así la memoria no depende del tamaño del documento
+    y también se detectan las cabeceras que cambian con cada capítulo.
+    """
+
+    def __init__(self, rules: list[tuple[str, str]] = (), strip_running_lines: bool = STRIP_RUNNING_LINES,
+                 scan_lines: int = RUNNING_LINES_SCAN, min_ratio: float = RUNNING_LINES_MIN_RATIO,
+                 min_pages: int = RUNNING_LINES_MIN_PAGES, window: int = RUNNING_LINES_WINDOW):
+        self.rules = [(re.compile(pattern), replacement) for pattern, replacement in rules]
+        self.strip_running_lines = strip_running_lines
+        self.scan_lines = scan_lines
+        self.min_ratio = min_ratio
+        self.min_pages = min_pages
+        self.window = window
+
+    def _lines(self, text: str) -> list[str]:
+        lines, previous_blank = [], True
+        for raw_line in text.splitlines():
+            line = _SPACES.sub(' ', raw_line).strip()
+            for pattern, replacement in self.rules: line = pattern.sub(replacement, line)
+            if line:
+                lines.append(line); previous_blank = False
+            elif not previous_blank:
+                lines.append(""); previous_blank = True
+        if lines and not lines[-1]: lines.pop()
+        return lines
+
+    def normalize(self, text: str) -> str:
+        """Limpia un texto suelto (sin detección de cabeceras, que necesita varias páginas)."""
+        return "\n".join(self._lines(text)) if text else ""
+
+    def _edge_indices(self, lines: list[str]) -> list[int]:
+        """Posiciones de las primeras y últimas scan_lines líneas con texto (y cortas) de la página."""
+        filled = [i for i, line in enumerate(lines[:self.scan_lines * 2]) if line][:self.scan_lines]
+        tail_start = max(len(lines) - self.scan_lines * 2, 0)
+        filled += [i for i, line in enumerate(lines[tail_start:], tail_start) if line][-self.scan_lines:]
+        return sorted(i for i in set(filled) if len(lines[i]) <= _MAX_RUNNING_LINE_CHARS)
+
+    @staticmethod
+    def _signature(line: str) -> str:
+        # Los números se ignoran: "Capítulo 3 · 41" y "Capítulo 3 · 42" son la misma cabecera.
+        return _DIGITS.sub('#', line.lower())
+
+    def iter_pages(self, pages):
+        """
+        Recibe (número, texto) de cada página y genera (número, texto limpio), omitiendo las que
+        quedan vacías. Las páginas salen con un retraso de `window` páginas (las que se miran por delante).
+        """
+        if not self.strip_running_lines:
+            for number, text in pages:
+                cleaned = self.normalize(text)
+                if cleaned: yield number, cleaned
+            return
+        counts = Counter()
+        pending, history = deque(), deque()
+
+        def release():
+            page = pending.popleft()
+            cleaned = self._clean_page(page, counts, len(history) + len(pending) + 1)
+            # La página pasa al historial; la más antigua deja de contar.
+            history.append(page[2])
+            if len(history) > self.window:
+                for signature in history.popleft():
+                    counts[signature] -= 1
+                    if counts[signature] <= 0: del counts[signature]
+            return cleaned
+
+        for number, text in pages:
+            lines = self._lines(text or "")
+            edges = self._edge_indices(lines)
+            signatures = {self._signature(lines[i]) for i in edges}
+            if any(_BARE_ROMAN.match(lines[i]) for i in edges): signatures.add(_ROMAN_SIGNATURE)
+            counts.update(signatures)
+            pending.append((number, lines, signatures))
+            if len(pending) > self.window and (page := release()): yield page
+        while pending:
+            if page := release(): yield page
+
+    def _clean_page(self, page: tuple, counts: Counter, context_pages: int) -> tuple[int, str] | None:
+        number, lines, _ = page
+        threshold = max(2, math.ceil(self.min_ratio * context_pages))
+        drop = set()
+        for i in self._edge_indices(lines):
+            # La firma la cuenta también esta página: >= 2 es que se repite en otra.
+            page_number = counts[_ROMAN_SIGNATURE] >= 2 if _BARE_ROMAN.match(lines[i]) else _PAGE_NUMBER.match(lines[i])
+            if page_number or (context_pages >= self.min_pages and counts[self._signature(lines[i])] >= threshold):
+                drop.add(i)
+        if drop:
+            kept, previous_blank = [], True
+            for i, line in enumerate(lines):
+                if i in drop or (not line and previous_blank): continue
+                kept.append(line); previous_blank = not line
+            if kept and not kept[-1]: kept.pop()
+            lines = kept
+        return (number, "\n".join(lines)) if lines else None
+
+    def normalize_document(self, pages: list[str]) -> tuple[list[str], str]:
+        """Una sola pasada sobre las páginas: devuelve las páginas limpias y el documento completo."""
+        cleaned_pages = [text for _, text in self.iter_pages(enumerate(pages, 1))]
+        return cleaned_pages, "\n\n".join(cleaned_pages)
+
+
+_default_normalizer = TextNormalizer()
 
 
 def clean_and_normalize_text(text: str) -> str:
     """
     Realiza una limpieza básica y normalización del texto extraído.
     """
-    if not text:
-        return ""
-
-    # 1. Reemplazar múltiples saltos de línea con un máximo de dos (para párrafos)
-    text = re.sub(r'\n\s*\n', '\n\n', text)
-    
-    # 2. Eliminar espacios o tabulaciones al principio y final de cada línea
-    lines = text.split('\n')
-    cleaned_lines = [line.strip() for line in lines]
-    text = '\n'.join(cleaned_lines)
-
-    # 3. Reemplazar múltiples espacios con uno solo
-    text = re.sub(r' +', ' ', text)
-    
-    # Puedes añadir más reglas de limpieza aquí si descubres patrones no deseados
-    # Por ejemplo, eliminar encabezados/pies de página si siguen un patrón predecible.
-
-    print("  -> Texto bruto limpiado y normalizado.")
-    return text.strip()
\ No newline at end of file
+    return _default_normalizer.normalize(text)
+
+
+def normalize_pages(pages):
+    """Limpia un flujo de (número, texto) de páginas quitando cabeceras, pies y números de página repetidos."""
+    return _default_normalizer.iter_pages(pages)
+
+
+def hash_pages(pages: list[str]) -> str:
+    """SHA-256 de las páginas unidas con "\\n\\n", sin construir el texto completo."""
+    digest = hashlib.sha256()
+    for i, page in enumerate(pages):
+        if i: digest.update(b"\n\n")
+        digest.update(page.encode("utf-8"))
+    return digest.hexdigest()
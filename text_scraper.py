@@ -2,31 +2,36 @@
 import requests
 import trafilatura
 
+from web_fetcher import get_web_fetcher
+
 # Ya no necesitamos requests_html, lo que simplifica las cosas
 
 def extract_text_from_url(url: str) -> str:
     """
-    Extrae el texto principal de una URL usando el método más robusto primero.
-    Trata todas las URLs como potenciales páginas web y usa 'trafilatura' para 
-    encontrar y limpiar el contenido principal.
+    Descarga una URL (con la sesión compartida y la caché HTTP de web_fetcher) y extrae su texto
+    principal con extract_text_from_html.
     """
     print(f"  -> Extrayendo contenido de: {url}")
 
     try:
-        # 1. Descargar el contenido HTML de la URL de forma segura.
-        # Usamos un user-agent para parecer un navegador normal.
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-        }
-        response = requests.get(url, headers=headers, timeout=60)
-        response.raise_for_status()
-        downloaded_html = response.text
+        downloaded_html = get_web_fetcher().fetch(url).text
+    except requests.RequestException as e:
+        print(f"    -> ERROR: No se pudo descargar la URL. {e}")
+        return ""
+    return extract_text_from_html(downloaded_html)
 
+def extract_text_from_html(downloaded_html: str) -> str:
+    """
+    Extrae el texto principal de una página ya descargada usando el método más robusto primero.
+    Trata todas las URLs como potenciales páginas web y usa 'trafilatura' para
+    encontrar y limpiar el contenido principal. Solo usa CPU: se puede ejecutar en un pool de procesos.
+    """
+    try:
         if not downloaded_html:
             print("    -> Fallo: La URL no devolvió contenido.")
             return ""
 
-        # 2. Usar 'trafilatura' para analizar el HTML y extraer el texto principal.
+        # Usar 'trafilatura' para analizar el HTML y extraer el texto principal.
         # Esta es la función clave que elimina menús, anuncios, código, etc.
         main_text = trafilatura.extract(
             downloaded_html,
@@ -44,9 +49,6 @@ def extract_text_from_url(url: str) -> str:
             # Esto es mejor que nada, pero no ideal.
             return trafilatura.extract(downloaded_html)
 
-    except requests.RequestException as e:
-        print(f"    -> ERROR: No se pudo descargar la URL. {e}")
-        return ""
     except Exception as e:
         print(f"    -> ERROR: Ocurrió un error inesperado durante el scraping. {e}")
-        return ""
\ No newline at end of file
+        return ""
@@ -0,0 +1,108 @@
+# vector_cache.py
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+import telemetry
+
+
+class _DocumentVectors:
+    """Fragmentos de un documento: ids, textos, metadatos y la matriz de embeddings (float32 contigua)."""
+
+    def __init__(self, ids: list[str], documents: list[str], metadatas: list[dict], embeddings):
+        self.ids = ids
+        self.documents = documents
+        self.metadatas = [metadata or {} for metadata in metadatas]
+        self.matrix = np.ascontiguousarray(np.asarray(embeddings, dtype=np.float32).reshape(len(ids), -1))
+        # Normas al cuadrado precalculadas: la distancia L2² de Chroma sale de un solo producto matriz-vector.
+        self.squared_norms = np.einsum("ij,ij->i", self.matrix, self.matrix)
+
+    @property
+    def nbytes(self) -> int:
+        return self.matrix.nbytes + self.squared_norms.nbytes
+
+
+class DocumentVectorCache:
+    """
+    Caché LRU de los embeddings de cada documento, cargados de Chroma la primera vez que se consultan.
+    Las búsquedas de un chat (siempre sobre el mismo documento) se resuelven por fuerza bruta con
+    NumPy, sin pasar por el cliente persistente. Devuelve los resultados con la forma de
+    collection.query y la misma métrica (L2 al cuadrado), así que ambas rutas son intercambiables.
+    """
+
+    def __init__(self, collection, max_documents: int, max_bytes: int):
+        self.collection = collection
+        self.max_documents = max_documents
+        self.max_bytes = max_bytes
+        self._entries: OrderedDict[str, _DocumentVectors] = OrderedDict()
+        self._generations: dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def get(self, source: str) -> _DocumentVectors | None:
+        with self._lock:
+            entry = self._entries.get(source)
+            if entry is not None:
+                self._entries.move_to_end(source)
+                telemetry.increment("cache_requests", cache="vectores", result="hit")
+                return entry
+            generation = self._generations.get(source, 0)
+        telemetry.increment("cache_requests", cache="vectores", result="miss")
+        start = time.perf_counter()
+        stored = self.collection.get(where={"source": source}, include=["documents", "metadatas", "embeddings"])
+        telemetry.observe("vector_cache_load_seconds", time.perf_counter() - start)
+        if not stored['ids']: return None
+        entry = _DocumentVectors(stored['ids'], stored['documents'], stored['metadatas'], stored['embeddings'])
+        with self._lock:
+            # Si el documento se reingirió mientras cargábamos, no guardamos la versión vieja.
+            if self._generations.get(source, 0) == generation:
+                self._entries[source] = entry
+                self._entries.move_to_end(source)
+                self._evict()
+        return entry
+
+    def _evict(self):
+        used = sum(entry.nbytes for entry in self._entries.values())
+        while len(self._entries) > 1 and (len(self._entries) > self.max_documents or used > self.max_bytes):
+            _, evicted = self._entries.popitem(last=False)
+            used -= evicted.nbytes
+
+    def invalidate(self, source: str | None = None):
+        """Olvida los vectores de un documento (o de todos) tras reingerirlo o borrarlo."""
+        with self._lock:
+            for key in [source] if source is not None else list(self._entries):
+                self._entries.pop(key, None)
+                self._generations[key] = self._generations.get(key, 0) + 1
+
+    def query(self, sources: list[str], query_embeddings, n_results: int) -> dict:
+        """
+        Los n_results fragmentos más cercanos a cada consulta entre los documentos indicados,
+        con las claves de collection.query: ids, documents, metadatas, distances y embeddings.
+        """
+        entries = [entry for entry in map(self.get, sources) if entry is not None]
+        results = {"ids": [], "documents": [], "metadatas": [], "distances": [], "embeddings": []}
+        if not entries: return results
+        start = time.perf_counter()
+        queries = np.asarray(query_embeddings, dtype=np.float32).reshape(len(query_embeddings), -1)
+        query_norms = np.einsum("ij,ij->i", queries, queries)
+        # ||q - v||² = ||q||² + ||v||² - 2 q·v, para todas las consultas y fragmentos a la vez.
+        distances = np.concatenate([entry.squared_norms[None, :] - 2 * (queries @ entry.matrix.T) for entry in entries], axis=1)
+        distances += query_norms[:, None]
+        np.maximum(distances, 0, out=distances)
+        offsets = np.cumsum([0] + [len(entry.ids) for entry in entries])
+        k = min(n_results, distances.shape[1])
+        for row in distances:
+            top = np.argpartition(row, k - 1)[:k] if k < len(row) else np.arange(len(row))
+            top = top[np.argsort(row[top], kind="stable")]
+            hits = []
+            for position in top:
+                owner = int(np.searchsorted(offsets, position, side="right")) - 1
+                hits.append((entries[owner], int(position - offsets[owner]), float(row[position])))
+            results["ids"].append([entry.ids[i] for entry, i, _ in hits])
+            results["documents"].append([entry.documents[i] for entry, i, _ in hits])
+            results["metadatas"].append([entry.metadatas[i] for entry, i, _ in hits])
+            results["distances"].append([distance for _, _, distance in hits])
+            results["embeddings"].append([entry.matrix[i] for entry, i, _ in hits])
+        telemetry.observe("vector_search_seconds", time.perf_counter() - start)
+        return results
@@ -0,0 +1,213 @@
+# web_fetcher.py
+import gzip
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+from xml.etree import ElementTree
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from config import (HTTP_CACHE_MAX_MB, HTTP_CACHE_PATH, URL_FETCH_TIMEOUT_SECONDS,
+                    URL_FETCH_WORKERS, URL_MAX_CONNECTIONS_PER_HOST)
+import telemetry
+
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+
+
+class FetchedPage:
+    """Una respuesta descargada, o la copia de la caché si el servidor respondió 304."""
+
+    def __init__(self, url: str, content: bytes, encoding: str | None, etag: str | None, last_modified: str | None,
+                 from_cache: bool = False):
+        self.url = url
+        self.content = content
+        self.encoding = encoding
+        self.etag = etag
+        self.last_modified = last_modified
+        self.from_cache = from_cache
+
+    @property
+    def text(self) -> str:
+        return self.content.decode(self.encoding or "utf-8", errors="replace")
+
+    @property
+    def validators(self) -> dict:
+        return {key: value for key, value in (("etag", self.etag), ("last_modified", self.last_modified)) if value}
+
+
+class HttpCache:
+    """
+    Caché en disco (SQLite) de las páginas descargadas que traen ETag o Last-Modified, con el cuerpo
+    comprimido. Con sus validadores, la siguiente descarga es una petición condicional. Expulsa
+    las páginas usadas hace más tiempo (LRU) al superar el tamaño máximo.
+    """
+
+    def __init__(self, path: str, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        with self._conn:
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS responses (
+                    url TEXT PRIMARY KEY,
+                    etag TEXT,
+                    last_modified TEXT,
+                    encoding TEXT,
+                    body BLOB NOT NULL,
+                    last_used REAL NOT NULL
+                )""")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_last_used ON responses(last_used)")
+        # Tamaño total en memoria: solo se recorre la tabla al superar el máximo.
+        self._bytes = self._total_bytes()
+
+    def _total_bytes(self) -> int:
+        return self._conn.execute("SELECT COALESCE(SUM(LENGTH(body)), 0) FROM responses").fetchone()[0]
+
+    def get(self, url: str) -> FetchedPage | None:
+        with self._lock:
+            row = self._conn.execute("SELECT etag, last_modified, encoding, body FROM responses WHERE url = ?", (url,)).fetchone()
+        if not row: return None
+        etag, last_modified, encoding, body = row
+        return FetchedPage(url, zlib.decompress(body), encoding, etag, last_modified, from_cache=True)
+
+    def touch(self, url: str):
+        with self._lock, self._conn:
+            self._conn.execute("UPDATE responses SET last_used = ? WHERE url = ?", (time.time(), url))
+
+    def put(self, page: FetchedPage):
+        body = zlib.compress(page.content)
+        with self._lock, self._conn:
+            replaced = self._conn.execute("SELECT LENGTH(body) FROM responses WHERE url = ?", (page.url,)).fetchone()
+            self._conn.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)",
+                               (page.url, page.etag, page.last_modified, page.encoding, body, time.time()))
+            self._bytes += len(body) - (replaced[0] if replaced else 0)
+            self._evict()
+
+    def _evict(self):
+        if self._bytes <= self.max_bytes: return
+        # Al superar el máximo se recuenta (otro proceso puede haber escrito) y se borra por tandas en orden LRU.
+        self._bytes = self._total_bytes()
+        while self._bytes > self.max_bytes:
+            victims = self._conn.execute("SELECT url, LENGTH(body) FROM responses ORDER BY last_used ASC LIMIT 32").fetchall()
+            if not victims: return
+            for url, size in victims:
+                if self._bytes <= self.max_bytes: return
+                self._conn.execute("DELETE FROM responses WHERE url = ?", (url,))
+                self._bytes -= size
+
+
+def _parse_url_list(page: FetchedPage) -> tuple[bool, list[str]]:
+    """URLs de un sitemap XML (¿es un índice de sitemaps?, sus <loc>) o de una lista de enlaces en texto plano."""
+    content = gzip.decompress(page.content) if page.content[:2] == b"\x1f\x8b" else page.content
+    try:
+        root = ElementTree.fromstring(content)
+    except ElementTree.ParseError:
+        lines = (line.strip() for line in content.decode(page.encoding or "utf-8", errors="replace").splitlines())
+        return False, [line for line in lines if line.startswith(("http://", "https://"))]
+    locs = [element.text.strip() for element in root.iter() if element.tag.endswith("loc") and element.text]
+    return root.tag.endswith("sitemapindex"), locs
+
+
+class WebFetcher:
+    """
+    Descargas HTTP de la ingesta de URLs: una sesión compartida con su pool de conexiones
+    (reutilizadas entre páginas del mismo servidor), como mucho max_per_host descargas
+    simultáneas por servidor y peticiones condicionales (If-None-Match / If-Modified-Since)
+    para las páginas que ya están en la caché: si no han cambiado, el 304 llega sin cuerpo.
+    """
+
+    def __init__(self, cache: HttpCache | None, max_per_host: int = URL_MAX_CONNECTIONS_PER_HOST,
+                 workers: int = URL_FETCH_WORKERS, timeout: float = URL_FETCH_TIMEOUT_SECONDS):
+        self.cache = cache
+        self.max_per_host = max_per_host
+        self.workers = workers
+        self.timeout = timeout
+        # La sesión no guarda estado entre peticiones (sin cookies de login): la comparten todos los hilos.
+        self.session = requests.Session()
+        self.session.headers["User-Agent"] = USER_AGENT
+        adapter = HTTPAdapter(pool_connections=32, pool_maxsize=max_per_host)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self._host_slots: dict[str, threading.BoundedSemaphore] = {}
+        self._host_slots_lock = threading.Lock()
+
+    @contextmanager
+    def _host_slot(self, url: str):
+        host = urlsplit(url).netloc
+        with self._host_slots_lock:
+            slot = self._host_slots.setdefault(host, threading.BoundedSemaphore(self.max_per_host))
+        with slot:
+            yield
+
+    def fetch(self, url: str) -> FetchedPage:
+        """Descarga una URL (condicional si está en la caché). Lanza requests.RequestException si falla."""
+        cached = self.cache.get(url) if self.cache else None
+        headers = {}
+        if cached and cached.etag: headers["If-None-Match"] = cached.etag
+        if cached and cached.last_modified: headers["If-Modified-Since"] = cached.last_modified
+        start = time.perf_counter()
+        with self._host_slot(url):
+            response = self.session.get(url, headers=headers, timeout=self.timeout)
+        telemetry.observe("http_fetch_seconds", time.perf_counter() - start)
+        if response.status_code == 304 and cached:
+            telemetry.increment("cache_requests", cache="http", result="hit")
+            self.cache.touch(url)
+            return cached
+        response.raise_for_status()
+        telemetry.increment("cache_requests", cache="http", result="miss")
+        page = FetchedPage(url, response.content, response.encoding or response.apparent_encoding,
+                           response.headers.get("ETag"), response.headers.get("Last-Modified"))
+        if self.cache and page.validators: self.cache.put(page)
+        return page
+
+    def fetch_many(self, urls: list[str]) -> list[tuple[str, FetchedPage | Exception]]:
+        """Descarga varias URLs a la vez. Devuelve (url, página o error) en el mismo orden."""
+        def fetch(url):
+            try:
+                return url, self.fetch(url)
+            except Exception as e:
+                return url, e
+        if not urls: return []
+        with ThreadPoolExecutor(max_workers=min(self.workers, len(urls)), thread_name_prefix="descarga") as pool:
+            return list(pool.map(fetch, urls))
+
+    def expand_url_list(self, url: str, max_depth: int = 3) -> list[str]:
+        """
+        Páginas que enumera un sitemap (también índices de sitemaps, anidados hasta max_depth, y
+        sitemaps .xml.gz) o una lista de enlaces en texto plano, sin duplicados y en orden.
+        """
+        urls, pending = [], [url]
+        for _ in range(max_depth):
+            children = []
+            for listed_url, page in self.fetch_many(pending):
+                if isinstance(page, Exception):
+                    print(f"  -> ⚠️ No se pudo descargar la lista de URLs '{listed_url}': {page}")
+                    continue
+                is_index, locs = _parse_url_list(page)
+                (children if is_index else urls).extend(locs)
+            if not children: break
+            pending = children
+        return list(dict.fromkeys(urls))
+
+
+_fetcher = None
+_fetcher_pid = None
+_fetcher_lock = threading.Lock()
+
+
+def get_web_fetcher() -> WebFetcher:
+    """Descargador común del proceso (uno por proceso: la conexión SQLite de la caché no sobrevive a un fork)."""
+    global _fetcher, _fetcher_pid
+    with _fetcher_lock:
+        if _fetcher is None or _fetcher_pid != os.getpid():
+            _fetcher = WebFetcher(HttpCache(HTTP_CACHE_PATH, HTTP_CACHE_MAX_MB * 1024 * 1024))
+            _fetcher_pid = os.getpid()
+        return _fetcher